@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks of each stage of the object set pipeline, timed and memory profiled
+separately on the checked in fixtures in benchmark_fixtures (compiled robot
+files for a range of finger segments) and the set yamls in object_sets, so no
+MuJoCo or ROS install is needed:
+
+  python3 benchmark.py                          # every stage, default sets and segments
+  python3 benchmark.py --stages split tasks --sets set_test set_multi_9540
+  python3 benchmark.py --quick                  # only set_test and 8 segments
+
+Every result is added to a JSON history, and the run fails (exit code 1) if a
+stage takes longer or uses more memory than the median of its previous runs on
+this machine by more than the threshold. After changing the robot xacros,
+regenerate the fixtures with --make-fixtures, which needs MuJoCo bin/compile
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import yaml
+
+filepath = os.path.dirname(os.path.abspath(__file__))
+description_path = os.path.dirname(filepath)
+sys.path.insert(0, filepath + "/object_sets")
+
+from build_object_set import build_catalogue, save_object_xml
+from xml_script import (tag_robot_files, write_task_files, random_object_split,
+                        load_object_trees, split_object_set, max_objects_per_task)
+from set_sync import sync_set, remove_set
+
+# ----- user defined options ----- #
+
+# compiled robot files for each number of segments, in folders N{segments}
+fixture_folder = "benchmark_fixtures"
+robot_files = ["gripper_mujoco.xml", "panda_mujoco.xml", "panda_and_gripper_mujoco.xml",
+               "gripper_task.xml"]
+
+# default parameters of the stages, fixtures must exist for every segment number
+default_sets = ["set_test", "set_fullset_800", "set_fullset_1500", "set_multi_9540"]
+default_segments = [3, 5, 8, 10, 20, 30]
+
+# the copy stage publishes a set with the task files of one gripper
+copy_segments = 8
+
+# fixed seed for random densities, frictions and splits, so every run does the same work
+seed = 1234
+
+# previous results, and how many of them the baseline of each stage is taken from
+history_file = "build_cache/benchmark_history.json"
+baseline_runs = 5
+
+# ----- command line options ----- #
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--stages", nargs="*", default=None) # which stages to run, default all
+parser.add_argument("--sets", nargs="*", default=default_sets) # which set yamls (without .yaml)
+parser.add_argument("--segments", nargs="*", type=int, default=default_segments)
+parser.add_argument("--quick", action="store_true", default=False) # only set_test and 8 segments
+parser.add_argument("--repeats", type=int, default=3) # the best time of this many runs is kept
+parser.add_argument("--threshold", type=float, default=0.25) # fractional slowdown which fails
+parser.add_argument("--min-seconds", type=float, default=0.01) # smaller slowdowns never fail
+parser.add_argument("--min-mb", type=float, default=1.0) # smaller memory increases never fail
+parser.add_argument("--history", default=None) # default is build_cache/benchmark_history.json
+parser.add_argument("--no-save", action="store_true", default=False) # do not add to the history
+parser.add_argument("--make-fixtures", action="store_true", default=False) # regenerate fixtures
+parser.add_argument("--compiler", default=None) # MuJoCo bin/compile, for --make-fixtures
+
+# ----- helper functions ----- #
+
+def load_set(set_name):
+  """
+  Load a set yaml from object_sets, with a fixed seed so every run is the same
+  (some older set yamls also lack random_order, so shuffle them as default)
+  """
+  with open(filepath + "/object_sets/" + set_name + ".yaml") as file:
+    object_details = yaml.safe_load(file)
+  object_details["settings"]["fixed_random_seed"] = seed
+  object_details["settings"].setdefault("random_order", True)
+  return object_details
+
+def load_gripper_details(segments):
+  """
+  Load the gripper config, with the given number of segments
+  """
+  with open(description_path + "/config/gripper.yaml") as file:
+    gripper_details = yaml.safe_load(file)
+  gripper_details["gripper_config"]["num_segments"] = segments
+  return gripper_details
+
+def make_xacro_tree(work_dir, gripper_details):
+  """
+  Create a tree in work_dir where the robot xacros can be expanded with a
+  private config file. The xacros are symlinked into real folders, so relative
+  paths resolve inside work_dir (as in build_multi_segment_set.py)
+  """
+  for source, target in [(description_path + "/xacro", work_dir + "/xacro"),
+                         (filepath + "/xacro", work_dir + "/mujoco/xacro")]:
+    os.makedirs(target)
+    for name in os.listdir(source):
+      os.symlink(source + "/" + name, target + "/" + name)
+  os.makedirs(work_dir + "/config")
+  with open(work_dir + "/config/gripper.yaml", "w") as outfile:
+    yaml.dump(gripper_details, outfile, default_flow_style=False)
+  return sorted([work_dir + "/mujoco/xacro/" + x for x in os.listdir(filepath + "/xacro")
+                 if x.endswith(".urdf.xacro")])
+
+def copy_fixtures(segments, build_dir):
+  """
+  Unpack the compiled robot files for a number of segments into build_dir
+  """
+  folder = filepath + "/" + fixture_folder + f"/N{segments}"
+  if not os.path.isdir(folder):
+    raise RuntimeError(f"no robot fixtures for {segments} segments in {folder}, "
+                       "create them with --make-fixtures")
+  os.makedirs(build_dir, exist_ok=True)
+  for name in robot_files:
+    with gzip.open(folder + "/" + name + ".gz") as infile, open(build_dir + "/" + name, "wb") as outfile:
+      shutil.copyfileobj(infile, outfile)
+
+def make_objects(set_name, objects_dir):
+  """
+  Build the catalogue of a set and write its object files into objects_dir
+  """
+  os.makedirs(objects_dir, exist_ok=True)
+  catalogue = build_catalogue(load_set(set_name), rng=np.random.RandomState(seed),
+                              mesh_dir=filepath + "/build/meshes_mujoco")
+  save_object_xml(catalogue, objects_dir)
+
+def get_splits(objects_dir):
+  """
+  Split the objects in objects_dir into tasks, returning only the split records
+  """
+  return [split for elements, split in random_object_split(
+    *load_object_trees(objects_dir), max_objects_per_task, rng=np.random.RandomState(seed))]
+
+# ----- stages ----- #
+
+# each stage prepares its inputs in work_dir, returning a function to reset
+# them before each run (or None) and the function which is timed
+
+def stage_xacro(params, work_dir):
+  """
+  Expand the robot xacros into urdfs, in-process as build_graph.py does
+  """
+  from xacro_expand import expand_xacro
+  gripper_details = load_gripper_details(params["segments"])
+  xacros = make_xacro_tree(work_dir, gripper_details)
+  def run():
+    for filename in xacros:
+      expand_xacro(filename, root_dir=work_dir + "/mujoco", config=gripper_details)
+  return None, run
+
+def stage_mjcf(params, work_dir):
+  """
+  Generate the gripper_task model directly with gripper_mjcf.py
+  """
+  from gripper_mjcf import generate_mjcf
+  gripper_details = load_gripper_details(params["segments"])
+  def run(): generate_mjcf(gripper_details, work_dir + "/gripper_task.xml")
+  return None, run
+
+def stage_catalogue(params, work_dir):
+  """
+  Generate the object catalogue of a set with build_object_set.py
+  """
+  object_details = load_set(params["set"])
+  def run():
+    build_catalogue(object_details, rng=np.random.RandomState(seed),
+                    mesh_dir=filepath + "/build/meshes_mujoco")
+  return None, run
+
+def stage_tag(params, work_dir):
+  """
+  Tag the compiled robot files with xml_script.py
+  """
+  gripper_details = load_gripper_details(params["segments"])
+  def reset(): copy_fixtures(params["segments"], work_dir)
+  def run(): tag_robot_files(gripper_details, work_dir)
+  return reset, run
+
+def stage_split(params, work_dir):
+  """
+  Randomly split the objects of a set into tasks
+  """
+  make_objects(params["set"], work_dir + "/objects")
+  object_trees = load_object_trees(work_dir + "/objects")
+  def run():
+    for elements, split in random_object_split(*object_trees, max_objects_per_task,
+                                               rng=np.random.RandomState(seed)):
+      pass
+  return None, run
+
+def stage_tasks(params, work_dir):
+  """
+  Write the task and keyframe files of every split of a set, for one gripper
+  """
+  copy_fixtures(params["segments"], work_dir)
+  robot_xml, task_tree = tag_robot_files(load_gripper_details(params["segments"]), work_dir)
+  make_objects(params["set"], work_dir + "/objects")
+  splits = get_splits(work_dir + "/objects")
+  def run(): write_task_files(task_tree, robot_xml, splits, work_dir, task_folder="gripper")
+  return None, run
+
+def stage_delta(params, work_dir):
+  """
+  Derive the task files of a wider finger from those of one gripper, as with
+  WIDTH_DELTAS=yes, instead of building them again
+  """
+  from width_delta import derive_task_folder
+  gripper_details = load_gripper_details(params["segments"])
+  copy_fixtures(params["segments"], work_dir)
+  robot_xml, task_tree = tag_robot_files(gripper_details, work_dir)
+  make_objects(params["set"], work_dir + "/objects")
+  write_task_files(task_tree, robot_xml, get_splits(work_dir + "/objects"), work_dir,
+                   task_folder="gripper")
+  with open(work_dir + "/gripper/gripper.yaml", "w") as outfile:
+    yaml.dump(gripper_details, outfile, default_flow_style=False)
+  wider_details = load_gripper_details(params["segments"])
+  wider_details["gripper_params"]["finger_width"] += 4e-3
+  def run(): derive_task_folder(work_dir + "/gripper", work_dir + "/gripper_wider", wider_details)
+  return None, run
+
+def stage_copy(params, work_dir):
+  """
+  Publish a built set (objects, one gripper and the meshes) into a new folder
+  """
+  source = work_dir + "/build"
+  copy_fixtures(copy_segments, source)
+  robot_xml, task_tree = tag_robot_files(load_gripper_details(copy_segments), source)
+  make_objects(params["set"], source + "/objects")
+  splits = split_object_set(load_set(params["set"]), source + "/objects")
+  write_task_files(task_tree, robot_xml, splits, source, task_folder="gripper")
+  for name in robot_files: os.remove(source + "/" + name)
+  shutil.copytree(filepath + "/build/meshes_mujoco", source + "/meshes_mujoco")
+  def reset():
+    remove_set(work_dir + "/set")
+    if os.path.exists(work_dir + "/mesh_store"): shutil.rmtree(work_dir + "/mesh_store")
+  def run(): sync_set(source, work_dir + "/set", work_dir + "/mesh_store")
+  return reset, run
+
+# every stage, with the parameters it takes
+stages = {
+  "xacro": (stage_xacro, ["segments"]),
+  "mjcf": (stage_mjcf, ["segments"]),
+  "catalogue": (stage_catalogue, ["set"]),
+  "tag": (stage_tag, ["segments"]),
+  "split": (stage_split, ["set"]),
+  "tasks": (stage_tasks, ["set", "segments"]),
+  "delta": (stage_delta, ["set", "segments"]),
+  "copy": (stage_copy, ["set"]),
+}
+
+# ----- running and comparing ----- #
+
+def get_maxrss_mb():
+  """
+  Get the peak resident memory of this process so far, in MB
+  """
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+def measure(stage, params, repeats):
+  """
+  Run one stage in this (forked) process, keeping the best time of repeats
+  runs, the growth in peak resident memory over them, and the peak python
+  memory of one more run (traced separately, as tracing slows the stage)
+  """
+
+  work_dir = tempfile.mkdtemp(prefix=f"benchmark_{stage}_")
+  try:
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink), \
+         contextlib.redirect_stderr(sink):
+      reset, run = stages[stage][0](params, work_dir)
+      times = []
+      rss_before = get_maxrss_mb()
+      for r in range(repeats):
+        if reset is not None: reset()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+      rss_growth = get_maxrss_mb() - rss_before
+      if reset is not None: reset()
+      tracemalloc.start()
+      run()
+      python_peak = tracemalloc.get_traced_memory()[1] / 1e6
+      tracemalloc.stop()
+  finally:
+    shutil.rmtree(work_dir)
+
+  return {
+    "seconds": round(min(times), 5),
+    "mean_seconds": round(float(np.mean(times)), 5),
+    "python_peak_mb": round(python_peak, 3),
+    "rss_growth_mb": round(rss_growth, 3),
+  }
+
+def get_key(result):
+  """
+  Identify the stage and parameters of a result, to compare it across runs
+  """
+  return (result["stage"], result.get("set"), result.get("segments"))
+
+def get_baselines(history, host):
+  """
+  Get the median seconds and python peak memory of each stage, over its most
+  recent baseline_runs results on this host
+  """
+  previous = {}
+  for run in history:
+    if run["host"] != host: continue
+    for result in run["results"]:
+      previous.setdefault(get_key(result), []).append(result)
+  baselines = {}
+  for key, results in previous.items():
+    results = results[-baseline_runs:]
+    baselines[key] = {x: float(np.median([r[x] for r in results]))
+                      for x in ["seconds", "python_peak_mb"]}
+  return baselines
+
+def check_regression(result, baseline):
+  """
+  Get the reasons a result has regressed from its baseline, if any
+  """
+  reasons = []
+  if baseline is None: return reasons
+  limits = {"seconds": args.min_seconds, "python_peak_mb": args.min_mb}
+  for quantity, minimum in limits.items():
+    increase = result[quantity] - baseline[quantity]
+    if increase > minimum and increase > args.threshold * baseline[quantity]:
+      reasons.append(f"{quantity} {baseline[quantity]:.3f} -> {result[quantity]:.3f}")
+  return reasons
+
+def make_fixtures(segments, compiler):
+  """
+  Regenerate the compiled robot fixtures for each number of segments, by
+  expanding the xacros and compiling the urdfs as the Makefile does
+  """
+  from xacro_expand import expand_xacro
+  for N in segments:
+    work_dir = tempfile.mkdtemp(prefix="benchmark_fixtures_")
+    try:
+      gripper_details = load_gripper_details(N)
+      xacros = make_xacro_tree(work_dir, gripper_details)
+      build_dir = work_dir + "/mujoco/build"
+      os.makedirs(build_dir)
+      os.symlink(filepath + "/build/meshes_mujoco", build_dir + "/meshes_mujoco")
+      folder = filepath + "/" + fixture_folder + f"/N{N}"
+      os.makedirs(folder, exist_ok=True)
+      for filename in xacros:
+        name = os.path.basename(filename)[:-len(".urdf.xacro")]
+        with open(build_dir + "/" + name + ".urdf", "w") as outfile:
+          outfile.write(expand_xacro(filename, root_dir=work_dir + "/mujoco", config=gripper_details))
+        subprocess.run([compiler, name + ".urdf", name + ".xml"], cwd=build_dir, check=True)
+        with open(build_dir + "/" + name + ".xml", "rb") as infile, \
+             gzip.GzipFile(folder + "/" + name + ".xml.gz", "wb", mtime=0) as outfile:
+          shutil.copyfileobj(infile, outfile)
+    finally:
+      shutil.rmtree(work_dir)
+    print(f"Created fixtures for {N} segments in {folder}")
+
+if __name__ == "__main__":
+
+  args = parser.parse_args()
+
+  if args.make_fixtures:
+    if args.compiler is None:
+      raise RuntimeError("--make-fixtures needs --compiler, the path to MuJoCo bin/compile")
+    make_fixtures(args.segments, os.path.abspath(args.compiler))
+    exit()
+
+  if args.quick:
+    args.sets = ["set_test"]
+    args.segments = [copy_segments]
+
+  selected = stages.keys() if args.stages is None else args.stages
+  for stage in selected:
+    if stage not in stages:
+      raise RuntimeError(f"unknown stage '{stage}', choose from {list(stages.keys())}")
+
+  history_path = filepath + "/" + history_file if args.history is None else args.history
+  history = []
+  if os.path.exists(history_path):
+    with open(history_path) as file:
+      history = json.load(file)
+  host = platform.node()
+  baselines = get_baselines(history, host)
+
+  print(f"{'stage':<11}{'set':<20}{'N':>4}{'seconds':>10}{'baseline':>10}"
+        f"{'py MB':>9}{'rss MB':>9}  result")
+
+  results = []
+  regressions = []
+  for stage in selected:
+    grid = [{}]
+    for param in stages[stage][1]:
+      values = args.sets if param == "set" else args.segments
+      grid = [dict(x, **{param: v}) for x in grid for v in values]
+
+    for params in grid:
+
+      # a fresh process for each, so stages do not share memory or caches
+      with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork")) as pool:
+        result = dict(stage=stage, **params, **pool.submit(measure, stage, params, args.repeats).result())
+      results.append(result)
+
+      baseline = baselines.get(get_key(result))
+      reasons = check_regression(result, baseline)
+      if reasons: regressions.append((result, reasons))
+      print(f"{stage:<11}{params.get('set', '-'):<20}{params.get('segments', '-'):>4}"
+            f"{result['seconds']:>10.3f}"
+            f"{'-' if baseline is None else format(baseline['seconds'], '.3f'):>10}"
+            f"{result['python_peak_mb']:>9.1f}{result['rss_growth_mb']:>9.1f}  "
+            f"{'REGRESSED' if reasons else 'new' if baseline is None else 'ok'}")
+
+  if not args.no_save:
+    history.append({
+      "date": datetime.now().strftime("%d-%m-%y_%H-%M-%S"),
+      "host": host,
+      "python": platform.python_version(),
+      "repeats": args.repeats,
+      "results": results,
+    })
+    os.makedirs(os.path.dirname(history_path), exist_ok=True)
+    with open(history_path + ".incomplete", "w") as outfile:
+      json.dump(history, outfile, indent=1)
+    os.replace(history_path + ".incomplete", history_path)
+    print(f"\nResults added to {history_path}")
+
+  if regressions:
+    print(f"\n{len(regressions)} stages regressed by more than {100 * args.threshold:.0f}%:")
+    for result, reasons in regressions:
+      name = " ".join([str(x) for x in get_key(result) if x is not None])
+      print(f"  {name}: {', '.join(reasons)}")
+    exit(1)
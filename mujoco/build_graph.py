@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+
+"""
+Dependency graph build of the mujoco files, which replaces the chain of phony
+make rules. Each step of the build is a node declaring the files it reads and
+writes, for every robot X in xacro/ and the objects of the set:
+
+  xacro/X.urdf.xacro -> urdf/X.urdf -> build/X.xml -> build/task (task files)
+  define_objects.yaml -> objects.xml, assets.xml... -> splits.yaml
+
+The robot xacros are expanded inside this process (see xacro_expand.py) with
+the gripper config from memory, and with generate_mjcf the gripper_task model
+is written directly by gripper_mjcf.py instead of compiling its urdf. The other
+nodes run shell commands. A node only runs if one of its outputs is missing, or if its command or the
+contents of its inputs have changed since it last succeeded (the digests are
+kept in a state file). Targets select the nodes to run, so making task files
+no longer builds the panda models, and independent nodes run side by side
+within one budget of jobs. The nodes of many variants can be added to one
+graph, so a parallel sweep never runs more than that many commands at once:
+
+  python3 build_graph.py tasks --task-folder gripper_N8_28 --gen-objects 0 --jobs 4
+
+Targets are node names, such as tasks and objects, or the aliases urdf, mjcf
+and split_objects, see --list.
+"""
+
+import os
+import glob
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+import yaml
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from set_sync import get_file_digest
+from build_trace import span, get_env
+from xacro_expand import expand_xacro
+import gripper_mjcf
+
+# where the graph of the mujoco folder records the digests of its last build
+graph_state_file = "build_cache/build_graph.json"
+
+# default caches of build_object_set.py (see Makefile)
+mesh_cache_folder = "build_cache/meshes"
+catalogue_cache_folder = "build_cache/catalogue"
+
+class Node:
+  """
+  One step of the build, a shell command run in cwd which reads inputs and
+  writes outputs (paths relative to cwd, outputs can be folders). If an action
+  is given that python function is called instead, and the command only
+  describes it (it is still part of the signature). The outputs
+  of an intermediate node are deleted after a build unless it is a target, and
+  are only remade when a node which reads them has to run. Outputs of other
+  nodes which this node edits in place are given as updates, it runs again
+  whenever one of their producers has run
+  """
+
+  def __init__(self, name, command, inputs=(), outputs=(), cwd=".", stage=None,
+               intermediate=False, always=False, labels=None, action=None, updates=()):
+    self.name = name
+    self.command = command
+    self.action = action
+    self.cwd = os.path.abspath(cwd)
+    self.inputs = [os.path.normpath(os.path.join(self.cwd, x)) for x in inputs]
+    self.outputs = [os.path.normpath(os.path.join(self.cwd, x)) for x in outputs]
+    self.updates = [os.path.normpath(os.path.join(self.cwd, x)) for x in updates]
+    self.stage = stage or name # name of its trace spans, shared by every variant
+    self.intermediate = intermediate
+    self.always = always # eg for inputs not known in advance
+    self.labels = labels or {}
+
+class BuildGraph:
+  """
+  A graph of nodes, connected where the output of one node is the input of
+  another, which builds targets running only the nodes which are out of date
+  """
+
+  def __init__(self, state_path=None):
+    self.nodes = {}
+    self.aliases = {}
+    self.producers = {}
+    self.state_path = state_path
+    self.state = {}
+    if state_path is not None and os.path.exists(state_path):
+      with open(state_path) as file:
+        self.state = json.load(file)
+
+  def add(self, node):
+    """
+    Add a node, no two nodes may write the same output
+    """
+    if node.name in self.nodes:
+      raise RuntimeError(f"build graph already has a node named '{node.name}'")
+    for x in node.outputs:
+      if x in self.producers:
+        raise RuntimeError(f"{x} is an output of both '{self.producers[x]}' and '{node.name}'")
+      self.producers[x] = node.name
+    self.nodes[node.name] = node
+    return node
+
+  def alias(self, name, targets):
+    """
+    Add a name which builds every one of targets
+    """
+    self.aliases[name] = list(targets)
+
+  def get_deps(self, node):
+    """
+    Get the names of the nodes which make the inputs of node
+    """
+    return list(dict.fromkeys([self.producers[x] for x in node.inputs + node.updates
+                               if x in self.producers]))
+
+  def expand(self, targets):
+    """
+    Get the node names of targets, replacing aliases
+    """
+    names = []
+    for x in targets:
+      if x in self.aliases: names += self.expand(self.aliases[x])
+      elif x in self.nodes: names.append(x)
+      else: raise RuntimeError(f"no build graph node or alias named '{x}', see --list")
+    return list(dict.fromkeys(names))
+
+  def select(self, targets):
+    """
+    Get the nodes needed to build targets in dependency order, checking that
+    every input is either an existing file or made by a node
+    """
+    order = []
+    visiting = []
+
+    def visit(name):
+      if name in order: return
+      if name in visiting:
+        raise RuntimeError(f"build graph has a cycle: {' -> '.join(visiting + [name])}")
+      visiting.append(name)
+      node = self.nodes[name]
+      for x in node.inputs:
+        if x not in self.producers and not os.path.exists(x):
+          raise RuntimeError(f"no node makes {x}, needed by '{name}'")
+      for dep in self.get_deps(node): visit(dep)
+      visiting.pop()
+      order.append(name)
+
+    for name in self.expand(targets): visit(name)
+    return order
+
+  def get_digest(self, path):
+    """
+    Get the digest of an input file, or for a deleted intermediate file the
+    digest it had when it was made
+    """
+    if os.path.isfile(path): return get_file_digest(path)
+    if path in self.producers:
+      return self.state.get(self.producers[path], {}).get("outputs", {}).get(path, "")
+    return ""
+
+  def get_signature(self, node):
+    """
+    Get a digest of the command of node and the contents of its inputs, and
+    when the producers of the files it updates last ran
+    """
+    h = hashlib.sha256(node.command.encode())
+    for x in node.inputs:
+      h.update(f"{x} {self.get_digest(x)}\n".encode())
+    for x in node.updates:
+      h.update(f"{x} {self.state.get(self.producers.get(x), {}).get('ran', '')}\n".encode())
+    return h.hexdigest()
+
+  def is_up_to_date(self, node, targeted):
+    """
+    Are the outputs of node current, deleted intermediates count as current
+    unless they are targeted
+    """
+    if node.always: return False
+    if node.intermediate and not targeted: missing = []
+    else: missing = [x for x in node.outputs if not os.path.exists(x)]
+    return len(missing) == 0 and self.state.get(node.name, {}).get("signature") == self.get_signature(node)
+
+  def run_node(self, node):
+    """
+    Run the command (or action) of node, returning its exit code, its captured
+    output (so that parallel nodes do not interleave their printing) and how
+    many seconds it took
+    """
+    for x in node.outputs:
+      os.makedirs(os.path.dirname(x), exist_ok=True)
+    start = time.time()
+    with span(node.stage, category="subprocess" if node.action is None else "python",
+              **node.labels) as s:
+      if node.action is None:
+        process = subprocess.Popen(node.command, shell=True, cwd=node.cwd, env=get_env(**node.labels),
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        with process.stdout: output = process.stdout.read()
+
+        # reaped here for the cpu time of this subprocess alone, as the span only
+        # measures this thread, which also misses the bytes the subprocess wrote
+        _, status, usage = os.wait4(process.pid, 0)
+        code = process.returncode = os.waitstatus_to_exitcode(status)
+        s["cpu"] += usage.ru_utime + usage.ru_stime
+        s["bytes"] += sum([os.path.getsize(x) for x in node.outputs if os.path.isfile(x)])
+      else:
+        try:
+          node.action()
+          code, output = 0, ""
+        except Exception as error:
+          code, output = 1, f"{node.command}: {type(error).__name__}: {error}"
+    return code, output, time.time() - start
+
+  def forget(self, names):
+    """
+    Forget the last build of nodes whose outputs were replaced outside the
+    graph (eg restored from a cache), so that they run the next time
+    """
+    for name in names: self.state.pop(name, None)
+    self.save_state()
+
+  def save_state(self):
+    """
+    Save the digests of every node which has run
+    """
+    if self.state_path is None: return
+    os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+    with open(self.state_path + ".incomplete", "w") as outfile:
+      json.dump(self.state, outfile, indent=1)
+    os.replace(self.state_path + ".incomplete", self.state_path)
+
+  def build(self, targets, jobs=1, callback=None, dry_run=False):
+    """
+    Build targets, running at most jobs nodes at once. Each node is checked
+    once its dependencies have finished, and skipped if it is up to date. The
+    callback is called with the name of every node once it has finished or
+    been skipped. Returns the seconds taken by each node that ran
+    """
+
+    order = self.select(targets)
+    targeted = self.expand(targets)
+    consumers = {name: [] for name in order}
+    waiting = {}
+    for name in order:
+      waiting[name] = self.get_deps(self.nodes[name])
+      for dep in waiting[name]: consumers[dep].append(name)
+
+    ready = [name for name in order if len(waiting[name]) == 0]
+    forced = []
+    ran = {}
+    running = {}
+    failed = None
+
+    def finish(name):
+      if callback is not None: callback(name)
+      for x in consumers[name]:
+        if name in waiting[x]:
+          waiting[x].remove(name)
+          if len(waiting[x]) == 0: ready.append(x)
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+      while len(ready) + len(running) > 0:
+
+        # start every ready node which is out of date, while there is budget
+        while len(ready) > 0 and len(running) < jobs and failed is None:
+          name = ready.pop(0)
+          node = self.nodes[name]
+          if (name not in forced and self.is_up_to_date(node, name in targeted)
+              and not (dry_run and any([x in ran for x in self.get_deps(node)]))):
+            finish(name)
+            continue
+
+          # deleted intermediates are remade before the nodes which read them
+          remake = [self.producers[x] for x in node.inputs
+                    if x in self.producers and not os.path.exists(x)
+                    and self.producers[x] not in ran and not dry_run]
+          if len(remake) > 0:
+            waiting[name] = list(dict.fromkeys(remake))
+            for x in waiting[name]:
+              if x not in forced:
+                forced.append(x)
+                ready.append(x)
+            continue
+
+          print(node.command)
+          if dry_run:
+            ran[name] = 0
+            finish(name)
+            continue
+          running[pool.submit(self.run_node, node)] = name
+
+        if len(running) == 0:
+          if failed is not None: break
+          continue
+
+        # wait for a node to finish
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+          name = running.pop(future)
+          node = self.nodes[name]
+          code, output, seconds = future.result()
+          if output != "": print(output, end="" if output.endswith("\n") else "\n")
+          if code != 0:
+            self.state.pop(name, None)
+            if failed is None: failed = (name, code)
+            continue
+          self.state[name] = {
+            "signature": self.get_signature(node),
+            "outputs": {x: get_file_digest(x) for x in node.outputs if os.path.isfile(x)},
+            "ran": time.time_ns(),
+          }
+          ran[name] = seconds
+          finish(name)
+
+    if not dry_run: self.save_state()
+
+    if failed is not None:
+      raise RuntimeError(f"build step '{failed[0]}' failed with exit code {failed[1]}")
+
+    # intermediate files are removed unless they were asked for
+    if not dry_run:
+      for name in order:
+        if self.nodes[name].intermediate and name not in targeted:
+          for x in self.nodes[name].outputs:
+            if os.path.isfile(x): os.remove(x)
+
+    return ran
+
+def get_object_meshes(object_details):
+  """
+  Get the mesh files used by the objects in a set yaml, relative to the
+  meshes_mujoco folder, following the naming in build_object_set.py
+  """
+  meshes = []
+  for object in object_details:
+    if object == "settings": continue
+    elif object_details[object]["include"] is False: continue
+    name_root = object_details[object]["name_root"]
+    fillet = object_details[object]["fillet"]
+    if fillet["used"]:
+      fillet_num = int((fillet["max"] - fillet["min"]) / fillet["step"]) + 1
+      names = [f"{name_root}_{fillet['min'] + j * fillet['step']}" for j in range(fillet_num)]
+    else:
+      names = [name_root]
+    for name in names:
+      mesh = f"models/{object_details[object]['path']}/{name}.STL"
+      if mesh not in meshes: meshes.append(mesh)
+  return sorted(meshes)
+
+def add_mujoco_nodes(graph, mujoco_dir, build_folder="build", task_folder="task",
+                     objects_folder="objects", python="python3", compiler="compile",
+                     gen_objects=True, shared_robot=False, mjb=False, mjb_compiler=None,
+                     bundle=False, mesh_cache=None, catalogue_cache=None, prefix="",
+                     labels=None, config=None, generate_mjcf=False):
+  """
+  Add the nodes which build the mujoco files of mujoco_dir to graph, their
+  names and aliases starting with prefix. Task files only need the gripper_task
+  model, the other robot models are made by the mjcf alias. Without
+  gen_objects there are no object nodes, the task files use the existing split.
+  A config dictionary is given to the xacros in place of reading the config
+  file, it must match that file, which is still an input of every node. With
+  generate_mjcf the gripper_task model skips xacro and the compiler
+  """
+
+  labels = labels or {}
+  objects_dir = f"{build_folder}/{objects_folder}"
+  mesh_cache = os.path.abspath(mesh_cache or mujoco_dir + "/" + mesh_cache_folder)
+  catalogue_cache = os.path.abspath(catalogue_cache or mujoco_dir + "/" + catalogue_cache_folder)
+
+  # every urdf depends on every xacro it may include and the gripper config
+  description_dir = os.path.dirname(os.path.abspath(mujoco_dir))
+  xacro_deps = sorted([os.path.relpath(x, mujoco_dir) for x in
+                       glob.glob(description_dir + "/xacro/*.xacro") +
+                       glob.glob(mujoco_dir + "/xacro/*.xacro")
+                       if not x.endswith(".urdf.xacro")])
+  xacro_deps += ["../config/gripper.yaml", "xacro_expand.py"]
+
+  robots = sorted([os.path.basename(x)[:-len(".urdf.xacro")]
+                   for x in glob.glob(mujoco_dir + "/xacro/*.urdf.xacro")])
+  for robot in robots:
+
+    def write_urdf(robot=robot):
+      urdf = expand_xacro(f"xacro/{robot}.urdf.xacro", root_dir=mujoco_dir, config=config)
+      with open(f"{mujoco_dir}/urdf/{robot}.urdf", "w") as outfile:
+        outfile.write(urdf)
+
+    graph.add(Node(f"{prefix}urdf/{robot}.urdf",
+      f"xacro xacro/{robot}.urdf.xacro > urdf/{robot}.urdf",
+      inputs=[f"xacro/{robot}.urdf.xacro"] + xacro_deps,
+      outputs=[f"urdf/{robot}.urdf"],
+      cwd=mujoco_dir, stage="xacro", labels=dict(labels, robot=robot), action=write_urdf))
+
+    # the task model can be written straight from the config, see gripper_mjcf.py
+    if generate_mjcf and robot == "gripper_task":
+
+      def write_mjcf(robot=robot):
+        details = config
+        if details is None:
+          with open(f"{mujoco_dir}/../config/gripper.yaml") as file:
+            details = yaml.safe_load(file)
+        gripper_mjcf.generate_mjcf(details, f"{mujoco_dir}/{build_folder}/{robot}.xml")
+
+      graph.add(Node(f"{prefix}{build_folder}/{robot}.xml",
+        f"gripper_mjcf.py --output {build_folder}/{robot}.xml",
+        inputs=["../config/gripper.yaml", "gripper_mjcf.py"],
+        outputs=[f"{build_folder}/{robot}.xml"],
+        cwd=mujoco_dir, stage="generate", intermediate=True, labels=dict(labels, robot=robot),
+        action=write_mjcf))
+      continue
+
+    # compiled in the build folder, so that mesh paths resolve from there
+    graph.add(Node(f"{prefix}{build_folder}/{robot}.xml",
+      f"rm -f {build_folder}/{robot}.xml && cp urdf/{robot}.urdf {build_folder}/{robot}.urdf && "
+      f"cd {build_folder} && {compiler} {robot}.urdf {robot}.xml && rm {robot}.urdf",
+      inputs=[f"urdf/{robot}.urdf"],
+      outputs=[f"{build_folder}/{robot}.xml"],
+      cwd=mujoco_dir, stage="compile", intermediate=True, labels=dict(labels, robot=robot)))
+
+  object_outputs = [f"{objects_dir}/{x}" for x in ["objects.xml", "assets.xml", "details.xml"]]
+  if gen_objects:
+
+    # the objects read the meshes named in the set yaml, and a set with no fixed
+    # random seed is drawn again every build, so its steps always run
+    object_inputs = [f"{objects_dir}/define_objects.yaml", f"{objects_dir}/build_object_set.py"]
+    random_set = True
+    if os.path.exists(f"{mujoco_dir}/{objects_dir}/define_objects.yaml"):
+      with open(f"{mujoco_dir}/{objects_dir}/define_objects.yaml") as file:
+        object_details = yaml.safe_load(file)
+      random_set = object_details["settings"].get("fixed_random_seed", 0) == 0
+      object_inputs += [f"{build_folder}/meshes_mujoco/{x}" for x in get_object_meshes(object_details)]
+
+    graph.add(Node(f"{prefix}objects",
+      f"{python} {objects_dir}/build_object_set.py --gen-objects 1 "
+      f"--mesh-cache {mesh_cache} --catalogue-cache {catalogue_cache}",
+      inputs=object_inputs,
+      outputs=object_outputs + [f"{objects_dir}/objects.db"],
+      cwd=mujoco_dir, stage="objects", always=random_set, labels=labels))
+
+    # the split also indexes objects.db, so it runs again whenever the objects node
+    # rewrites it, even with the same contents
+    graph.add(Node(f"{prefix}splits",
+      f"{python} ./xml_script.py --build-folder {build_folder} --objects-folder {objects_folder} "
+      f"--split-only 1",
+      inputs=[f"{objects_dir}/define_objects.yaml", "xml_script.py"] + object_outputs,
+      outputs=[f"{objects_dir}/splits.yaml", f"{objects_dir}/task_objects.npy"],
+      updates=[f"{objects_dir}/objects.db"],
+      cwd=mujoco_dir, stage="splits", always=random_set, labels=labels))
+
+    graph.alias(f"{prefix}split_objects", [f"{prefix}splits"])
+
+  # the task files use the split in splits.yaml, made by the splits node above
+  # with gen_objects, otherwise already in the build folder
+  task_dir = f"{build_folder}/{task_folder}"
+  graph.add(Node(f"{prefix}tasks",
+    f"rm -f {task_dir}/*.xml {task_dir}/keyframes/*.xml && "
+    f"{python} ./xml_script.py --build-folder {build_folder} --task-folder {task_folder} "
+    f"--objects-folder {objects_folder} --gen-objects 0 "
+    f"--shared-robot {int(shared_robot)} --mjb {int(mjb)} "
+    f"--mjb-compiler {mjb_compiler or compiler} --bundle {int(bundle)} --tag-robots 0",
+    inputs=[f"{build_folder}/gripper_task.xml", "../config/gripper.yaml", "xml_script.py",
+            "task_bundle.py", f"{objects_dir}/define_objects.yaml", f"{objects_dir}/splits.yaml"]
+           + object_outputs,
+    outputs=[task_dir],
+    cwd=mujoco_dir, stage="tasks", labels=labels))
+
+  graph.alias(f"{prefix}urdf", [f"{prefix}urdf/{x}.urdf" for x in robots])
+  graph.alias(f"{prefix}mjcf", [f"{prefix}{build_folder}/{x}.xml" for x in robots])
+
+if __name__ == "__main__":
+
+  # define arguments and parse them
+  parser = argparse.ArgumentParser()
+  parser.add_argument("targets", nargs="*", default=["tasks"])
+  parser.add_argument("--build-folder",         default="build")
+  parser.add_argument("--task-folder",          default="task")
+  parser.add_argument("--objects-folder",       default="objects")
+  parser.add_argument("--python",               default="python3")
+  parser.add_argument("--compiler",             default="compile") # converts urdf to mjcf, eg <mujoco>/bin/compile
+  parser.add_argument("--gen-objects",          default=True, type=int)
+  parser.add_argument("--shared-robot",         default=False, type=int)
+  parser.add_argument("--mjb",                  default=False, type=int)
+  parser.add_argument("--mjb-compiler",         default=None)
+  parser.add_argument("--bundle",               default=False, type=int)
+  parser.add_argument("--mesh-cache",           default=None)
+  parser.add_argument("--catalogue-cache",      default=None)
+  parser.add_argument("--generate-mjcf",        default=False, type=int) # write gripper_task.xml with gripper_mjcf.py
+  parser.add_argument("-j", "--jobs",           default=1, type=int) # how many nodes may run at once
+  parser.add_argument("-n", "--dry-run",        action="store_true") # print the commands which would run
+  parser.add_argument("--list",                 action="store_true") # print the nodes and aliases
+  args = parser.parse_args()
+
+  filepath = os.path.dirname(os.path.abspath(__file__))
+  graph = BuildGraph(filepath + "/" + graph_state_file)
+  add_mujoco_nodes(graph, filepath, build_folder=args.build_folder, task_folder=args.task_folder,
+                   objects_folder=args.objects_folder, python=args.python, compiler=args.compiler,
+                   gen_objects=bool(args.gen_objects), shared_robot=bool(args.shared_robot),
+                   mjb=bool(args.mjb), mjb_compiler=args.mjb_compiler, bundle=bool(args.bundle),
+                   mesh_cache=args.mesh_cache, catalogue_cache=args.catalogue_cache,
+                   generate_mjcf=bool(args.generate_mjcf))
+
+  if args.list:
+    for name, node in graph.nodes.items():
+      deps = ", ".join(graph.get_deps(node))
+      print(f"{name}" + (f" <- {deps}" if deps != "" else ""))
+    for name, targets in graph.aliases.items():
+      print(f"{name} = {', '.join(targets)}")
+    exit()
+
+  try:
+    order = graph.select(args.targets)
+    ran = graph.build(args.targets, jobs=args.jobs, dry_run=args.dry_run)
+  except RuntimeError as error:
+    print(f"build_graph.py: {error}")
+    exit(1)
+  print(f"build_graph.py: {len(ran)} of {len(order)} steps {'would run' if args.dry_run else 'run'}, "
+        f"the rest are up to date")
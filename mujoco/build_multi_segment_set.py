@@ -7,11 +7,21 @@ of segments.
 """
 
 import yaml
+import copy
 import subprocess
 import os
 import shutil
 import argparse
-from datetime import datetime
+import hashlib
+import sqlite3
+import time
+import numpy as np
+from datetime import datetime, timedelta
+from set_sync import sync_set, merge_into_set
+from build_trace import span, start_trace, get_labels, load_spans, save_chrome_trace, print_summary
+from build_graph import BuildGraph, add_mujoco_nodes, get_object_meshes, graph_state_file
+from width_delta import get_width_patch, derive_task_folder, compare_task_folders
+from xml_script import compile_task_files
 
 debug = False
 
@@ -30,8 +40,30 @@ object_py = "build_object_set.py"
 
 # these do not have to exist (note that we need the 'meshes_mujoco' folder for real applications)
 objects_folder = "objects"
+collision_folder = "collision"
+object_index_file = "objects.db"
 build_folder = "build"
 
+# private scratch trees for parallel builds (--jobs > 1), deleted once merged
+scratch_folder = "build_jobs"
+
+# cache of previously built outputs, keyed by a digest of every build input
+cache_folder = "build_cache"
+
+# content addressed store of mesh files shared by every set in a folder, the
+# meshes_mujoco folder of each set links into it rather than holding a copy
+mesh_store_folder = "mesh_store"
+
+# timings of previous builds, kept in the cache folder to calibrate the cost model
+build_timings_file = "build_timings.yaml"
+max_timing_records = 500
+
+# spans of a traced build (--trace yes), exported to trace.json in this folder
+trace_folder = "build_trace"
+
+# objects per task file, this must match max_objects_per_task in xml_script.py
+objects_per_task = 20
+
 # default task folder name (see Makefile), only to delete it for tidyness
 default_task_folder_name = "task"
 
@@ -54,13 +86,25 @@ parser.add_argument("--copy-to-override", default="no") # if the copy-to locatio
 parser.add_argument("--copy-to-merge-sets", default="no") # do we copy task files into an already existing set in the 'copy-to' directory
 parser.add_argument("--use-hashes", default="no") # do we make hash versions of task files
 parser.add_argument("--python", default="python3") # what python call are we using
+parser.add_argument("-j", "--jobs", type=int, default=1) # how many build steps run at once, across every (N, width) variant
+parser.add_argument("--use-cache", default="yes") # do we reuse cached outputs when no build inputs have changed
+parser.add_argument("--shared-robot", default="no") # do task files include one shared copy of the robot
+parser.add_argument("--mjb", default="no") # do we also compile every task file into a mujoco binary (.mjb)
+parser.add_argument("--mjb-compiler", default="default") # command to compile .mjb files, 'default' uses bin/compile
+parser.add_argument("--bundle", default="no") # do we pack the task files of each gripper into one tasks.bundle
+parser.add_argument("--generate-mjcf", default="no") # write the gripper model with gripper_mjcf.py, skipping xacro and compile
+parser.add_argument("--width-deltas", default="no", choices=["yes", "no", "check"]) # derive each width from the first width of its N, 'check' compares with full builds
+parser.add_argument("--mesh-links", default="hard", choices=["hard", "symlink", "copy"]) # how set meshes link to the shared mesh store
+parser.add_argument("--plan", action="store_true", default=False) # estimate the files, disk and time of the build, without building
+parser.add_argument("--trace", default="no") # record timed spans of every build stage, for a chrome trace and summary
 args = parser.parse_args()
 
 # ----- begin scripting ---- #
 
-def get_yaml_hash(filepath):
+def get_yaml_hash(filepath, yaml_string=None):
   """
-  Get a simple hash of the text of the yaml file, stripping all whitespace
+  Get a simple hash of the text of the yaml file, stripping all whitespace. The
+  text can be given directly as yaml_string, then filepath is not read
   """
 
   # simple string hash function which returns same hash each run (unlike Python hash())
@@ -72,13 +116,513 @@ def get_yaml_hash(filepath):
     return hex(hash)[2:].upper().zfill(8)
 
   # read the yaml file as a string for hashing
-  with open(filepath, "r") as yamlfile:
-    yaml_string = yamlfile.read()
-    yaml_string = "".join(yaml_string.split())
+  if yaml_string is None:
+    with open(filepath, "r") as yamlfile:
+      yaml_string = yamlfile.read()
+  yaml_string = "".join(yaml_string.split())
 
   # hash the yaml string for the task folder name
   return myHash(yaml_string)
 
+def link_files(source_dir, target_dir, names=None):
+  """
+  Create target_dir and fill it with symlinks to the files in source_dir (every
+  file if names is None). The directory itself is real, so that relative '..'
+  paths used by xacro resolve inside the scratch tree and not the source tree
+  """
+  os.makedirs(target_dir, exist_ok=True)
+  if names is None:
+    names = [x for x in os.listdir(source_dir) if os.path.isfile(source_dir + "/" + x)]
+  for name in names:
+    os.symlink(source_dir + "/" + name, target_dir + "/" + name)
+
+def make_scratch_tree(job_path, variant_details):
+  """
+  Create a private copy of the description tree for building one (N, width)
+  variant. Sources are symlinked, only the config file and outputs are private
+  """
+
+  if os.path.exists(job_path): shutil.rmtree(job_path)
+
+  job_mujoco = job_path + "/mujoco"
+  job_build = job_mujoco + "/" + build_folder
+
+  link_files(description_path + "/xacro", job_path + "/xacro")
+  link_files(filepath + "/xacro", job_mujoco + "/xacro")
+  link_files(filepath, job_mujoco, ["xacro_expand.py", "gripper_mjcf.py", "xml_script.py",
+                                    "task_bundle.py", "build_trace.py"])
+  link_files(activepath + "/" + objects_folder, job_build + "/" + objects_folder,
+             [object_yaml, object_py, "splits.yaml", "objects.xml", "assets.xml", "details.xml"])
+  os.symlink(activepath + "/meshes_mujoco", job_build + "/meshes_mujoco")
+
+  # the object split is included by the task files, eg when compiling them
+  for folder in ["assets", "objects"]:
+    link_files(activepath + "/" + objects_folder + "/" + folder,
+               job_build + "/" + objects_folder + "/" + folder)
+
+  # simplified collision meshes are loaded by the object assets
+  if os.path.isdir(activepath + "/" + objects_folder + "/" + collision_folder):
+    os.symlink(activepath + "/" + objects_folder + "/" + collision_folder,
+               job_build + "/" + objects_folder + "/" + collision_folder)
+
+  # the config file is the only input which differs between variants
+  os.makedirs(job_path + "/config")
+  with open(job_path + gripper_config_file, "w") as outfile:
+    yaml.dump(variant_details, outfile, default_flow_style=False)
+
+def add_variant_nodes(graph, mujoco_dir, this_folder_name, variant_details, prefix="",
+                      labels=None):
+  """
+  Add the build steps of one variant to graph, which make its task files from
+  the objects already split in the build folder of mujoco_dir. The xacros are
+  given variant_details in memory, rather than each reading the config file
+  """
+  add_mujoco_nodes(graph, mujoco_dir, build_folder=build_folder, task_folder=this_folder_name,
+                   objects_folder=objects_folder, python=args.python,
+                   compiler=args.mujoco_path + "/bin/compile", gen_objects=False,
+                   shared_robot=args.shared_robot == "yes", mjb=args.mjb == "yes",
+                   mjb_compiler=None if args.mjb_compiler == "default" else args.mjb_compiler,
+                   bundle=args.bundle == "yes", prefix=prefix, labels=labels,
+                   config=copy.deepcopy(variant_details),
+                   generate_mjcf=args.generate_mjcf == "yes")
+
+def merge_variant(job_path, this_folder_name, with_urdfs):
+  """
+  Move the outputs of a scratch build into the shared build folder, the robot
+  urdfs are overwritten by each variant so only the final one is merged
+  """
+
+  job_build = job_path + "/mujoco/" + build_folder
+  shutil.copytree(job_build + "/" + this_folder_name, activepath + "/" + this_folder_name)
+  shutil.copyfile(job_path + gripper_config_file,
+                  activepath + "/" + this_folder_name + "/" + gripper_config_file_name)
+
+  # leave the robot urdfs as the serial build would
+  if with_urdfs and os.path.isdir(job_path + "/mujoco/urdf"):
+    os.makedirs(filepath + "/urdf", exist_ok=True)
+    urdfs = os.listdir(job_path + "/mujoco/urdf")
+    for x in urdfs:
+      shutil.copyfile(job_path + "/mujoco/urdf/" + x, filepath + "/urdf/" + x)
+
+    # these were not made by the build graph of the build folder, which must remake them
+    BuildGraph(filepath + "/" + graph_state_file).forget(["urdf/" + x for x in urdfs])
+
+# sha256 of files already read this run, meshes are shared by every variant
+file_digests = {}
+
+def get_file_digest(path, remember=True):
+  """
+  Get the sha256 hex digest of a file, or of the text 'missing' if it does not
+  exist. Digests are remembered for the rest of the run, unless the file will
+  be rewritten (like the gripper config) and remember=False
+  """
+  if path not in file_digests or not remember:
+    if os.path.isfile(path):
+      h = hashlib.sha256()
+      with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+          h.update(chunk)
+      file_digests[path] = h.hexdigest()
+    else:
+      file_digests[path] = hashlib.sha256(b"missing").hexdigest()
+  return file_digests[path]
+
+def get_digest(inputs):
+  """
+  Combine a list of (label, value) string pairs into one sha256 hex digest
+  """
+  h = hashlib.sha256()
+  for label, value in inputs:
+    h.update(f"{label}={value}\n".encode())
+  return h.hexdigest()
+
+def get_objects_key(yaml_file=None, py_file=None):
+  """
+  Digest of every input to the object files of a set: the set yaml, the object
+  and splitting scripts, and the object meshes. By default this is the set in
+  the build folder. A set with no fixed random seed draws a new split every
+  build, so it has no key (None) and is never cached
+  """
+
+  objects_path = activepath + "/" + objects_folder
+  if yaml_file is None: yaml_file = objects_path + "/" + object_yaml
+  if py_file is None: py_file = objects_path + "/" + object_py
+  with open(yaml_file) as file:
+    object_details = yaml.safe_load(file)
+  if object_details["settings"].get("fixed_random_seed", 0) == 0: return None
+
+  inputs = [
+    (object_yaml, get_file_digest(yaml_file, remember=False)),
+    (object_py, get_file_digest(py_file)),
+    ("xml_script.py", get_file_digest(filepath + "/xml_script.py")),
+  ]
+  for mesh in get_object_meshes(object_details):
+    inputs.append((mesh, get_file_digest(activepath + "/meshes_mujoco/" + mesh)))
+
+  return get_digest(inputs)
+
+def get_variant_key(objects_key, config_digest, this_folder_name, reference_key=None):
+  """
+  Digest of every input to the task files of one (N, width) variant, this
+  includes the objects key as the keyframes depend on the object split. A
+  variant derived from a reference variant also depends on the reference key
+  """
+
+  inputs = [
+    ("objects", objects_key),
+    ("task folder", this_folder_name),
+    ("mujoco path", args.mujoco_path),
+    ("shared robot", args.shared_robot),
+    ("mjb", args.mjb),
+    ("mjb compiler", args.mjb_compiler),
+    ("bundle", args.bundle),
+    ("generate mjcf", args.generate_mjcf),
+    (gripper_config_file_name, config_digest),
+    ("compile", get_file_digest(args.mujoco_path + "/bin/compile")),
+  ]
+  if reference_key is not None: inputs.append(("reference", reference_key))
+  for name in ["build_graph.py", "xacro_expand.py", "gripper_mjcf.py", "xml_script.py",
+               "task_bundle.py", "width_delta.py"]:
+    inputs.append((name, get_file_digest(filepath + "/" + name)))
+
+  # every xacro (robot description) and every robot mesh
+  for folder in [description_path + "/xacro", filepath + "/xacro"]:
+    for root, dirs, files in sorted(os.walk(folder)):
+      for name in sorted(files):
+        inputs.append((os.path.relpath(root + "/" + name, description_path),
+                       get_file_digest(root + "/" + name)))
+  mesh_path = activepath + "/meshes_mujoco"
+  for name in sorted(os.listdir(mesh_path)):
+    if os.path.isfile(mesh_path + "/" + name):
+      inputs.append((name, get_file_digest(mesh_path + "/" + name)))
+
+  return get_digest(inputs)
+
+def index_task_variants(index_file, variant_rows):
+  """
+  Add the (folder, segments, width_mm, config_hash) of each gripper variant to
+  the variants table of the SQLite object index, if the set has one
+  """
+  if not os.path.exists(index_file): return
+  db = sqlite3.connect(index_file)
+  db.execute("DELETE FROM variants")
+  db.executemany("INSERT OR REPLACE INTO variants VALUES (?, ?, ?, ?)", variant_rows)
+  db.commit()
+  db.close()
+
+def store_in_cache(source_paths, cache_entry):
+  """
+  Copy the given files and folders into a new cache entry, the entry only
+  appears once complete so an interrupted build never leaves a bad entry
+  """
+  if os.path.exists(cache_entry): return
+  temp_entry = cache_entry + ".incomplete"
+  if os.path.exists(temp_entry): shutil.rmtree(temp_entry)
+  os.makedirs(temp_entry)
+  for path in source_paths:
+    if os.path.isdir(path):
+      shutil.copytree(path, temp_entry + "/" + os.path.basename(path))
+    else:
+      shutil.copyfile(path, temp_entry + "/" + os.path.basename(path))
+  os.replace(temp_entry, cache_entry)
+
+def restore_from_cache(cache_entry, target_dir):
+  """
+  Copy everything in a cache entry into the target folder, replacing folders
+  """
+  os.makedirs(target_dir, exist_ok=True)
+  for x in os.listdir(cache_entry):
+    if os.path.isdir(cache_entry + "/" + x):
+      if os.path.exists(target_dir + "/" + x): shutil.rmtree(target_dir + "/" + x)
+      shutil.copytree(cache_entry + "/" + x, target_dir + "/" + x)
+    else:
+      shutil.copyfile(cache_entry + "/" + x, target_dir + "/" + x)
+
+def get_width_reference(references, N, width_mm, variant_details, verbose=False):
+  """
+  Get the (folder, config, key) of the reference variant that a variant with
+  --width-deltas is derived from, which is the first width of its N. Returns
+  None if the variant is built in full, as the reference itself or because the
+  width changes more than width_delta.py can patch
+  """
+  if args.width_deltas == "no" or width_mm == widths[0] or N not in references:
+    return None
+  try:
+    get_width_patch(references[N][1], variant_details)
+  except ValueError as error:
+    if verbose: print(f"Building N={N} width={width_mm:.0f}mm in full, {error}")
+    return None
+  return references[N]
+
+# ----- build planning ----- #
+
+# every cost estimate is linear in the features of its stage
+cost_features = {
+  "objects": lambda stage: [1, stage["objects"]],
+  "variant": lambda stage: [1, stage["tasks"], stage["segments"], stage["tasks"] * stage["segments"]],
+  "delta": lambda stage: [1, stage["tasks"], stage["segments"], stage["tasks"] * stage["segments"]],
+}
+
+# costs used until builds have been recorded, from builds of set_test and set_test_large
+default_costs = {
+  "objects": {
+    "seconds": [0.25, 0.0001],
+    "files": [6, 0.1],
+    "bytes": [4300, 2520],
+  },
+  "variant": {
+    "seconds": [1.23, 0.0015, 0.053, 0],
+    "files": [1, 2, 0, 0],
+    "bytes": [1600, 10500, 0, 2780],
+  },
+  "delta": {
+    "seconds": [0.01, 0.003, 0.0005, 0.0001],
+    "files": [1, 2, 0, 0],
+    "bytes": [1600, 10500, 0, 2780],
+  },
+}
+
+def count_objects(object_details):
+  """
+  Count the objects a set yaml creates without building them, one for every
+  fillet, scale, density and friction, following build_catalogue() in
+  build_object_set.py
+  """
+  settings = object_details["settings"]
+  density_loop = 1 if settings.get("random_density", False) else len(settings["object_densities"])
+  friction_loop = 1 if settings.get("random_friction", False) else len(settings["friction_scalings"])
+  num_objects = 0
+  for object in object_details:
+    if object == "settings": continue
+    elif object_details[object]["include"] is False: continue
+    fillet = object_details[object]["fillet"]
+    fillet_num = int((fillet["max"] - fillet["min"]) / fillet["step"]) + 1 if fillet["used"] else 1
+    num_objects += fillet_num * object_details[object]["scale"]["num"] * density_loop * friction_loop
+  return num_objects
+
+def get_folder_size(paths):
+  """
+  Get the number of files and the total bytes of the given files and folders
+  """
+  files, size = 0, 0
+  for path in paths:
+    if os.path.isfile(path):
+      files, size = files + 1, size + os.path.getsize(path)
+    for root, dirs, names in os.walk(path):
+      files += len(names)
+      size += sum([os.path.getsize(root + "/" + x) for x in names])
+  return files, size
+
+def load_build_timings():
+  """
+  Load the recorded timings of previous builds, a list of one dictionary per
+  stage which was built (not restored from the cache)
+  """
+  timings_file = filepath + "/" + cache_folder + "/" + build_timings_file
+  if not os.path.exists(timings_file): return []
+  with open(timings_file) as file:
+    return yaml.safe_load(file) or []
+
+def save_build_timings(new_records):
+  """
+  Add the timings of newly built stages to the record, keeping only the most
+  recent max_timing_records
+  """
+  if len(new_records) == 0: return
+  records = (load_build_timings() + new_records)[-max_timing_records:]
+  os.makedirs(filepath + "/" + cache_folder, exist_ok=True)
+  timings_file = filepath + "/" + cache_folder + "/" + build_timings_file
+  with open(timings_file + ".incomplete", "w") as outfile:
+    yaml.safe_dump(records, outfile, sort_keys=False)
+  os.replace(timings_file + ".incomplete", timings_file)
+
+def get_cost_model(records):
+  """
+  Fit the seconds, files and bytes of each stage to the recorded builds. With
+  enough different builds recorded this is a least squares fit, otherwise the
+  default costs are scaled to match the builds there are. Variants built with
+  other options (shared robot, mjb, bundle) are only used if there are no others
+  """
+
+  options = {"shared_robot": args.shared_robot, "mjb": args.mjb, "bundle": args.bundle}
+  model = {}
+  calibrated = 0
+
+  for stage, features in cost_features.items():
+    stage_records = [r for r in records if r["stage"] == stage]
+    same_options = [r for r in stage_records if all([r.get(k) == v for k, v in options.items()])]
+    if len(same_options) > 0: stage_records = same_options
+    calibrated += len(stage_records)
+
+    model[stage] = {}
+    for quantity, default in default_costs[stage].items():
+      coefficients = np.array(default, dtype=float)
+      if len(stage_records) > 0:
+        X = np.array([features(r) for r in stage_records], dtype=float)
+        y = np.array([r[quantity] for r in stage_records], dtype=float)
+        if np.linalg.matrix_rank(X) == X.shape[1]:
+          coefficients = np.linalg.lstsq(X, y, rcond=None)[0]
+        elif (X @ coefficients).sum() > 0:
+          coefficients *= y.sum() / (X @ coefficients).sum()
+      model[stage][quantity] = coefficients
+
+  return model, calibrated
+
+def estimate_stage(model, stage):
+  """
+  Fill in the estimated seconds, files and bytes of a stage, and its wall time
+  given how many variants are built in parallel
+  """
+  for quantity, coefficients in model[stage["stage"]].items():
+    stage[quantity] = max(0.0, float(np.dot(cost_features[stage["stage"]](stage), coefficients)))
+  stage["files"] = int(round(stage["files"]))
+  stage["bytes"] = int(round(stage["bytes"]))
+  stage["wall"] = stage["seconds"] / (args.jobs if stage["stage"] == "variant" else 1)
+  return stage
+
+def get_build_plan(set_files, model):
+  """
+  Expand the sets x segments x widths of this build into its stages and
+  estimate the cost of each, without writing anything. The set_files are
+  (name, set yaml, object script) for each set, and stages whose outputs are
+  already in the cache are marked as cached
+  """
+
+  use_cache = args.use_cache == "yes"
+  plan = []
+
+  for set_name, yaml_file, py_file in set_files:
+
+    # the reference variant of each N, when widths are derived from it
+    references = {}
+
+    with open(yaml_file) as file:
+      object_details = yaml.safe_load(file)
+    num_objects = count_objects(object_details)
+    num_tasks = int(np.ceil(num_objects / objects_per_task))
+
+    objects_key = get_objects_key(yaml_file, py_file) if use_cache else None
+    if objects_key is not None:
+      cached = os.path.isdir(cache_path + "/objects/" + objects_key)
+    else: cached = False
+    set_plan = {
+      "set": set_name,
+      "objects_stage": estimate_stage(model, {"stage": "objects", "set": set_name,
+                                              "objects": num_objects, "cached": cached}),
+      "variants": [],
+    }
+
+    # the gripper config of each variant is never written, only its digest is needed
+    variant_details = yaml.safe_load(yaml.dump(gripper_details))
+    for N in segments:
+      for width_mm in widths:
+        variant_details["gripper_config"]["num_segments"] = N
+        variant_details["gripper_params"]["finger_width"] = width_mm * 1e-3
+        config_text = yaml.dump(variant_details, default_flow_style=False)
+        if args.use_hashes == "yes":
+          this_folder_name = f"{task_folder_name}_N{N}_H{get_yaml_hash(None, config_text)}"
+        else:
+          this_folder_name = f"{task_folder_name}_N{N}_{width_mm:.0f}"
+        reference = get_width_reference(references, N, width_mm, variant_details)
+        derived = reference is not None and args.width_deltas == "yes"
+        if objects_key is not None:
+          config_digest = hashlib.sha256(config_text.encode()).hexdigest()
+          variant_key = get_variant_key(objects_key, config_digest, this_folder_name,
+                                        reference_key=reference[2] if derived else None)
+          cached = os.path.isdir(cache_path + "/tasks/" + variant_key)
+        else: variant_key = None
+        if width_mm == widths[0]:
+          references[N] = (this_folder_name, copy.deepcopy(variant_details), variant_key)
+        set_plan["variants"].append(estimate_stage(model, {
+          "stage": "delta" if derived else "variant",
+          "set": set_name, "folder": this_folder_name,
+          "segments": N, "width_mm": float(width_mm), "objects": num_objects,
+          "tasks": num_tasks, "cached": cached,
+        }))
+
+    plan.append(set_plan)
+
+  return plan
+
+def format_bytes(size):
+  """
+  Format a number of bytes for printing, eg 1.5 GB
+  """
+  for unit in ["B", "kB", "MB", "GB"]:
+    if size < 1000: break
+    size /= 1000
+  else: unit = "TB"
+  return f"{size:.1f} {unit}"
+
+def format_seconds(seconds):
+  """
+  Format a number of seconds for printing, as hours:minutes:seconds
+  """
+  return str(timedelta(seconds=round(seconds)))
+
+def print_build_plan(plan, calibrated):
+  """
+  Print the estimated cost of each set in the plan and of the whole build
+  """
+
+  if calibrated > 0: print(f"Cost model calibrated on {calibrated} recorded build stages")
+  else: print("No builds recorded yet, using the default cost model")
+  print(f"{len(plan)} sets x {len(segments)} segments x {len(widths)} widths, "
+        f"{args.jobs} parallel jobs, cache {'on' if args.use_cache == 'yes' else 'off'}\n")
+
+  print(f"{'set':<32}{'objects':>8}{'tasks':>7}{'variants':>10}{'cached':>8}"
+        f"{'files':>10}{'size':>12}{'time':>10}")
+  totals = [0, 0, 0]
+  for set_plan in plan:
+    stages = [set_plan["objects_stage"]] + set_plan["variants"]
+    files = sum([x["files"] for x in stages])
+    size = sum([x["bytes"] for x in stages])
+    wall = sum([x["wall"] for x in stages if not x["cached"]])
+    num_cached = len([x for x in set_plan["variants"] if x["cached"]])
+    print(f"{set_plan['set']:<32}{set_plan['objects_stage']['objects']:>8}"
+          f"{set_plan['variants'][0]['tasks']:>7}{len(set_plan['variants']):>10}{num_cached:>8}"
+          f"{files:>10}{format_bytes(size):>12}{format_seconds(wall):>10}")
+    totals = [totals[0] + files, totals[1] + size, totals[2] + wall]
+
+  print(f"\nEstimated total: {totals[0]} files, {format_bytes(totals[1])}, "
+        f"{format_seconds(totals[2])} wall time")
+
+  # the meshes of every set link to the one mesh store
+  mesh_files, mesh_bytes = get_folder_size([activepath + "/meshes_mujoco"])
+  print(f"Plus {mesh_files} mesh files ({format_bytes(mesh_bytes)}) per set, "
+        f"linked to the shared {mesh_store_folder} unless MESH_LINKS=copy")
+
+def print_progress(plan, started):
+  """
+  Print how many stages of the plan are done and the estimated time left, the
+  remaining estimate is scaled by how long the finished stages took compared
+  to their own estimates
+  """
+  stages = [x for set_plan in plan for x in [set_plan["objects_stage"]] + set_plan["variants"]]
+  done = [x for x in stages if x.get("done")]
+  planned_done = sum([x["wall"] for x in done if not x["cached"]])
+  planned_left = sum([x["wall"] for x in stages if not x.get("done") and not x["cached"]])
+  elapsed = time.time() - started
+  scale = elapsed / planned_done if planned_done > 0 else 1.0
+  print(f"Progress: {len(done)}/{len(stages)} stages done, {format_seconds(elapsed)} elapsed, "
+        f"ETA {format_seconds(planned_left * scale)}")
+
+def record_stage(stage, seconds, paths):
+  """
+  Mark a planned stage as built, returning its measured cost as a timing record
+  """
+  stage["done"] = True
+  stage["cached"] = False
+  files, size = get_folder_size(paths)
+  record = {x: stage[x] for x in ["stage", "set", "objects", "tasks", "segments", "width_mm"]
+            if x in stage}
+  record.update({
+    "seconds": round(seconds, 3), "files": files, "bytes": size,
+    "shared_robot": args.shared_robot, "mjb": args.mjb, "bundle": args.bundle,
+    "jobs": args.jobs, "date": datetime.now().strftime("%d-%m-%y_%H-%M-%S"),
+  })
+  return record
+
 filepath = os.path.dirname(os.path.abspath(__file__))
 description_path = os.path.dirname(filepath)
 
@@ -90,12 +634,15 @@ dirs = [
   build_folder + "/" + objects_folder,
 ]
 for dir in dirs:
-  if not os.path.exists(filepath +  "/" + dir):
+  if not os.path.exists(filepath +  "/" + dir) and not args.plan:
     os.makedirs(filepath +  "/" + dir)
 
 # path to where the set will be built
 activepath = filepath + "/" + build_folder
 
+# path to the cache of previous build outputs and timings
+cache_path = filepath + "/" + cache_folder
+
 # get the names of possible object sets
 setpath = filepath + "/" + set_directory + "/"
 available_sets = [x for x in os.listdir(setpath) if x.startswith(set_starts_with) and x.endswith(set_ends_with)]
@@ -169,6 +716,39 @@ else:
 if len(segments) == 0:
   raise RuntimeError("no segments specified in build_multi_segment_set.py")
 
+# bundled task files cannot be patched, so every width is built in full
+if args.width_deltas != "no" and args.bundle == "yes":
+  print("WIDTH_DELTAS is not used with BUNDLE=yes, every width will be built in full")
+  args.width_deltas = "no"
+
+# ----- plan the build ----- #
+
+if not args.clean:
+
+  # the set yaml and object script of each set, as they will be in the build area
+  if args.build_only:
+    set_files = [(build_folder, activepath + "/" + objects_folder + "/" + object_yaml,
+                  activepath + "/" + objects_folder + "/" + object_py)]
+  else:
+    set_files = [(x[:-ext_length], setpath + x, setpath + object_py) for x in build_sets]
+
+  model, calibrated = get_cost_model(load_build_timings())
+  plan = get_build_plan(set_files, model)
+
+  # for a dry run, only print the plan
+  if args.plan:
+    print_build_plan(plan, calibrated)
+    exit()
+
+  stages = [x for set_plan in plan for x in [set_plan["objects_stage"]] + set_plan["variants"]]
+  print(f"Planned {len(stages)} build stages, {len([x for x in stages if x['cached']])} cached, "
+        f"estimated {format_seconds(sum([x['wall'] for x in stages if not x['cached']]))}")
+  started = time.time()
+
+  # every process of the build adds its spans to the trace folder
+  if args.trace == "yes":
+    start_trace(filepath + "/" + trace_folder)
+
 # copy object generation python file into the build area
 if not args.build_only:
   shutil.copyfile(setpath + "/" + object_py, activepath + "/" + objects_folder + "/" + object_py)
@@ -179,16 +759,12 @@ copy_choice = None
 err_str = ""
 allow_copy_to = True
 
-for set_to_build in build_sets:
+for s, set_to_build in enumerate(build_sets):
 
   if not args.build_only and not args.clean:
     set_to_build = set_to_build[:-ext_length]
 
-    # remove the object set from the object folder, before we rebuild it
-    if (os.path.isdir(setpath + "/" + set_to_build)):
-      print("Removing", set_to_build)
-      shutil.rmtree(setpath + set_to_build)
-
+    # the published set is left in place, sync_set() replaces it once rebuilt
     # copy the set yaml into the mjcf builder directory
     set_yaml = f"{set_to_build}.yaml"
     shutil.copyfile(setpath + "/" + set_yaml, activepath + "/" + objects_folder + "/" + object_yaml)
@@ -204,42 +780,218 @@ for set_to_build in build_sets:
 
   # if cleaning, run 'make clean' and exit now folders have been deleted
   if args.clean:
+    if os.path.exists(filepath + "/" + scratch_folder):
+      shutil.rmtree(filepath + "/" + scratch_folder)
     make = "make clean"
     subprocess.run([make], shell=True, cwd=filepath)
     print("build_multi_segment_set.py has finished cleaning")
     exit()
 
-  for i, N in enumerate(segments):
-    for width_mm in widths:
+  # task folder name of every variant in the order they are built, and its index row
+  variants = []
+  variant_rows = []
+
+  # parallel builds each get a scratch tree under here, with a private config
+  scratch_path = filepath + "/" + scratch_folder
+  jobs = []
+
+  # the reference variant of each N, and the variants derived from them once built
+  references = {}
+  deltas = []
+
+  # the estimated cost of each stage of this set, and the timings of those built
+  set_plan = plan[s]
+  timing_records = []
+
+  # every span of this set is labelled with it
+  with span("build set", set=set_plan["set"]):
+    # variants are reused from the cache if none of their inputs have changed
+    use_cache = args.use_cache == "yes"
+    if use_cache:
+      objects_key = get_objects_key()
+      if objects_key is None:
+        print("Not using the cache, the set has no fixed random seed")
+        use_cache = False
+      else: objects_cache = cache_path + "/objects/" + objects_key
+
+    # generate and split the objects once for the whole set, every variant shares them
+    objects_outputs = [activepath + "/" + objects_folder + "/" + x for x in
+                       ["objects.xml", "assets.xml", "details.xml", "splits.yaml",
+                        "assets", "objects", object_index_file, "task_objects.npy",
+                        collision_folder, "mesh_report.yaml"]]
+    if use_cache and os.path.isdir(objects_cache):
+      print("Reusing cached objects")
+
+      # files a previous set may have left are removed, and as the objects are
+      # replaced outside the build graph it must run their steps next time
+      for path in objects_outputs[-4:]:
+        if os.path.isdir(path): shutil.rmtree(path)
+        elif os.path.exists(path): os.remove(path)
+      with span("restore objects", category="copy"):
+        restore_from_cache(objects_cache, activepath + "/" + objects_folder)
+      BuildGraph(filepath + "/" + graph_state_file).forget(["objects", "splits"])
+      set_plan["objects_stage"].update(done=True, cached=True)
+    else:
+      graph = BuildGraph(filepath + "/" + graph_state_file)
+      add_mujoco_nodes(graph, filepath, build_folder=build_folder, objects_folder=objects_folder,
+                       python=args.python, labels=get_labels())
+      start = time.time()
+      graph.build(["split_objects"], jobs=args.jobs)
+      timing_records.append(record_stage(set_plan["objects_stage"], time.time() - start,
+                                         [x for x in objects_outputs if os.path.exists(x)]))
+      if use_cache:
+        with span("store objects", category="copy"):
+          store_in_cache([x for x in objects_outputs if os.path.exists(x)], objects_cache)
+    print_progress(plan, started)
+
+    for i, N in enumerate(segments):
+      for width_mm in widths:
+
+        # overwrite yaml dictionary with settings for this iteration
+        gripper_details["gripper_config"]["num_segments"] = N
+        gripper_details["gripper_params"]["finger_width"] = width_mm * 1e-3
+
+        # is this width derived from the reference variant of its N
+        reference = get_width_reference(references, N, width_mm, gripper_details, verbose=True)
+        build_in_full = reference is None or args.width_deltas == "check"
+
+        # write the overwritten dictionary to the file (or a private copy of it),
+        # derived variants save it in their task folder when they are patched
+        config_text = yaml.dump(gripper_details, default_flow_style=False)
+        if build_in_full and args.jobs > 1:
+          job_path = f"{scratch_path}/N{N}_{width_mm:.0f}"
+          with span("make scratch tree", category="files", N=N, width=width_mm):
+            make_scratch_tree(job_path, gripper_details)
+          this_config_file = job_path + gripper_config_file
+        elif build_in_full:
+          this_config_file = description_path + gripper_config_file
+          with open(this_config_file, "w") as outfile:
+            outfile.write(config_text)
+
+        # create the task folder name
+        yaml_hash = get_yaml_hash(None, config_text)
+        if args.use_hashes == "yes":
+          this_folder_name = f"{task_folder_name}_N{N}_H{yaml_hash}"
+        else:
+          this_folder_name = f"{task_folder_name}_N{N}_{width_mm:.0f}"
+        variant_rows.append((this_folder_name, N, width_mm, yaml_hash))
+        this_stage = set_plan["variants"][len(variant_rows) - 1]
+
+        # reuse the task files from the cache if they exist
+        if use_cache:
+          variant_key = get_variant_key(objects_key, hashlib.sha256(config_text.encode()).hexdigest(),
+                                        this_folder_name, None if build_in_full else reference[2])
+          variant_cache = cache_path + "/tasks/" + variant_key
+        else: variant_key, variant_cache = None, None
+        if width_mm == widths[0]:
+          references[N] = (this_folder_name, copy.deepcopy(gripper_details), variant_key)
+        if use_cache:
+          if os.path.isdir(variant_cache):
+            print(f"Reusing cached build of {this_folder_name}")
+            with span("restore variant", category="copy", N=N, width=width_mm):
+              restore_from_cache(variant_cache, activepath)
+            variants.append(this_folder_name)
+            this_stage.update(done=True, cached=True)
+            print_progress(plan, started)
+            continue
+
+        # build the task and keyframe files, the objects are already done
+        labels = dict(get_labels(), N=N, width=width_mm)
+        if reference is not None:
+          deltas.append((reference[0], this_folder_name, copy.deepcopy(gripper_details),
+                         this_stage, labels, variant_cache))
+        if build_in_full and args.jobs > 1:
+          jobs.append((job_path, f"N{N}_{width_mm:.0f}/", variant_cache,
+                       this_folder_name, this_stage, labels, copy.deepcopy(gripper_details)))
+        elif build_in_full:
+          graph = BuildGraph(filepath + "/" + graph_state_file)
+          add_variant_nodes(graph, filepath, this_folder_name, gripper_details, labels=labels)
+          start = time.time()
+          with span("build variant", N=N, width=width_mm):
+            graph.build(["tasks"])
+
+          # copy the gripper.yaml config file into the new folder
+          shutil.copyfile(this_config_file, 
+                          activepath + "/" + this_folder_name + "/" + gripper_config_file_name)
+
+          if use_cache:
+            with span("store variant", category="copy", N=N, width=width_mm):
+              store_in_cache([activepath + "/" + this_folder_name], variant_cache)
+
+          timing_records.append(record_stage(this_stage, time.time() - start,
+                                             [activepath + "/" + this_folder_name]))
+          print_progress(plan, started)
+
+        variants.append(this_folder_name)
+
+    # build the steps of every queued variant in one graph, sharing the budget of
+    # parallel jobs, then merge the variants in the serial order
+    if len(jobs) > 0:
+      print(f"Building {len(jobs)} variants with {args.jobs} parallel jobs")
+      graph = BuildGraph()
+      for job_path, prefix, variant_cache, this_folder_name, this_stage, labels, details in jobs:
+        add_variant_nodes(graph, job_path + "/mujoco", this_folder_name, details, prefix, labels)
+      job_stages = {x[1] + "tasks": x[4] for x in jobs}
+
+      def variant_done(name):
+        if name in job_stages:
+          job_stages[name]["done"] = True
+          print_progress(plan, started)
+
+      try:
+        node_seconds = graph.build(list(job_stages), jobs=args.jobs, callback=variant_done)
+      except RuntimeError as error:
+        raise RuntimeError(f"{error}, scratch trees left in: {scratch_path}")
 
-      # overwrite yaml dictionary with settings for this iteration
-      gripper_details["gripper_config"]["num_segments"] = N
-      gripper_details["gripper_params"]["finger_width"] = width_mm * 1e-3
+      for j, (job_path, prefix, variant_cache, this_folder_name, this_stage, labels, details) in enumerate(jobs):
+        with span("merge variant", category="copy", **labels):
+          merge_variant(job_path, this_folder_name, with_urdfs=(j == len(jobs) - 1))
+        if variant_cache is not None:
+          with span("store variant", category="copy", **labels):
+            store_in_cache([activepath + "/" + this_folder_name], variant_cache)
 
-      # write the overwritten dictionary to the file
-      with open(description_path + gripper_config_file, "w") as outfile:
-        yaml.dump(gripper_details, outfile, default_flow_style=False)
+        # the cost of a variant is the time taken by its own steps
+        seconds = sum([x for name, x in node_seconds.items() if name.startswith(prefix)])
+        timing_records.append(record_stage(this_stage, seconds,
+                                           [activepath + "/" + this_folder_name]))
 
-      # create the task folder name
-      if args.use_hashes == "yes":
-        yaml_hash = get_yaml_hash(description_path + gripper_config_file)
-        this_folder_name = f"{task_folder_name}_N{N}_H{yaml_hash}"
-      else:
-        this_folder_name = f"{task_folder_name}_N{N}_{width_mm:.0f}"
+    # derive the other widths of each N from its reference variant, now they are all built
+    for reference_folder, this_folder_name, details, this_stage, labels, variant_cache in deltas:
+      if args.width_deltas == "check":
+        with span("derive variant", category="files", **labels):
+          derive_task_folder(activepath + "/" + reference_folder,
+                             scratch_path + "/deltas/" + this_folder_name, details)
+        differences = compare_task_folders(scratch_path + "/deltas/" + this_folder_name,
+                                           activepath + "/" + this_folder_name)
+        if len(differences) > 0:
+          raise RuntimeError(f"{this_folder_name} derived from {reference_folder} differs from "
+                             f"its full build:\n" + "\n".join(differences))
+        print(f"{this_folder_name} derived from {reference_folder} matches its full build")
+        continue
 
-      # call make to create the files
-      make = "make TASK={0} INCDIR={1} DIRNAME={2} MJCOMPILE={3}/bin/compile PYTHON={4}".format(
-        this_folder_name, objects_folder, build_folder, args.mujoco_path, args.python)
-    
-      # fix: always generate objects, causes bug when waiting until the end
-      # disable object generation until the final loop (assets/objects wiped at the start of each 'make')
-      if False and i != len(segments) - 1: make += " GEN_OBJECTS=0"
+      start = time.time()
+      with span("derive variant", category="files", **labels):
+        derive_task_folder(activepath + "/" + reference_folder, activepath + "/" + this_folder_name,
+                           details)
+        if args.mjb == "yes":
+          compile_task_files(activepath, task_folder=this_folder_name,
+                             compiler=args.mujoco_path + "/bin/compile" if args.mjb_compiler == "default"
+                             else args.mjb_compiler)
+      if variant_cache is not None:
+        with span("store variant", category="copy", **labels):
+          store_in_cache([activepath + "/" + this_folder_name], variant_cache)
+      timing_records.append(record_stage(this_stage, time.time() - start,
+                                         [activepath + "/" + this_folder_name]))
+      print_progress(plan, started)
 
-      subprocess.run([make], shell=True, cwd=filepath)
+    # record the variants in the object index of the set
+    with span("index variants"):
+      index_task_variants(activepath + "/" + objects_folder + "/" + object_index_file, variant_rows)
 
-      # copy the gripper.yaml config file into the new folder
-      shutil.copyfile(description_path + gripper_config_file, 
-                      activepath + "/" + this_folder_name + "/" + gripper_config_file_name)
+    # the cost model of later plans is calibrated on these timings
+    save_build_timings(timing_records)
+
+    for this_folder_name in variants:
 
       # are we merging new tasks into an existing object set (in 'copy_to' directory)
       if args.copy_to != "no" and args.copy_to_merge_sets == "yes":
@@ -248,43 +1000,50 @@ for set_to_build in build_sets:
           # now copy our task files directly into that set
           allow_copy_to = False
           if not os.path.exists(f"{copy_to_path}/{set_to_build}/{this_folder_name}"):
-            shutil.copytree(f"{activepath}/{this_folder_name}", 
-                            f"{copy_to_path}/{set_to_build}/{this_folder_name}")
+            with span("merge into set", category="copy"):
+              merge_into_set(f"{activepath}/{this_folder_name}", f"{copy_to_path}/{set_to_build}",
+                             this_folder_name, copy_to_path + "/" + mesh_store_folder, args.mesh_links)
             err_str += f"TASK ADDED: {set_to_build}/{this_folder_name}\n"
           else: err_str += f"TASK FOUND ALREADY FOR {set_to_build}/{this_folder_name}\n"
 
-  # finally, copy the built set into the specified object sets folder
-  if not args.build_only:
-    shutil.copytree(activepath, setpath + "/" + set_to_build)
+    if os.path.exists(scratch_path): shutil.rmtree(scratch_path)
 
-    # are we copying to an additional directory
-    if args.copy_to != "no" and allow_copy_to:
-      copy_to_path = filepath + "/" + args.copy_to
-      print(f"build_multi_segment_set.py is about to copy the object set to: {copy_to_path}")
-      if copy_choice is None:
-        if args.copy_to_yes == "yes": copy_choice = "yes"
-        else:
-          copy_choice = input("Type yes to continue (this choice will apply to all sets being built)\n> ")
-      if copy_choice.lower() in ["y", "yes"]:
-        try:
-          shutil.copytree(activepath, copy_to_path + "/" + set_to_build)
-          print("Copy operation complete\n")
-          err_str += f"Generated {set_to_build} and moved it to: {copy_to_path}/{set_to_build}"
-        except FileExistsError as e:
-          if args.copy_to_override == "yes":
-            delete_folder = "deleted"
-            timestamp = datetime.now().strftime("%d-%m-%y_%H-%M-%S")
-            if not os.path.exists(copy_to_path + f"/{delete_folder}"):
-              os.makedirs(copy_to_path + f"/{delete_folder}")
-            err_str += f"Existing object set '{set_to_build}' found, moved to '{copy_to_path}/{delete_folder}' with timestamp: {timestamp}\n"
-            shutil.move(copy_to_path + "/" + set_to_build, copy_to_path + f"/{delete_folder}/" + set_to_build + f"_{timestamp}")
-            shutil.copytree(activepath, copy_to_path + "/" + set_to_build)
-            err_str += f"Generated {set_to_build} and moved it to: {copy_to_path}/{set_to_build}"
+    # finally, copy the built set into the specified object sets folder
+    if not args.build_only:
+      with span("publish set", category="copy"):
+        sync_set(activepath, setpath + "/" + set_to_build, setpath + "/" + mesh_store_folder,
+                 args.mesh_links)
+
+      # are we copying to an additional directory
+      if args.copy_to != "no" and allow_copy_to:
+        copy_to_path = filepath + "/" + args.copy_to
+        print(f"build_multi_segment_set.py is about to copy the object set to: {copy_to_path}")
+        if copy_choice is None:
+          if args.copy_to_yes == "yes": copy_choice = "yes"
           else:
-            print(f"Copy operation failed because object set '{set_to_build}' already exists: {e}")
+            copy_choice = input("Type yes to continue (this choice will apply to all sets being built)\n> ")
+        if copy_choice.lower() in ["y", "yes"]:
+          target = copy_to_path + "/" + set_to_build
+          if os.path.exists(target) and args.copy_to_override != "yes":
+            print(f"Copy operation failed because object set '{set_to_build}' already exists")
             err_str += f"COPY FAILED, OBJECT SET ALREADY EXISTS: '{set_to_build}'\n"
-      else:
-        print("Copy operation aborted")
+          else:
+            # the existing set is kept aside, without copying it
+            backup = None
+            if os.path.exists(target):
+              delete_folder = "deleted"
+              timestamp = datetime.now().strftime("%d-%m-%y_%H-%M-%S")
+              if not os.path.exists(copy_to_path + f"/{delete_folder}"):
+                os.makedirs(copy_to_path + f"/{delete_folder}")
+              backup = copy_to_path + f"/{delete_folder}/" + set_to_build + f"_{timestamp}"
+              err_str += f"Existing object set '{set_to_build}' found, moved to '{copy_to_path}/{delete_folder}' with timestamp: {timestamp}\n"
+            with span("copy set", category="copy"):
+              copied, reused = sync_set(activepath, target, copy_to_path + "/" + mesh_store_folder,
+                                        args.mesh_links, backup)
+            print(f"Copy operation complete, {copied} files copied and {reused} unchanged\n")
+            err_str += f"Generated {set_to_build} and moved it to: {copy_to_path}/{set_to_build}"
+        else:
+          print("Copy operation aborted")
 
 if err_str != "": print(f"\n{err_str}\n")
 
@@ -294,4 +1053,12 @@ gripper_details["gripper_params"]["finger_width"] = original_W
 
 # write the overwritten dictionary to the file
 with open(description_path + gripper_config_file, "w") as outfile:
-  yaml.dump(gripper_details, outfile, default_flow_style=False)
\ No newline at end of file
+  yaml.dump(gripper_details, outfile, default_flow_style=False)
+
+# export the spans of every process as a chrome trace, and summarise each stage
+if args.trace == "yes":
+  spans = load_spans(filepath + "/" + trace_folder)
+  save_chrome_trace(spans, filepath + "/" + trace_folder + "/trace.json")
+  print()
+  print_summary(spans)
+  print(f"\nBuild trace saved to: {filepath}/{trace_folder}/trace.json (open in ui.perfetto.dev)")
\ No newline at end of file
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+"""
+Tracing of the build pipeline. Code is wrapped in nested spans, each recording
+its wall time, cpu time (including any subprocesses it waited for), peak
+resident memory and bytes written, with labels such as the set, N and width
+being built:
+
+  from build_trace import span
+
+  with span("write task files", category="files", N=8) as s:
+    ...
+    s["bytes"] += extra_bytes # eg outputs written by a subprocess
+
+Spans on the main thread measure the whole process, including any threads
+started inside them. Spans on other threads (the steps the build graph runs in
+parallel) measure only their own thread, so the cpu time and bytes written by
+any subprocess they wait for must be added to "cpu" and "bytes" by the caller.
+
+Tracing is off (spans do nothing) unless the BUILD_TRACE environment variable
+names a folder, where every process appends its spans. Subprocesses inherit
+it, so build_multi_segment_set.py, xml_script.py and build_object_set.py all
+add to the same trace, and commands can be traced from the Makefile with:
+
+  python3 build_trace.py <name> [--output file] -- command args...
+
+At the end of a build the spans are exported as a Chrome trace-event JSON file
+(open in chrome://tracing or ui.perfetto.dev) and a per stage summary table.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import contextlib
+import subprocess
+import argparse
+
+# folder where every process appends its spans, tracing is off if not set
+trace_env = "BUILD_TRACE"
+
+# labels added to every span of a process (json), so subprocesses keep them
+labels_env = "BUILD_TRACE_LABELS"
+
+# labels of the open spans in each thread, inner spans inherit them
+open_spans = threading.local()
+
+def get_label_stack():
+  """
+  Get the labels of the open spans in this thread, outermost first
+  """
+  if not hasattr(open_spans, "labels"): open_spans.labels = []
+  return open_spans.labels
+
+def enabled():
+  """
+  Is this process recording spans
+  """
+  return os.environ.get(trace_env) is not None
+
+def start_trace(folder):
+  """
+  Turn on tracing for this process and every subprocess it starts, replacing
+  any spans from a previous trace in folder
+  """
+  if os.path.isdir(folder):
+    for x in os.listdir(folder):
+      if x.startswith("spans_"): os.remove(folder + "/" + x)
+  os.makedirs(folder, exist_ok=True)
+  os.environ[trace_env] = os.path.abspath(folder)
+
+  # scripts run from other folders (eg build_object_set.py) import this module
+  path = os.path.dirname(os.path.abspath(__file__))
+  os.environ["PYTHONPATH"] = os.pathsep.join([path] + [x for x in
+    os.environ.get("PYTHONPATH", "").split(os.pathsep) if x != ""])
+
+def get_labels():
+  """
+  Get the labels of the innermost open span, including those inherited from
+  the process which started this one
+  """
+  labels = json.loads(os.environ.get(labels_env, "{}"))
+  for x in get_label_stack(): labels.update(x)
+  return labels
+
+def get_env(**labels):
+  """
+  Get a copy of the environment for a subprocess, whose spans will carry the
+  labels of the open spans here plus the given labels
+  """
+  env = dict(os.environ)
+  if enabled(): env[labels_env] = json.dumps(dict(get_labels(), **labels))
+  return env
+
+def on_main_thread():
+  """
+  Is this the main thread, whose spans measure the whole process
+  """
+  return threading.current_thread() is threading.main_thread()
+
+def get_bytes_written():
+  """
+  Get the bytes this process has written so far, or only this thread if it is
+  not the main thread (only available on linux)
+  """
+  try:
+    with open("/proc/self/io" if on_main_thread() else "/proc/thread-self/io") as file:
+      for line in file:
+        if line.startswith("wchar:"): return int(line.split()[1])
+  except OSError: pass
+  return 0
+
+def get_cpu_seconds():
+  """
+  Get the cpu time of this process and every subprocess it has waited for, or
+  only this thread if it is not the main thread (as the subprocesses waited
+  for by each thread cannot be told apart)
+  """
+  if not on_main_thread(): return time.thread_time()
+  own = resource.getrusage(resource.RUSAGE_SELF)
+  children = resource.getrusage(resource.RUSAGE_CHILDREN)
+  return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def get_peak_rss_mb():
+  """
+  Get the peak resident memory of this process or its largest subprocess, in MB
+  """
+  own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  return max(own, children) / 1e3
+
+@contextlib.contextmanager
+def span(name, category="stage", **labels):
+  """
+  Record the code inside as a span, yielding a dictionary where extra bytes
+  written (eg by a subprocess) can be added to "bytes", and on threads other
+  than the main thread the cpu time of subprocesses to "cpu"
+  """
+
+  extra = {"bytes": 0, "cpu": 0}
+  if not enabled():
+    yield extra
+    return
+
+  get_label_stack().append(labels)
+  start = time.time()
+  cpu = get_cpu_seconds()
+  written = get_bytes_written()
+  try:
+    yield extra
+  finally:
+    record = {
+      "name": name,
+      "category": category,
+      "process": os.path.basename(sys.argv[0]),
+      "pid": os.getpid(),
+      "tid": threading.get_native_id(),
+      "start": start,
+      "end": time.time(),
+      "cpu": get_cpu_seconds() - cpu + extra["cpu"],
+      "rss_mb": get_peak_rss_mb(),
+      "bytes": get_bytes_written() - written + extra["bytes"],
+      "labels": get_labels(),
+    }
+    get_label_stack().pop()
+    folder = os.environ[trace_env]
+    with open(f"{folder}/spans_{os.getpid()}.jsonl", "a") as outfile:
+      outfile.write(json.dumps(record) + "\n")
+
+def load_spans(folder):
+  """
+  Load the spans every process recorded in folder, in order of starting
+  """
+  spans = []
+  for x in sorted(os.listdir(folder)):
+    if x.startswith("spans_"):
+      with open(folder + "/" + x) as file:
+        spans += [json.loads(line) for line in file if line.strip() != ""]
+  return sorted(spans, key=lambda x: x["start"])
+
+def save_chrome_trace(spans, filename):
+  """
+  Save spans in the Chrome trace-event JSON format, one timeline per process
+  """
+  origin = min([x["start"] for x in spans], default=0)
+  events = []
+  for pid, process in sorted(set([(x["pid"], x["process"]) for x in spans])):
+    events.append({"name": "process_name", "ph": "M", "pid": pid,
+                   "args": {"name": f"{process} ({pid})"}})
+  for x in spans:
+    events.append({
+      "name": x["name"],
+      "cat": x["category"],
+      "ph": "X",
+      "ts": round((x["start"] - origin) * 1e6),
+      "dur": round((x["end"] - x["start"]) * 1e6),
+      "pid": x["pid"],
+      "tid": x["tid"],
+      "args": dict(x["labels"], cpu_s=round(x["cpu"], 4), peak_rss_mb=round(x["rss_mb"], 1),
+                   bytes_written=x["bytes"]),
+    })
+  with open(filename, "w") as outfile:
+    json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, outfile)
+
+def print_summary(spans):
+  """
+  Print the total wall time, cpu time and bytes written of every span name,
+  and the peak memory. Nested spans are also included in their parents
+  """
+  stages = {}
+  for x in spans:
+    key = (x["category"], x["name"])
+    if key not in stages: stages[key] = {"calls": 0, "wall": 0, "cpu": 0, "rss_mb": 0, "bytes": 0}
+    stage = stages[key]
+    stage["calls"] += 1
+    stage["wall"] += x["end"] - x["start"]
+    stage["cpu"] += x["cpu"]
+    stage["rss_mb"] = max(stage["rss_mb"], x["rss_mb"])
+    stage["bytes"] += x["bytes"]
+
+  print(f"{'stage':<36}{'category':<12}{'calls':>6}{'wall s':>10}{'cpu s':>10}"
+        f"{'peak MB':>10}{'written MB':>12}")
+  for (category, name), stage in sorted(stages.items(), key=lambda x: -x[1]["wall"]):
+    print(f"{name:<36}{category:<12}{stage['calls']:>6}{stage['wall']:>10.2f}{stage['cpu']:>10.2f}"
+          f"{stage['rss_mb']:>10.1f}{stage['bytes'] / 1e6:>12.2f}")
+
+if __name__ == "__main__":
+
+  # run a command inside a span, eg from the Makefile
+  parser = argparse.ArgumentParser()
+  parser.add_argument("name")
+  parser.add_argument("--output", default=None) # file the command writes, added to the bytes
+
+  # everything after '--' is the command, so its own options are not parsed here
+  split = sys.argv.index("--") if "--" in sys.argv else len(sys.argv)
+  args = parser.parse_args(sys.argv[1:split])
+  command = sys.argv[split + 1:]
+  with span(args.name, category="subprocess") as s:
+    result = subprocess.run(command)
+    if args.output is not None and os.path.exists(args.output):
+      s["bytes"] += os.path.getsize(args.output)
+  exit(result.returncode)
@@ -0,0 +1,695 @@
+#!/usr/bin/env python3
+
+"""
+Generate the mujoco model of the gripper, build/gripper_task.xml, directly from
+the gripper config without xacro or the mujoco compile tool. The links and
+joints of xacro/gripper.main.xacro, xacro/gripper.segmented_fingers.xacro and
+mujoco/xacro/gripper_task.urdf.xacro are rebuilt here, the mass and inertia of
+every finger segment are computed at once with the xacro formulas, and links on
+fixed joints are merged into their parent bodies as the compile tool does. A
+model for any number of segments or finger width takes milliseconds:
+
+  from gripper_mjcf import generate_mjcf
+  generate_mjcf(gripper_details, "build/gripper_task.xml")
+
+The values set by hand in the xacros are repeated below. After changing the
+xacros, check the generated model still matches the compiled urdf with:
+
+  python3 gripper_mjcf.py --validate --compiler <mujoco>/bin/compile --segments 5 8 30 --widths 24 28
+"""
+
+import os
+import copy
+import time
+import shutil
+import tempfile
+import subprocess
+import argparse
+import yaml
+import numpy as np
+from lxml import etree
+
+# get relevant path information
+filepath = os.path.dirname(os.path.abspath(__file__))
+description_path = os.path.dirname(filepath)
+
+# ----- values set by hand in the xacros ----- #
+
+# where the segmented fingers attach to the finger platform (gripper.xacro)
+finger_fix_xyz = (0.129, 0, 0)
+
+# inertials of the gripper links from solidworks (gripper.main.xacro), as
+# (mass, origin xyz, origin rpy, (ixx, iyy, izz, ixy, ixz, iyz))
+base_inertial = (1.5, (0, 0, 25 * 0.001), (np.pi, 0, 0),
+                 (9.95e-3, 10.08e-3, 5.13e-3, 2.73e-6, -14.32e-6, 121.38e-6))
+intermediate_inertial = (0.1, (0, 0, 0), (0, 0, 0),
+                         (55.59e-6, 146.36e-6, 154.18e-6, -47.23e-6, 1.16e-6, 1.00e-6))
+platform_inertial = intermediate_inertial # a copy of the above in the xacro
+rigid_finger_inertial = (0.2, (0, 0, 0), (0, 0, 0),
+                         (283.44e-6, 1.38e-3, 1.60e-3, -567.23e-6, -6.59e-6, 2.40e-6))
+palm_inertial = (0.05, (0, 0, 0), (0, 0, 0), (10.0e-6, 10.0e-6, 10.0e-6, 0.0, 0.0, 0.0))
+
+# links of the xy base joints (gripper_task.urdf.xacro)
+base_joint_inertial = (1.0, (0, 0, 0), (0, 0, 0), (1e-3, 1e-3, 1e-3, 0, 0, 0))
+
+# joint dynamics and limits
+gripper_joint_damping = 1.0 # gripper.main.xacro
+base_joint_damping = 1.0 # gripper_task.urdf.xacro
+base_joint_limit = 1.0
+base_rotation_limit = 1000.0
+segment_joint_damping = 0.01 # gripper.segmented_fingers.xacro
+segment_joint_friction = 0.0
+segment_joint_limit = 1.0
+hook_joint_damping = 100.0 # only if the hook is not fixed
+hook_joint_friction = 100.0
+
+# the fingertip meshes are made for a 28mm wide finger with a 35mm hook
+fingertip_mesh_width = 28e-3
+fingertip_mesh_length = 35e-3
+
+# height of the gripper base when the finger ends touch the ground, without the
+# finger length (gripper_task.urdf.xacro)
+fingerend_touches_ground = 0.1407
+
+# the value of pi typed into each xacro, which changes the last digits
+hook_angle_pi = 3.1415926535897 # gripper.segmented_fingers.xacro
+base_height_pi = 3.141592 # gripper_task.urdf.xacro
+
+# compiler settings (mujoco/xacro/mujoco.xacro)
+mesh_folder = "./meshes_mujoco/"
+size_settings = {"njmax": "3400", "nconmax": "800"}
+balance_inertia = True
+
+# ----- segment mass and inertia ----- #
+
+def get_segment_inertia(mass, length, width, thickness):
+  """
+  Get the diagonal inertia of finger segments, boxes along x which rotate about
+  y and z at one end, as in gripper.segmented_fingers.xacro. Any argument can
+  be an array (eg every segment, or many widths), the result has a last axis
+  of (ixx, iyy, izz)
+  """
+  return np.stack(np.broadcast_arrays(
+    (1.0/12.0) * mass * (thickness ** 2 + width ** 2),
+    (1.0/12.0) * mass * (length ** 2 + thickness ** 2) + mass * (length / 2.0) ** 2,
+    (1.0/12.0) * mass * (length ** 2 + width ** 2) + mass * (length / 2.0) ** 2,
+  ), axis=-1)
+
+def get_finger_links(gripper_details):
+  """
+  Get the length, mass, box size and scaled diagonal inertia of every link of
+  a finger in one step, rows are the segments followed by the hook
+  """
+  params = gripper_details["gripper_params"]
+  num_segments = gripper_details["gripper_config"]["num_segments"]
+  finger_length = params["finger_length"]
+  hook_length = params["hook_length"]
+
+  length = np.append(np.full(num_segments, finger_length / float(num_segments)), hook_length)
+  mass = (params["finger_mass"] * length) / (finger_length + hook_length)
+  inertia = get_segment_inertia(mass, length, params["finger_width"], params["finger_thickness"])
+  size = np.stack(np.broadcast_arrays(length, params["finger_width"], params["finger_thickness"]),
+                  axis=1)
+
+  return {
+    "length": length,
+    "mass": mass,
+    "inertia": inertia * params["segment_inertia_scaling"],
+    "size": size,
+  }
+
+# ----- rotations ----- #
+
+def get_rotation(rpy):
+  """
+  Get the rotation matrix of urdf roll, pitch and yaw angles
+  """
+  r, p, y = rpy
+  rx = np.array([[1, 0, 0], [0, np.cos(r), -np.sin(r)], [0, np.sin(r), np.cos(r)]])
+  ry = np.array([[np.cos(p), 0, np.sin(p)], [0, 1, 0], [-np.sin(p), 0, np.cos(p)]])
+  rz = np.array([[np.cos(y), -np.sin(y), 0], [np.sin(y), np.cos(y), 0], [0, 0, 1]])
+  return rz @ ry @ rx
+
+def get_quat(rotation):
+  """
+  Get the quaternion (w, x, y, z) of a rotation matrix
+  """
+  m = rotation
+  trace = np.trace(m)
+  if trace > 0:
+    s = 2 * np.sqrt(1 + trace)
+    quat = [s / 4, (m[2, 1] - m[1, 2]) / s, (m[0, 2] - m[2, 0]) / s, (m[1, 0] - m[0, 1]) / s]
+  elif m[0, 0] > m[1, 1] and m[0, 0] > m[2, 2]:
+    s = 2 * np.sqrt(1 + m[0, 0] - m[1, 1] - m[2, 2])
+    quat = [(m[2, 1] - m[1, 2]) / s, s / 4, (m[0, 1] + m[1, 0]) / s, (m[0, 2] + m[2, 0]) / s]
+  elif m[1, 1] > m[2, 2]:
+    s = 2 * np.sqrt(1 + m[1, 1] - m[0, 0] - m[2, 2])
+    quat = [(m[0, 2] - m[2, 0]) / s, (m[0, 1] + m[1, 0]) / s, s / 4, (m[1, 2] + m[2, 1]) / s]
+  else:
+    s = 2 * np.sqrt(1 + m[2, 2] - m[0, 0] - m[1, 1])
+    quat = [(m[1, 0] - m[0, 1]) / s, (m[0, 2] + m[2, 0]) / s, (m[1, 2] + m[2, 1]) / s, s / 4]
+  return np.array(quat) / np.linalg.norm(quat)
+
+def get_quat_rotation(quat):
+  """
+  Get the rotation matrix of a quaternion (w, x, y, z)
+  """
+  w, x, y, z = np.array(quat, dtype=float) / np.linalg.norm(quat)
+  return np.array([
+    [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+    [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+    [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+  ])
+
+def get_principal_inertia(inertia):
+  """
+  Get the principal moments (largest first) and axes of an inertia tensor, the
+  axes are the columns of a rotation matrix. Moments which break the triangle
+  inequality are replaced by their mean, as with balanceinertia
+  """
+  off_diagonal = inertia - np.diag(np.diag(inertia))
+  if np.all(off_diagonal == 0):
+    order = np.argsort(-np.diag(inertia), kind="stable")
+    values = np.diag(inertia)[order]
+    axes = np.eye(3)[:, order]
+  else:
+    values, axes = np.linalg.eigh(inertia)
+    values, axes = values[::-1], axes[:, ::-1]
+  if np.linalg.det(axes) < 0: axes = axes * [1, 1, -1]
+  if balance_inertia and values[1] + values[2] < values[0]:
+    values = np.full(3, np.mean(values))
+  return values, axes
+
+# ----- links and joints ----- #
+
+def get_inertial(mass, xyz, rpy, inertia):
+  """
+  Get a link inertial from urdf values, with the inertia tensor in the link frame
+  """
+  ixx, iyy, izz, ixy, ixz, iyz = inertia
+  rotation = get_rotation(rpy)
+  tensor = np.array([[ixx, ixy, ixz], [ixy, iyy, iyz], [ixz, iyz, izz]])
+  return {"mass": mass, "pos": np.array(xyz, dtype=float),
+          "inertia": rotation @ tensor @ rotation.T}
+
+def get_geom(geom_type, size=None, xyz=(0, 0, 0), rpy=(0, 0, 0), mesh=None, scale=None,
+             visual=False):
+  """
+  Get a geom from a urdf visual or collision, the mesh is a file name
+  """
+  return {"type": geom_type, "size": size, "pos": np.array(xyz, dtype=float),
+          "rotation": get_rotation(rpy), "mesh": mesh, "scale": scale, "visual": visual}
+
+def get_mesh_geoms(visual_mesh, collision_mesh):
+  """
+  Get the visual and collision geoms of a link made of two meshes
+  """
+  return [get_geom("mesh", mesh=visual_mesh + ".STL", visual=True),
+          get_geom("mesh", mesh=collision_mesh + ".STL")]
+
+def get_joint(name, joint_type, parent, child, xyz=(0, 0, 0), rpy=(0, 0, 0), axis=(1, 0, 0),
+              limits=None, damping=0.0, friction=0.0):
+  """
+  Get a joint from urdf values, limits are (lower, upper)
+  """
+  return {"name": name, "type": joint_type, "parent": parent, "child": child,
+          "pos": np.array(xyz, dtype=float), "rotation": get_rotation(rpy),
+          "axis": np.array(axis, dtype=float), "limits": limits, "damping": damping,
+          "friction": friction}
+
+def get_gripper_links(gripper_details):
+  """
+  Get the links and joints of the gripper_task robot, in the order of the urdf
+  """
+
+  config = gripper_details["gripper_config"]
+  params = gripper_details["gripper_params"]
+  links = {}
+  joints = []
+
+  def add_link(name, inertial=None, geoms=()):
+    links[name] = {"name": name, "inertial": inertial, "geoms": list(geoms)}
+
+  # ----- gripper.main.xacro ----- #
+
+  add_link("gripper_base_link", get_inertial(*base_inertial), [
+    get_geom("mesh", mesh="main body visual.STL", visual=True),
+    get_geom("cylinder", size=(0.03, 0.1 / 2)),
+  ])
+
+  for number in [1, 2, 3]:
+    finger = f"finger_{number}"
+    add_link(f"{finger}_intermediate", get_inertial(*intermediate_inertial),
+             get_mesh_geoms("nut visual", "nut collision"))
+    if config["is_segmented"]:
+      add_link(finger, get_inertial(*platform_inertial),
+               get_mesh_geoms("platform only visual", "platform only collision"))
+    else:
+      add_link(finger, get_inertial(*rigid_finger_inertial),
+               get_mesh_geoms("finger platform visual", "finger platform collision"))
+
+    angle = (number - 1) * ((2 * np.pi) / 3)
+    rpy = (3 * np.pi / 2, 3 * np.pi / 2, (np.pi / 2) - angle)
+    if config["fixed_motor_joints"]:
+      joints.append(get_joint(f"{finger}_prismatic_joint", "fixed", "gripper_base_link",
+                              f"{finger}_intermediate", (100e-3 * np.sin(angle), 100e-3 * np.cos(angle), 0), rpy))
+      joints.append(get_joint(f"{finger}_revolute_joint", "fixed", f"{finger}_intermediate", finger))
+    else:
+      joints.append(get_joint(f"{finger}_prismatic_joint", "prismatic", "gripper_base_link",
+                              f"{finger}_intermediate", (0, 0, 0), rpy, axis=(0, 1, 0),
+                              limits=(params["xy_min"], params["xy_max"]),
+                              damping=gripper_joint_damping))
+      joints.append(get_joint(f"{finger}_revolute_joint", "revolute", f"{finger}_intermediate",
+                              finger, axis=(0, 0, 1),
+                              limits=(-1 * params["angle_max_abs"], params["angle_max_abs"]),
+                              damping=gripper_joint_damping))
+
+  add_link("palm", get_inertial(*palm_inertial),
+           get_mesh_geoms("palm sensor visual", "palm sensor visual"))
+  joints.append(get_joint("palm_prismatic_joint", "prismatic", "gripper_base_link", "palm",
+                          rpy=(0, -np.pi / 2, 0), axis=(1, 0, 0),
+                          limits=(params["z_min"], params["z_max"]),
+                          damping=gripper_joint_damping))
+
+  # ----- gripper.segmented_fingers.xacro ----- #
+
+  if config["is_segmented"]:
+
+    num_segments = config["num_segments"]
+    if num_segments < 3:
+      raise ValueError(f"num_segments is {num_segments}, the segmented finger xacro needs at least 3")
+
+    finger_links = get_finger_links(gripper_details)
+    length = finger_links["length"][0]
+    hook_length = params["hook_length"]
+    width = params["finger_width"]
+    hook_angle = params["hook_angle_degrees"] * (hook_angle_pi / 180.0)
+    torsion = config["torsion"]
+    segment_limits = (-segment_joint_limit, segment_joint_limit)
+
+    for number in [1, 2, 3]:
+      prefix = f"finger_{number}"
+
+      # joints then links, in the order the xacro loop adds them
+      if config["fixed_first_segment"]:
+        joints.append(get_joint(f"{prefix}_fixed_segment_connection", "fixed", prefix,
+                                f"{prefix}_segment_link_1", finger_fix_xyz, (np.pi / 2, 0, 0)))
+      else:
+        joints.append(get_joint(f"{prefix}_segment_joint_0", "revolute", prefix,
+                                f"{prefix}_segment_link_1", finger_fix_xyz, (np.pi / 2, 0, 0),
+                                axis=(0, 1, 0), limits=segment_limits,
+                                damping=segment_joint_damping, friction=segment_joint_friction))
+
+      for i in range(num_segments):
+        segment = i + 1
+        add_link(f"{prefix}_segment_link_{segment}", {
+          "mass": finger_links["mass"][i],
+          "pos": np.zeros(3),
+          "inertia": np.diag(finger_links["inertia"][i]),
+        }, [get_geom("box", size=finger_links["size"][i] / 2, xyz=(length / 2, 0, 0), visual=True),
+            get_geom("box", size=finger_links["size"][i] / 2, xyz=(length / 2, 0, 0))])
+
+        # every other joint twists the finger if torsion is used
+        if segment > 1:
+          bending = (segment % 2 * torsion) + (1 - torsion)
+          joints.append(get_joint(f"{prefix}_segment_joint_{segment - 1}", "revolute",
+                                  f"{prefix}_segment_link_{segment - 1}",
+                                  f"{prefix}_segment_link_{segment}", (length, 0, 0),
+                                  axis=(0, 1, 0) if bending else (1, 0, 0),
+                                  limits=segment_limits, damping=segment_joint_damping,
+                                  friction=segment_joint_friction))
+
+      add_link(f"{prefix}_finger_hook_link", {
+        "mass": finger_links["mass"][-1],
+        "pos": np.zeros(3),
+        "inertia": np.diag(finger_links["inertia"][-1]),
+      }, [get_geom("mesh", mesh="fingertip 28mm visual.STL", rpy=(0, 0, -np.pi / 2),
+                   scale=(width / fingertip_mesh_width, 1, 1), visual=True),
+          get_geom("mesh", mesh="fingertip 28mm collision.STL", rpy=(0, 0, -np.pi / 2),
+                   scale=(width / fingertip_mesh_width, hook_length / fingertip_mesh_length, 1))])
+
+      if config["fixed_hook_segment"]:
+        joints.append(get_joint(f"{prefix}_finger_hook_joint", "fixed",
+                                f"{prefix}_segment_link_{num_segments}",
+                                f"{prefix}_finger_hook_link", (length, 0, 0), (0, -hook_angle, 0)))
+      else:
+        joints.append(get_joint(f"{prefix}_finger_hook_joint", "revolute",
+                                f"{prefix}_segment_link_{num_segments}",
+                                f"{prefix}_finger_hook_link", (length, 0, 0), (0, -hook_angle, 0),
+                                axis=(0, 1, 0), limits=segment_limits,
+                                damping=hook_joint_damping, friction=hook_joint_friction))
+
+  # ----- gripper_task.urdf.xacro ----- #
+
+  # the base starts with the finger ends just above the ground
+  if params["hook_angle_degrees"] > 90:
+    hook_extra = 0.0
+  else:
+    hook_extra = params["hook_length"] * np.cos(params["hook_angle_degrees"] * (base_height_pi / 180.0))
+  height = (fingerend_touches_ground + params["finger_length"]) + params["fingertip_clearance"] + hook_extra
+  base_limits = (-base_joint_limit, base_joint_limit)
+
+  add_link("world")
+  if config["xy_base_joint"]:
+    add_link("base_XY", get_inertial(*base_joint_inertial))
+    add_link("base_YZ", get_inertial(*base_joint_inertial))
+    joints.append(get_joint("base_X_joint", "prismatic", "world", "base_XY", (0, 0, height),
+                            (np.pi, 0, 0), axis=(1, 0, 0), limits=base_limits,
+                            damping=base_joint_damping))
+    joints.append(get_joint("base_Y_joint", "prismatic", "base_XY", "base_YZ", axis=(0, -1, 0),
+                            limits=base_limits, damping=base_joint_damping))
+    if config["z_base_rotation"]:
+      add_link("base_ZrotZ", get_inertial(*base_joint_inertial))
+      joints.append(get_joint("base_Z_joint", "prismatic", "base_YZ", "base_ZrotZ",
+                              axis=(0, 0, 1), limits=base_limits, damping=base_joint_damping))
+      joints.append(get_joint("base_Z_rotation_joint", "revolute", "base_ZrotZ",
+                              "gripper_base_link", axis=(0, 0, 1),
+                              limits=(-base_rotation_limit, base_rotation_limit),
+                              damping=base_joint_damping))
+    else:
+      joints.append(get_joint("base_Z_joint", "prismatic", "base_YZ", "gripper_base_link",
+                              axis=(0, 0, 1), limits=base_limits, damping=base_joint_damping))
+  else:
+    joints.append(get_joint("world_to_base", "prismatic", "world", "gripper_base_link",
+                            (0, 0, height), (np.pi, 0, 0), axis=(0, 0, 1), limits=base_limits,
+                            damping=base_joint_damping))
+
+  return links, joints
+
+def combine_inertials(first, second):
+  """
+  Get the inertial of two bodies joined together, both in the same frame
+  """
+  mass = first["mass"] + second["mass"]
+  pos = (first["mass"] * first["pos"] + second["mass"] * second["pos"]) / mass
+  inertia = np.zeros((3, 3))
+  for x in [first, second]:
+    d = x["pos"] - pos
+    inertia += x["inertia"] + x["mass"] * (np.dot(d, d) * np.eye(3) - np.outer(d, d))
+  return {"mass": mass, "pos": pos, "inertia": inertia}
+
+def merge_fixed_joints(links, joints):
+  """
+  Merge the child link of every fixed joint into its parent, as the compiler
+  does with static bodies. Its geoms and any joints leaving it are moved into
+  the parent frame (taking its place in the order of bodies), and the
+  inertials are combined
+  """
+  links = dict(links)
+  for joint in [x for x in joints if x["type"] == "fixed"]:
+    parent = links[joint["parent"]]
+    child = links.pop(joint["child"])
+    pos, rotation = joint["pos"], joint["rotation"]
+
+    for geom in child["geoms"]:
+      parent["geoms"].append(dict(geom, pos=pos + rotation @ geom["pos"],
+                                  rotation=rotation @ geom["rotation"]))
+
+    if child["inertial"] is not None:
+      moved = {"mass": child["inertial"]["mass"],
+               "pos": pos + rotation @ child["inertial"]["pos"],
+               "inertia": rotation @ child["inertial"]["inertia"] @ rotation.T}
+      if parent["inertial"] is None: parent["inertial"] = moved
+      else: parent["inertial"] = combine_inertials(parent["inertial"], moved)
+
+    moved = [x for x in joints if x["parent"] == child["name"]]
+    for x in moved:
+      x.update(parent=parent["name"], pos=pos + rotation @ x["pos"],
+               rotation=rotation @ x["rotation"])
+    index = joints.index(joint)
+    joints = ([x for x in joints[:index] if not any([x is y for y in moved])] + moved
+              + [x for x in joints[index:] if not any([x is y for y in moved])])
+
+  return links, [x for x in joints if x["type"] != "fixed"]
+
+# ----- mjcf output ----- #
+
+def format_numbers(values):
+  """
+  Format numbers as the compiler writes them, to 6 significant figures, with
+  rounding errors of rotations written as zero
+  """
+  text = []
+  for x in np.atleast_1d(values):
+    x = f"{0 if abs(x) < 1e-12 else x:.6g}"
+    text.append("0" if x == "-0" else x)
+  return " ".join(text)
+
+def set_pose(element, pos, rotation, always_pos=False):
+  """
+  Set the pos and quat attributes of an element, leaving out default values
+  """
+  if always_pos or np.any(np.abs(pos) > 1e-12):
+    element.set("pos", format_numbers(pos))
+  if not np.allclose(rotation, np.eye(3), rtol=0, atol=1e-12):
+    element.set("quat", format_numbers(get_quat(rotation)))
+
+def add_body(parent_element, link, joint, links, joints):
+  """
+  Add the body of link (with the joint leading to it) and then its children
+  """
+
+  body = etree.SubElement(parent_element, "body", {"name": link["name"]})
+  set_pose(body, joint["pos"], joint["rotation"])
+
+  if link["inertial"] is not None:
+    values, axes = get_principal_inertia(link["inertial"]["inertia"])
+    inertial = etree.SubElement(body, "inertial")
+    set_pose(inertial, link["inertial"]["pos"], axes, always_pos=True)
+    inertial.set("mass", format_numbers(link["inertial"]["mass"]))
+    inertial.set("diaginertia", format_numbers(values))
+
+  element = etree.SubElement(body, "joint", {"name": joint["name"]})
+  if joint["type"] == "prismatic": element.set("type", "slide")
+  if joint["limits"] is not None:
+    element.set("limited", "true")
+    element.set("range", format_numbers(joint["limits"]))
+  element.set("damping", format_numbers(joint["damping"]))
+  if joint["friction"] != 0: element.set("frictionloss", format_numbers(joint["friction"]))
+  if not np.array_equal(joint["axis"], [0, 0, 1]): element.set("axis", format_numbers(joint["axis"]))
+
+  for geom in link["geoms"]:
+    element = etree.SubElement(body, "geom")
+    if geom["size"] is not None: element.set("size", format_numbers(geom["size"]))
+    set_pose(element, geom["pos"], geom["rotation"])
+    element.set("type", geom["type"])
+    if geom["visual"]:
+      element.attrib.update({"contype": "0", "conaffinity": "0", "group": "1", "density": "0"})
+    if geom["mesh"] is not None:
+      element.set("mesh", os.path.splitext(geom["mesh"])[0])
+
+  for x in joints:
+    if x["parent"] == link["name"]:
+      add_body(body, links[x["child"]], x, links, joints)
+
+def get_mjcf(gripper_details, model_name="gripper_task"):
+  """
+  Get the mjcf tree of the gripper_task robot for a gripper configuration
+  """
+
+  links, joints = get_gripper_links(gripper_details)
+
+  # meshes are named after their file, in the order of the urdf links
+  meshes = {}
+  for link in links.values():
+    for geom in link["geoms"]:
+      if geom["mesh"] is not None:
+        meshes.setdefault(os.path.splitext(geom["mesh"])[0], (geom["mesh"], geom["scale"]))
+
+  links, joints = merge_fixed_joints(links, joints)
+
+  root = etree.Element("mujoco", {"model": model_name})
+  etree.SubElement(root, "compiler", {"angle": "radian", "meshdir": mesh_folder})
+  etree.SubElement(root, "size", size_settings)
+  asset = etree.SubElement(root, "asset")
+  worldbody = etree.SubElement(root, "worldbody")
+
+  for x in joints:
+    if x["parent"] == "world":
+      add_body(worldbody, links[x["child"]], x, links, joints)
+
+  for name, (filename, scale) in meshes.items():
+    mesh = etree.SubElement(asset, "mesh", {"name": name, "file": filename})
+    if scale is not None and not np.allclose(scale, 1, rtol=0, atol=1e-12):
+      mesh.set("scale", format_numbers(scale))
+
+  etree.indent(root, space="  ")
+  return etree.ElementTree(root)
+
+def generate_mjcf(gripper_details, filename):
+  """
+  Write the gripper_task robot mjcf file for a gripper configuration
+  """
+  tree = get_mjcf(gripper_details, os.path.splitext(os.path.basename(filename))[0])
+  with open(filename, "wb") as outfile:
+    outfile.write(etree.tostring(tree, pretty_print=True))
+
+# ----- validation against the compiled urdf ----- #
+
+def get_vector(element, name, default):
+  """
+  Get a numeric attribute of an element as an array
+  """
+  text = element.get(name)
+  return np.array(default if text is None else [float(x) for x in text.split()], dtype=float)
+
+def get_model_summary(filename):
+  """
+  Get the bodies of an mjcf file for comparison, each with its parent, pose,
+  inertial (as a tensor, so the choice of principal axes does not matter),
+  joints and geoms (in the body frame, flattening any frames)
+  """
+
+  root = etree.parse(filename).getroot()
+  meshes = {x.get("name"): (x.get("file"), get_vector(x, "scale", [1, 1, 1]))
+            for x in root.iter("mesh")}
+
+  def get_geoms(element, pos, rotation):
+    geoms = []
+    for x in element:
+      this_pos = pos + rotation @ get_vector(x, "pos", [0, 0, 0])
+      this_rotation = rotation @ get_quat_rotation(get_vector(x, "quat", [1, 0, 0, 0]))
+      if x.tag == "frame":
+        geoms += get_geoms(x, this_pos, this_rotation)
+      elif x.tag == "geom":
+        mesh = meshes.get(x.get("mesh"), (None, None))
+        geoms.append({"type": x.get("type", "sphere"), "size": get_vector(x, "size", []),
+                      "pos": this_pos, "rotation": this_rotation, "mesh": mesh[0],
+                      "scale": mesh[1], "visual": x.get("contype") == "0" and x.get("conaffinity") == "0"})
+    return geoms
+
+  bodies = {}
+  for body in root.find("worldbody").iter("body"):
+    pos = get_vector(body, "pos", [0, 0, 0])
+    rotation = get_quat_rotation(get_vector(body, "quat", [1, 0, 0, 0]))
+    parent = body.getparent()
+    while parent.tag == "frame":
+      frame_rotation = get_quat_rotation(get_vector(parent, "quat", [1, 0, 0, 0]))
+      pos = get_vector(parent, "pos", [0, 0, 0]) + frame_rotation @ pos
+      rotation = frame_rotation @ rotation
+      parent = parent.getparent()
+    inertial = body.find("inertial")
+    axes = get_quat_rotation(get_vector(inertial, "quat", [1, 0, 0, 0]))
+    bodies[body.get("name")] = {
+      "parent": parent.get("name", "world"),
+      "pos": pos,
+      "rotation": rotation,
+      "mass": get_vector(inertial, "mass", [0]),
+      "com": get_vector(inertial, "pos", [0, 0, 0]),
+      "inertia": axes @ np.diag(get_vector(inertial, "diaginertia", [0, 0, 0])) @ axes.T,
+      "joints": [{"name": x.get("name"), "type": x.get("type", "hinge"),
+                  "axis": get_vector(x, "axis", [0, 0, 1]), "range": get_vector(x, "range", []),
+                  "damping": get_vector(x, "damping", [0]),
+                  "frictionloss": get_vector(x, "frictionloss", [0])} for x in body.findall("joint")],
+      "geoms": get_geoms(body, np.zeros(3), np.eye(3)),
+    }
+  return bodies
+
+def compare_models(generated, compiled, rtol=1e-4, atol=1e-8):
+  """
+  Compare two model summaries, returning a list of the differences found
+  """
+
+  def differ(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+      a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+      return a.shape != b.shape or not np.allclose(a, b, rtol=rtol, atol=atol)
+    return a != b
+
+  differences = []
+  for name in sorted(set(generated) ^ set(compiled)):
+    differences.append(f"body {name} is only in the {'generated' if name in generated else 'compiled'} model")
+
+  for name in [x for x in compiled if x in generated]:
+    a, b = generated[name], compiled[name]
+    for key in ["parent", "pos", "rotation", "mass", "com", "inertia"]:
+      if differ(a[key], b[key]): differences.append(f"body {name} {key}: {a[key]} != {b[key]}")
+    for kind in ["joints", "geoms"]:
+      if len(a[kind]) != len(b[kind]):
+        differences.append(f"body {name} has {len(a[kind])} {kind}, compiled has {len(b[kind])}")
+        continue
+      for i, (x, y) in enumerate(zip(a[kind], b[kind])):
+        for key in x:
+          if differ(x[key], y[key]):
+            differences.append(f"body {name} {kind[:-1]} {i} {key}: {x[key]} != {y[key]}")
+
+  return differences
+
+def compile_urdf(gripper_details, compiler, work_dir):
+  """
+  Build gripper_task.xml as the Makefile does, expanding the xacro and then
+  compiling the urdf, returning the path of the mjcf file
+  """
+  from xacro_expand import expand_xacro
+  build_dir = work_dir + "/build"
+  os.makedirs(build_dir, exist_ok=True)
+  if not os.path.exists(build_dir + "/meshes_mujoco"):
+    os.symlink(filepath + "/build/meshes_mujoco", build_dir + "/meshes_mujoco")
+  with open(build_dir + "/gripper_task.urdf", "w") as outfile:
+    outfile.write(expand_xacro("xacro/gripper_task.urdf.xacro", root_dir=filepath,
+                               config=gripper_details))
+  subprocess.run([compiler, "gripper_task.urdf", "gripper_task.xml"], cwd=build_dir, check=True)
+  return build_dir + "/gripper_task.xml"
+
+def validate(gripper_details, segments, widths, compiler):
+  """
+  Compare the generated model with the compiled urdf for every number of
+  segments and finger width (in mm, None keeps the config width), returning
+  True if they all match
+  """
+
+  work_dir = tempfile.mkdtemp(prefix="gripper_mjcf_")
+  matched = True
+  try:
+    for N in segments:
+      for width_mm in widths:
+        details = copy.deepcopy(gripper_details)
+        details["gripper_config"]["num_segments"] = N
+        if width_mm is not None: details["gripper_params"]["finger_width"] = width_mm * 1e-3
+        width_mm = details["gripper_params"]["finger_width"] * 1e3
+
+        start = time.time()
+        compiled = compile_urdf(details, compiler, work_dir)
+        compile_time = time.time() - start
+        start = time.time()
+        generate_mjcf(details, work_dir + "/generated.xml")
+        generate_time = time.time() - start
+
+        differences = compare_models(get_model_summary(work_dir + "/generated.xml"),
+                                     get_model_summary(compiled))
+        print(f"N={N} width={width_mm:g}mm: {'ok' if len(differences) == 0 else 'DIFFERENT'}, "
+              f"generated in {generate_time * 1e3:.1f} ms, xacro and compile took {compile_time * 1e3:.0f} ms")
+        for x in differences[:20]: print("  " + x)
+        if len(differences) > 20: print(f"  ... and {len(differences) - 20} more differences")
+        matched = matched and len(differences) == 0
+  finally:
+    shutil.rmtree(work_dir)
+
+  return matched
+
+if __name__ == "__main__":
+
+  # define arguments and parse them
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--config", default=description_path + "/config/gripper.yaml")
+  parser.add_argument("--output", default=filepath + "/build/gripper_task.xml")
+  parser.add_argument("--segments", nargs="*", type=int, default=None) # override num_segments, several only with --validate
+  parser.add_argument("--widths", nargs="*", type=float, default=None) # override finger_width (in mm)
+  parser.add_argument("--validate", action="store_true") # compare with the compiled urdf rather than writing
+  parser.add_argument("--compiler", default="compile") # eg <mujoco>/bin/compile, used by --validate
+  args = parser.parse_args()
+
+  with open(args.config) as file:
+    gripper_details = yaml.safe_load(file)
+
+  segments = args.segments or [gripper_details["gripper_config"]["num_segments"]]
+  widths = args.widths or [None]
+
+  if args.validate:
+    exit(0 if validate(gripper_details, segments, widths, args.compiler) else 1)
+
+  if len(segments) > 1 or len(widths) > 1:
+    raise RuntimeError("give one value of --segments and --widths, unless using --validate")
+  gripper_details["gripper_config"]["num_segments"] = segments[0]
+  if widths[0] is not None: gripper_details["gripper_params"]["finger_width"] = widths[0] * 1e-3
+  generate_mjcf(gripper_details, args.output)
@@ -1,19 +1,40 @@
 #!/usr/bin/env python3
 
+"""
+Build the objects.xml, assets.xml and details.xml files of an object set from
+its define_objects.yaml. Every object in the set is first computed as one row
+of a numpy structured array, the catalogue, which can also be used by other
+tools:
+
+  import yaml
+  from build_object_set import build_catalogue
+
+  with open("define_objects.yaml") as file:
+    object_details = yaml.safe_load(file)
+
+  catalogue = build_catalogue(object_details)
+  heavy = catalogue[catalogue["mass"] > 0.2]
+"""
+
 import yaml
 import os
+import re
+import shutil
+import hashlib
+import sqlite3
 from lxml import etree
 import numpy as np
 import argparse
+import contextlib
 
-# define arguments and parse them
-parser = argparse.ArgumentParser()
-parser.add_argument("--gen-objects", default=True, type=int)
-args = parser.parse_args()
-
-if not bool(args.gen_objects):
-  # no need to run this script
-  exit()
+# spans are only recorded when run by a traced build, which puts build_trace.py
+# (in the mujoco folder) on the python path
+try:
+  from build_trace import span
+except ImportError:
+  @contextlib.contextmanager
+  def span(name, category="stage", **labels):
+    yield {"bytes": 0}
 
 # objects yaml file
 objects_yaml_file = "define_objects.yaml"
@@ -22,79 +43,133 @@ objects_yaml_file = "define_objects.yaml"
 filepath = os.path.dirname(os.path.abspath(__file__))
 description_path = os.path.dirname(filepath)
 
-# import the dictionary of object information
-with open(filepath + "/" + objects_yaml_file) as file:
-  object_details = yaml.safe_load(file)
+# where simplified collision meshes and their report are saved (in this folder)
+collision_folder = "collision"
+mesh_report_file = "mesh_report.yaml"
+
+# SQLite index of every object in the set, also filled in by xml_script.py
+object_index_file = "objects.db"
 
-# do we have a fixed random seed (so test set fixed)
-rand_seed = object_details["settings"]["fixed_random_seed"]
-if rand_seed == 0: rand_seed = np.random.randint(0, 2147483647)
-np.random.seed(rand_seed)
+# settings which change the catalogue rows of an entry, see build_catalogue_incremental()
+catalogue_settings = ["object_densities", "friction_scalings", "random_density",
+                      "random_friction", "maximum_mass_grams", "collision_vertex_budget",
+                      "inertia_from_mesh"]
 
 # how big do we want the ground
 ground_xy_size = 1
 
-# define key xml snippets in the form of a function, returning formatted snippet
-def get_object_xml(name, quat, mass, diaginertia, friction="1 0.005 0.0001"):
-  # this snippet creates the main object in mujoco
-  object_xml = """
-  <body name="{0}" pos="0 0 0">
-    <inertial pos="0 0 0" quat="{1}" mass="{2}" diaginertia="{3}"/>
-    <freejoint name="{0}"/>
-    <geom name="{0}_geom" type="mesh" mesh="{0}" friction="{4}"/>
-  </body>\n
-  """.format(name, quat, mass, diaginertia, friction)
-  return object_xml
-
-def get_asset_xml(name, filepath, xscale, yscale, zscale, refquat):
-  # this snippet defines the object mesh
-  mesh_xml = """
-  <mesh name="{0}" file="{1}"
-        scale="{2} {3} {4}"
-        refquat="{5}"
-  />\n
-  """.format(name, filepath, xscale, yscale, zscale, refquat)
-  return mesh_xml
-
-def get_details_xml(name, x, y, z, z_rest):
-  # this snippet is for me to save any extrsa relevant information
-  details_xml = """
-  <object_details name="{0}" x="{1}" y="{2}" z="{3}" z_rest="{4}"/>\n
-  """.format(name, x, y, z, z_rest)
-  return details_xml
-
-# function to add xml to a tree
-def add_chunk(tree, parent_tag, xml_string_to_add):
-  """
-  This function adds a chunk of xml text under the bracket of the given
-  parent tag into the given tree
-  """
-
-  # print(xml_string_to_add)
-
-  # extract the xml text from
-  new_tree = etree.fromstring(xml_string_to_add)
-
-  # get the root of the parent tree
-  root = tree.getroot()
-
-  # special case where we are adding at the root
-  if parent_tag == "@root":
-    root.append(new_tree)
-    return
-
-  # search recursively for all instances of the parent tag
-  tags = root.findall(".//" + parent_tag)
-
-  if len(tags) > 1:
-    raise RuntimeError("more than one parent tag found")
-  elif len(tags) == 0:
-    raise RuntimeError("parent tag not found")
-
-  for t in tags:
-    t.append(new_tree)
-  
-  return
+# default mujoco friction parameters for geoms
+# mujoco friction: sliding / torsional / rolling
+# default: 1.0, 0.005, 0.0001
+# increase rolling friction to 0.005 to prevent objects rolling on their own
+default_friction = [1.0, 0.005, 0.005]
+scale_all = False # only scale sliding friction
+
+# object categories, in the order they are printed
+categories = ["cubes", "cuboids", "cylinders", "spheres", "ellipsoids"]
+
+# inertial parameters read from the yaml for each inertial type
+inertial_keys = {
+  "cuboid" : ["x", "y", "z"],
+  "sphere" : ["r", "r", "r"],
+  "cylinder" : ["r", "r", "h"],
+  "ellipsoid" : ["a", "b", "c"],
+}
+
+# one row for every object in the set, in the order they are saved
+catalogue_dtype = np.dtype([
+  ("name", "U128"),             # unique object name
+  ("variant", "U128"),          # name before the density and friction extension
+  ("mesh", "U128"),             # path to the STL file
+  ("vertex_budget", "i4"),      # max collision mesh vertices, 0 to collide with the mesh itself
+  ("collision_mesh", "U128"),   # path to the simplified collision STL, empty if not needed
+  ("entry", "U64"),             # top level yaml entry the object comes from
+  ("sample", "i4"),             # index of the (entry, density, scale) sample
+  ("category", "U16"),          # one of categories
+  ("quat", "U64"),
+  ("refquat", "U64"),
+  ("inertia_from_mesh", "?"),   # are mass, inertia, size and z_rest from the mesh
+  ("ipos", "f8", (3,)),         # centre of mass in the body frame
+  ("iquat", "U64"),             # orientation of the inertia axes in the body frame
+  ("density", "f8"),
+  ("friction", "f8", (3,)),
+  ("scale", "f8", (3,)),
+  ("mass", "f8"),               # mass after capping at maximum_mass_grams
+  ("raw_mass", "f8"),           # mass before capping
+  ("mass_capped", "?"),
+  ("diaginertia", "f8", (3,)),
+  ("size", "f8", (3,)),         # x, y, z size when resting on the spawn axis
+  ("z_rest", "f8"),
+])
+
+# define key xml elements in the form of a function, whitespace matches the
+# indentation of the saved files. One element of each kind is reused for every
+# object, setting its attributes with the matching set_ function
+def get_object_element(separate_collision=False):
+  # this element creates the main object in mujoco, with an extra visual only
+  # geom if the object collides with a simplified mesh
+  body = etree.Element("body", {"name": "", "pos": "0 0 0"})
+  body.text = "\n    "
+  etree.SubElement(body, "inertial", {"pos": "0 0 0", "quat": "", "mass": "",
+                                      "diaginertia": ""}).tail = "\n    "
+  etree.SubElement(body, "freejoint", {"name": ""}).tail = "\n    "
+  etree.SubElement(body, "geom", {"name": "", "type": "mesh", "mesh": "",
+                                  "friction": ""}).tail = "\n  "
+  if separate_collision:
+    body[-1].tail = "\n    "
+    etree.SubElement(body, "geom", {"name": "", "type": "mesh", "contype": "0", "conaffinity": "0",
+                                    "group": "1", "density": "0", "mesh": ""}).tail = "\n  "
+  return body
+
+def set_object_element(body, name, quat, mass, diaginertia, friction="1 0.005 0.0001",
+                       pos="0 0 0"):
+  inertial, freejoint, geom = body[:3]
+  body.set("name", name)
+  inertial.set("pos", pos)
+  inertial.set("quat", quat)
+  inertial.set("mass", str(mass))
+  inertial.set("diaginertia", diaginertia)
+  freejoint.set("name", name)
+  geom.set("name", name + "_geom")
+  geom.set("friction", friction)
+  if len(body) > 3:
+    geom.set("mesh", name + "_collision")
+    body[3].set("name", name + "_geom_visual")
+    body[3].set("mesh", name)
+  else:
+    geom.set("mesh", name)
+
+def get_asset_element():
+  # this element defines the object mesh
+  return etree.Element("mesh", {"name": "", "file": "", "scale": "", "refquat": ""})
+
+def set_asset_element(mesh, name, filepath, xscale, yscale, zscale, refquat):
+  mesh.set("name", name)
+  mesh.set("file", filepath)
+  mesh.set("scale", f"{xscale} {yscale} {zscale}")
+  mesh.set("refquat", refquat)
+
+def get_details_element():
+  # this element is for me to save any extrsa relevant information
+  return etree.Element("object_details", {"name": "", "x": "", "y": "", "z": "", "z_rest": ""})
+
+def set_details_element(details, name, x, y, z, z_rest):
+  details.set("name", name)
+  details.set("x", str(x))
+  details.set("y", str(y))
+  details.set("z", str(z))
+  details.set("z_rest", str(z_rest))
+
+def get_ground_element():
+  # the ground is the final element in the object file
+  body = etree.Element("body", {"name": "ground", "pos": "0 0 0"})
+  body.text = "\n    "
+  etree.SubElement(body, "geom", {
+    "name": "ground_geom", "type": "plane",
+    "size": f"{ground_xy_size} {ground_xy_size} {ground_xy_size}",
+    "friction": f"{default_friction[0]} {default_friction[1]} {default_friction[2]}"
+  }).tail = "\n  "
+  return body
 
 def print_categories(count_dict):
   """
@@ -115,335 +190,864 @@ def print_categories(count_dict):
 
   return total
 
-if __name__ == "__main__":
-
-  object_root = etree.Element("mujoco")
-  assets_root = etree.Element("mujoco")
-  detail_root = etree.Element("mujoco")
-
-  object_tree = etree.ElementTree(object_root)
-  assets_tree = etree.ElementTree(assets_root)
-  detail_tree = etree.ElementTree(detail_root)
-
-  biggest_mass = [0, "object"]
-
-  # default mujoco friction parameters for geoms
-  # mujoco friction: sliding / torsional / rolling
-  # default: 1.0, 0.005, 0.0001
-  # increase rolling friction to 0.005 to prevent objects rolling on their own
-  default_friction = [1.0, 0.005, 0.005]
-  scale_all = False # only scale sliding friction
-
-  # get density and friction values from the yaml file
-  density_values = object_details["settings"]["object_densities"]
-  friction_factors = object_details["settings"]["friction_scalings"]
-  try:
-    max_mass = object_details["settings"]["maximum_mass_grams"] * 1e-3
-  except KeyError as e:
-    print("settings does not contain 'maximum_mass_grams':", e)
-    max_mass = 1e6
-  avg_mass = 0
-
-  # scale default friction by factors and convert [[a,b,c], [d,e,f]] into ["a b c", "d e f"]
+def get_friction_values(friction_factors):
+  """
+  Scale the default friction by each factor, giving friction strings for mujoco
+  eg [[a,b,c], [d,e,f]] becomes ["a b c", "d e f"]
+  """
   friction_values = []
   for f in friction_factors:
     if scale_all:
       friction_values.append("".join(str([f * x for x in default_friction])[1:-1].split(",")))
     else: # scale only the first friction, sliding friction
       friction_values.append("".join(str([f * x if i == 0 else x for i, x in enumerate(default_friction)])[1:-1].split(",")))
+  return friction_values
 
-  random_density = object_details["settings"]["random_density"]
-  random_friction = object_details["settings"]["random_friction"]
+def get_max_mass(object_details):
+  """
+  Get the mass in kg above which object masses are capped
+  """
+  try:
+    return object_details["settings"]["maximum_mass_grams"] * 1e-3
+  except KeyError as e:
+    print("settings does not contain 'maximum_mass_grams':", e)
+    return 1e6
 
-  if random_density:
-    density_loop = 1
-  else:
-    density_loop = len(density_values)
+def draw_random_indices(rng, num_samples, objects_per_sample, num_densities, num_frictions):
+  """
+  Pick a random density for each sample and a random friction for each of its
+  objects. Draws are interleaved per sample (density first), so a fixed seed
+  always gives the same object set. Use None for values which are not random
+  """
+  density_indices = None
+  friction_indices = None
+
+  if num_densities is not None and num_frictions is not None:
+    density_indices = np.empty(num_samples, dtype=int)
+    friction_indices = np.empty((num_samples, objects_per_sample), dtype=int)
+    for i in range(num_samples):
+      density_indices[i] = rng.choice(num_densities)
+      friction_indices[i] = rng.choice(num_frictions, size=objects_per_sample)
+    friction_indices = friction_indices.reshape(-1)
+  elif num_densities is not None:
+    density_indices = rng.choice(num_densities, size=num_samples)
+  elif num_frictions is not None:
+    friction_indices = rng.choice(num_frictions, size=num_samples * objects_per_sample)
+
+  return density_indices, friction_indices
+
+def get_inertia(inertial_type, dims, density):
+  """
+  Calculate the mass, diaginertia, detail dimensions (bounding box) and
+  category of many objects of one inertial type at once. The dims are the
+  scaled inertial parameters, with shape (num, 3)
+  """
+
+  if inertial_type == "cuboid":
+
+    x, y, z = dims.T
+    mass = x * y * z * density
+    diaginertia = np.stack([
+      (1.0/12.0) * mass * (y**2 + z**2),
+      (1.0/12.0) * mass * (x**2 + z**2),
+      (1.0/12.0) * mass * (x**2 + y**2),
+    ], axis=1)
+    detail = dims
+    category = np.where((x == y) & (x == z), "cubes", "cuboids")
+
+  elif inertial_type == "sphere":
+
+    rx, ry, rz = dims.T
+    mass = (4.0/3.0) * np.pi * rx * ry * rz * density
+    diaginertia = np.stack([
+      (1.0/5.0) * mass * (ry**2 + rz**2),
+      (1.0/5.0) * mass * (rx**2 + rz**2),
+      (1.0/5.0) * mass * (rx**2 + ry**2),
+    ], axis=1)
+    detail = dims * 2
+    category = "spheres"
+
+  elif inertial_type == "cylinder":
+
+    rx, ry, h = dims.T
+    mass = np.pi * rx * ry * h * density
+    diaginertia = np.stack([
+      (1.0/12.0) * mass * (3 * rx * ry + h**2),
+      (1.0/12.0) * mass * (3 * rx * ry + h**2),
+      (1.0/2.0) * mass * rx * ry,
+    ], axis=1)
+    detail = np.stack([rx * 2, ry * 2, h], axis=1)
+    category = "cylinders"
+
+  elif inertial_type == "ellipsoid":
+
+    a, b, c = dims.T
+    mass = (4.0/3.0) * np.pi * a * b * c * density
+    diaginertia = np.stack([
+      (1.0/5.0) * mass * (b**2 + c**2),
+      (1.0/5.0) * mass * (a**2 + c**2),
+      (1.0/5.0) * mass * (a**2 + b**2),
+    ], axis=1)
+    detail = dims * 2
+    category = "ellipsoids"
 
-  if random_friction:
-    friction_loop = 1
   else:
-    friction_loop = len(friction_values)
+    raise RuntimeError("inertial type not one of 'cuboid', 'sphere', 'cylinder', 'ellipsoid'")
+
+  return mass, diaginertia, detail, category
+
+def build_catalogue(object_details, rng=np.random, mesh_dir=None, mesh_memo=None):
+  """
+  Compute every object in the set from the define_objects.yaml dictionary,
+  returning a numpy structured array with one row per object (see
+  catalogue_dtype). The rng is used for random densities and frictions. Objects
+  with inertia_from_mesh read their STL from mesh_dir (default meshes_mujoco),
+  reusing the mesh_memo dictionary across calls if given
+  """
 
-  category_count = {
-    "cubes" : 0,
-    "cuboids" : 0,
-    "cylinders" : 0,
-    "spheres" : 0,
-    "ellipsoids" : 0
-  }
-  counter_ref = ""
+  if mesh_dir is None: mesh_dir = description_path + "/meshes_mujoco"
 
-  mass_capped_counter = 0
+  # get density and friction values from the yaml file
+  settings = object_details["settings"]
+  density_values = settings["object_densities"]
+  friction_values = get_friction_values(settings["friction_scalings"])
+  random_density = settings.get("random_density", False)
+  random_friction = settings.get("random_friction", False)
+  max_mass = get_max_mass(object_details)
+
+  density_loop = 1 if random_density else len(density_values)
+  friction_loop = 1 if random_friction else len(friction_values)
+
+  # ----- gather one sample per yaml entry, density and scale ----- #
+
+  entries = []
+  types = []
+  params = []
+  scales = []
+  aligns = []
+  spawn_axes = []
+  spawn_heights = []
+  vertex_budgets = []
+  from_mesh_flags = []
+  density_strings = []
+  friction_indices = []
+  variants = []
+  meshes = []
+  quats = []
 
-  # loop through top level entries in the yaml file
   for object in object_details:
 
     # should we skip this yaml file entry
     if object == "settings": continue
     elif object_details[object]["include"] is False: continue
 
-    # loop through the given densities
+    details = object_details[object]
+    name_root = details["name_root"]
+    name_suffix = details["suffix"]
+    name_path = details["path"]
+    scale_num = details["scale"]["num"]
+    inertial_type = details["inertial"]["type"]
+    frame_align = details["inertial"]["align"]
+
+    if inertial_type not in inertial_keys:
+      raise RuntimeError("inertial type not one of 'cuboid', 'sphere', 'cylinder', 'ellipsoid'")
+    if details["spawn"]["axis"] not in ["x", "y", "z"]:
+      raise RuntimeError("spawn axis not one of 'x', 'y', 'z'")
+
+    # collision meshes are simplified to this many vertices, 0 means never
+    vertex_budget = details.get("collision_vertex_budget",
+                                settings.get("collision_vertex_budget", 0))
+    if 0 < vertex_budget < 4:
+      raise RuntimeError(f"collision_vertex_budget of {object} must be 0 or at least 4")
+
+    # use the mesh itself for mass, inertia and rest height instead of the yaml values
+    from_mesh = details.get("inertia_from_mesh", settings.get("inertia_from_mesh", False))
+
+    # every fillet option shares the same inertia
+    if details["fillet"]["used"]:
+      fillet_step = details["fillet"]["step"]
+      fillet_min = details["fillet"]["min"]
+      fillet_num = int((details["fillet"]["max"] - fillet_min) / fillet_step) + 1
+      fillets = [fillet_min + j * fillet_step for j in range(fillet_num)]
+      obj_filenames = [f"{name_root}_{x}" for x in fillets]
+      name_roots = [f"{name_root}_{x}_{name_suffix}" for x in fillets]
+    else:
+      obj_filenames = [name_root]
+      name_roots = [f"{name_root}_{name_suffix}"]
+    paths = [f"models/{name_path}/{x}.STL" for x in obj_filenames]
+
+    # work out the scale factors
+    if scale_num == 1:
+      entry_scales = np.ones((1, 3))
+    else:
+      scale_min = np.array([details["scale"]["min"][x] for x in "xyz"])
+      scale_max = np.array([details["scale"]["max"][x] for x in "xyz"])
+      increment = (scale_max - scale_min) / (scale_num - 1)
+      entry_scales = scale_min + np.arange(scale_num)[:, None] * increment
+
+    num_samples = density_loop * scale_num
+
+    # pick random densities and frictions in the same order every time
+    random_density_indices, random_friction_indices = draw_random_indices(
+      rng, num_samples, len(paths) * friction_loop,
+      len(density_values) if random_density else None,
+      len(friction_values) if random_friction else None
+    )
+    if random_density:
+      density_strings += [str(x) for x in np.array(density_values)[random_density_indices]]
+    else:
+      density_strings += [str(x) for x in density_values for i in range(scale_num)]
+    if random_friction:
+      friction_indices.append(random_friction_indices)
+    else:
+      friction_indices.append(np.tile(np.arange(friction_loop), num_samples * len(paths)))
+
+    q = details["quat"]
     for d in range(density_loop):
-
-      # extract key information
-      name_root = object_details[object]["name_root"]
-      name_suffix = object_details[object]["suffix"]
-      name_path = object_details[object]["path"]
-
-      spawn_axis = object_details[object]["spawn"]["axis"]
-      spawn_height = object_details[object]["spawn"]["rest"]
-
-      scale_num = object_details[object]["scale"]["num"]
-      x_max = object_details[object]["scale"]["max"]["x"]
-      x_min = object_details[object]["scale"]["min"]["x"]
-      y_max = object_details[object]["scale"]["max"]["y"]
-      y_min = object_details[object]["scale"]["min"]["y"]
-      z_max = object_details[object]["scale"]["max"]["z"]
-      z_min = object_details[object]["scale"]["min"]["z"]
-
-      inertial_type = object_details[object]["inertial"]["type"]
-      frame_align = object_details[object]["inertial"]["align"]
-
-      fillet_used = object_details[object]["fillet"]["used"]
-      if fillet_used:
-        fillet_step = object_details[object]["fillet"]["step"]
-        fillet_max = object_details[object]["fillet"]["max"]
-        fillet_min = object_details[object]["fillet"]["min"]
-        # work out how many fillet steps
-        fillet_num = int((fillet_max - fillet_min) / fillet_step) + 1
-
-      qx = object_details[object]["quat"]["x"]
-      qy = object_details[object]["quat"]["y"]
-      qz = object_details[object]["quat"]["z"]
-      qw = object_details[object]["quat"]["w"]
-
-      # work out scale increments
-      if scale_num > 1:
-        x_increment = (x_max - x_min) / (scale_num - 1)
-        y_increment = (y_max - y_min) / (scale_num - 1)
-        z_increment = (z_max - z_min) / (scale_num - 1)
-
-      # loop through scaling number
       for i in range(scale_num):
+        variants.append([f"{x}_{i}" for x in name_roots])
+        meshes.append(paths)
+        quats.append((f"{q['w']} {q['x']} {q['y']} {q['z']}",
+                      f"{q['w']} {-q['x']} {-q['y']} {-q['z']}")) # note quaternion conjugate used, see mujoco docs
+
+    entries += [object] * num_samples
+    types += [inertial_type] * num_samples
+    params += [[details["inertial"][x] for x in inertial_keys[inertial_type]]] * num_samples
+    scales.append(np.tile(entry_scales, (density_loop, 1)))
+    aligns += [["xyz".index(x) for x in frame_align]] * num_samples
+    spawn_axes += ["xyz".index(details["spawn"]["axis"])] * num_samples
+    spawn_heights += [details["spawn"]["rest"]] * num_samples
+    vertex_budgets += [vertex_budget] * num_samples
+    from_mesh_flags += [from_mesh] * num_samples
+
+  # ----- calculate the inertia of every sample in batches per inertial type ----- #
+
+  num_samples = len(entries)
+  rows = np.arange(num_samples)
+  types = np.array(types)
+  aligns = np.array(aligns, dtype=int).reshape(num_samples, 3)
+  spawn_axes = np.array(spawn_axes, dtype=int)
+  density = np.array([float(x) for x in density_strings])
+  scales = np.concatenate(scales) if num_samples > 0 else np.ones((0, 3))
+
+  # swap scaling for inertia based on frame alignment
+  dims = scales[rows[:, None], aligns] * np.array(params, dtype=float).reshape(num_samples, 3)
+
+  mass = np.empty(num_samples)
+  diaginertia = np.empty((num_samples, 3))
+  detail = np.empty((num_samples, 3))
+  category = np.empty(num_samples, dtype="U16")
+  for inertial_type in inertial_keys:
+    mask = types == inertial_type
+    if not mask.any(): continue
+    mass[mask], diaginertia[mask], detail[mask], category[mask] = get_inertia(
+      inertial_type, dims[mask], density[mask])
+
+  # rotate the bounding box onto the spawn axis, which is vertical at rest
+  spawn_order = np.array([[2, 0, 1], [1, 2, 0], [0, 1, 2]])[spawn_axes]
+  size = detail[rows[:, None], aligns[rows[:, None], spawn_order]]
+  z_rest = np.array(spawn_heights, dtype=float) * scales[rows, spawn_axes]
+
+  # cap mass above a certain amount
+  mass_capped = mass > max_mass
+  capped_mass = np.where(mass_capped, max_mass, mass)
+
+  # ----- expand every sample into its fillet and friction options ----- #
+
+  objects_per_sample = np.array([len(x) * friction_loop for x in variants], dtype=int)
+  sample = np.repeat(rows, objects_per_sample)
+  friction_index = np.concatenate(friction_indices) if num_samples > 0 else np.zeros(0, dtype=int)
+  friction = np.array([[float(x) for x in f.split(" ")] for f in friction_values])[friction_index]
+
+  catalogue = np.zeros(len(sample), dtype=catalogue_dtype)
+  catalogue["sample"] = sample
+  catalogue["entry"] = np.array(entries, dtype="U64")[sample]
+  catalogue["category"] = category[sample]
+  catalogue["vertex_budget"] = np.array(vertex_budgets, dtype=int)[sample]
+  catalogue["density"] = density[sample]
+  catalogue["friction"] = friction
+  catalogue["scale"] = scales[sample]
+  catalogue["mass"] = capped_mass[sample]
+  catalogue["raw_mass"] = mass[sample]
+  catalogue["mass_capped"] = mass_capped[sample]
+  catalogue["diaginertia"] = diaginertia[sample]
+  catalogue["size"] = size[sample]
+  catalogue["z_rest"] = z_rest[sample]
+
+  # name every object, the extensions add up over the friction loop
+  names = []
+  object_variants = []
+  object_meshes = []
+  object_quats = []
+  object_refquats = []
+  fric_floats = friction[:, 0].tolist()
+  o = 0
+  for s in range(num_samples):
+    for variant, mesh in zip(variants[s], meshes[s]):
+      name = variant
+      for f in range(friction_loop):
+        name += f"_den{density_strings[s]}_fric{fric_floats[o]:.1f}"
+        names.append(name)
+        object_variants.append(variant)
+        object_meshes.append(mesh)
+        object_quats.append(quats[s][0])
+        object_refquats.append(quats[s][1])
+        o += 1
+
+  catalogue["name"] = names
+  catalogue["variant"] = object_variants
+  catalogue["mesh"] = object_meshes
+  catalogue["quat"] = object_quats
+  catalogue["refquat"] = object_refquats
+  catalogue["iquat"] = object_quats
+
+  # ----- replace the analytic values of objects using their mesh ----- #
+
+  from_mesh = np.array(from_mesh_flags, dtype=bool)[sample]
+  catalogue["inertia_from_mesh"] = from_mesh
+  if from_mesh.any():
+    mesh_rows = catalogue[from_mesh]
+    volume, ipos, principal, iquat, size, z_rest = get_mesh_inertia(
+      mesh_rows["mesh"], mesh_rows["scale"], mesh_rows["quat"], spawn_axes[sample][from_mesh],
+      mesh_dir, memo=mesh_memo)
+    mesh_mass = volume * mesh_rows["density"]
+    catalogue["raw_mass"][from_mesh] = mesh_mass
+    catalogue["mass_capped"][from_mesh] = mesh_mass > max_mass
+    catalogue["mass"][from_mesh] = np.minimum(mesh_mass, max_mass)
+    catalogue["diaginertia"][from_mesh] = principal * mesh_rows["density"][:, None]
+    catalogue["ipos"][from_mesh] = ipos
+    catalogue["iquat"][from_mesh] = iquat
+    catalogue["size"][from_mesh] = size
+    catalogue["z_rest"][from_mesh] = z_rest
+
+  return catalogue
+
+def get_entry_key(object, details, settings, rng_state, mesh_dir):
+  """
+  Get a digest of everything the catalogue rows of one yaml entry depend on:
+  the entry, the settings it uses, the random state before it is drawn, this
+  script, and its mesh files if the rows are computed from them
+  """
 
-        if random_density: density = np.random.choice(density_values)
-        else: density = density_values[d]
-        # print("density is", density)
-
-        # work out this scale factor
-        if scale_num == 1:
-          xscale = 1.0
-          yscale = 1.0
-          zscale = 1.0
-        else:
-          xscale = x_min + i * x_increment
-          yscale = y_min + i * y_increment
-          zscale = z_min + i * z_increment
-
-        # swap scaling for inertia based on frame alignment
-        scales = [xscale, yscale, zscale]
-        align = [
-          0 if frame_align[0] == 'x' else (1 if frame_align[0] == 'y' else 2),
-          0 if frame_align[1] == 'x' else (1 if frame_align[1] == 'y' else 2),
-          0 if frame_align[2] == 'x' else (1 if frame_align[2] == 'y' else 2)
-        ]
-        xscale_in = scales[align[0]]
-        yscale_in = scales[align[1]]
-        zscale_in = scales[align[2]]
-
-        if inertial_type == "cuboid":
-
-          # extract dimensions
-          x = xscale_in * object_details[object]["inertial"]["x"]
-          y = yscale_in * object_details[object]["inertial"]["y"]
-          z = zscale_in * object_details[object]["inertial"]["z"]
-
-          # calculate the mass
-          mass = x * y * z * density
-
-          # calculate the diaginertia
-          ixx = (1.0/12.0) * mass * (y**2 + z**2)
-          iyy = (1.0/12.0) * mass * (x**2 + z**2)
-          izz = (1.0/12.0) * mass * (x**2 + y**2)
-
-          detail_x = x
-          detail_y = y
-          detail_z = z
-
-          if x == y and x == z and y == z:
-            counter_ref = "cubes"
-          else:
-            counter_ref = "cuboids"
-
-        elif inertial_type == "sphere":
-          
-          # extract dimensions
-          rx = xscale_in * object_details[object]["inertial"]["r"]
-          ry = yscale_in * object_details[object]["inertial"]["r"]
-          rz = zscale_in * object_details[object]["inertial"]["r"]
-
-          # calculate the mass
-          mass = (4.0/3.0) * np.pi * rx * ry * rz * density
-
-          # calculate the diaginertia
-          ixx = (1.0/5.0) * mass * (ry**2 + rz**2)
-          iyy = (1.0/5.0) * mass * (rx**2 + rz**2)
-          izz = (1.0/5.0) * mass * (rx**2 + ry**2)
-
-          detail_x = rx * 2
-          detail_y = ry * 2
-          detail_z = rz * 2
-
-          counter_ref = "spheres"
-
-        elif inertial_type == "cylinder":
-
-          # extract dimensions
-          rx = xscale_in * object_details[object]["inertial"]["r"]
-          ry = yscale_in * object_details[object]["inertial"]["r"]
-          h = zscale_in * object_details[object]["inertial"]["h"]
-          
-          # calculate the mass
-          mass = np.pi * rx * ry * h * density
-
-          # calculate the diaginertia
-          ixx = (1.0/12.0) * mass * (3 * rx * ry + h**2)
-          iyy = (1.0/12.0) * mass * (3 * rx * ry + h**2)
-          izz = (1.0/2.0) * mass * rx * ry
-
-          detail_x = rx * 2
-          detail_y = ry * 2
-          detail_z = h
-
-          counter_ref = "cylinders"
-
-        elif inertial_type == "ellipsoid":
-
-          # extract dimensions
-          a = xscale_in * object_details[object]["inertial"]["a"]
-          b = yscale_in * object_details[object]["inertial"]["b"]
-          c = zscale_in * object_details[object]["inertial"]["c"]
-
-          # calculate the mass
-          mass = (4.0/3.0) * np.pi * a * b * c * density
-
-          # calculate the diaginertia
-          ixx = (1.0/5.0) * mass * (b**2 + c**2)
-          iyy = (1.0/5.0) * mass * (a**2 + c**2)
-          izz = (1.0/5.0) * mass * (a**2 + b**2)
-
-          detail_x = a * 2
-          detail_y = b * 2
-          detail_z = c * 2
-
-          counter_ref = "ellipsoids"
-
-        else:
-          raise RuntimeError("inertial type not one of 'cuboid', 'sphere', 'cylinder'")
-
-        # now generate the final xml name
-        if fillet_used:
-          obj_filenames = [
-            "{0}_{1}".format(name_root, fillet_min + j * fillet_step)
-            for j in range(fillet_num)
-          ]
-          names = [
-            "{0}_{1}_{2}_{3}".format(
-              name_root,
-              fillet_min + j * fillet_step,
-              name_suffix,
-              i
-            ) for j in range(fillet_num)
-          ]
-        else:
-          obj_filenames = ["{0}".format(name_root, name_suffix)]
-          names = ["{0}_{1}_{2}".format(name_root, name_suffix, i)]
-        
-        # format key data ready to insert into xml snippets
-        quat = f"{qw} {qx} {qy} {qz}"
-        quat_conj = f"{qw} {-qx} {-qy} {-qz}" # note quaternion conjugate used, see mujoco docs
-        diaginertia = "{0:.6f} {1:.6f} {2:.6f}".format(ixx, iyy, izz)
-
-        dims = [detail_x, detail_y, detail_z]
-        
-        # check which axis the z rest is
-        if spawn_axis == "x": 
-          x_size = dims[align[2]]
-          y_size = dims[align[0]]
-          z_size = dims[align[1]]
-          z_rest = spawn_height * xscale
-        elif spawn_axis == "y":
-          x_size = dims[align[1]]
-          y_size = dims[align[2]]
-          z_size = dims[align[0]]
-          z_rest = spawn_height * yscale
-        elif spawn_axis == "z":
-          x_size = dims[align[0]]
-          y_size = dims[align[1]]
-          z_size = dims[align[2]]
-          z_rest = spawn_height * zscale
-        else: raise RuntimeError("spawn axis not one of 'x', 'y', 'z'")
-
-        if mass > biggest_mass[0]:
-          biggest_mass[0] = mass
-          biggest_mass[1] = names[0] + f", density {density}"
-
-        # cap mass above a certain amount
-        if mass > max_mass:
-          mass = max_mass
-          mass_capped_counter += 1
-
-        # loop through every fillet option and create the xml snippets
-        for k, name in enumerate(names):
-
-          # loop through every friction option (if random then friction_loop=1)
-          for f in range(friction_loop):
-
-            if random_friction: friction = np.random.choice(friction_values)
-            else: friction = friction_values[f]
-
-            path = "models/{0}/{1}.STL".format(name_path, obj_filenames[k])
-
-            # add an extension to uniquely name each object (friction is vec [f1, f2, f3], use only f1)
-            fric_float = float(friction.split(" ")[0])
-            name_ext = f"_den{density}_fric{fric_float:.1f}"
-            name += name_ext
-
-            object_xml = get_object_xml(name, quat, mass, diaginertia, friction)
-            asset_xml = get_asset_xml(name, path, xscale, yscale, zscale, quat_conj)
-            detail_xml = get_details_xml(name, x_size, y_size, z_size, z_rest)
-
-            add_chunk(object_tree, "@root", object_xml)
-            add_chunk(assets_tree, "@root", asset_xml)
-            add_chunk(detail_tree, "@root", detail_xml)
-
-            # count the category of this object
-            category_count[counter_ref] += 1
-            avg_mass += mass
-
-  # add the ground as the final element in the object tree
-  ground_xml = f"""
-  <body name="ground" pos="0 0 0">
-    <geom name="ground_geom" type="plane" size="{ground_xy_size} {ground_xy_size} {ground_xy_size}"
-      friction="{default_friction[0]} {default_friction[1]} {default_friction[2]}"/>
-  </body>
-  """
-  add_chunk(object_tree, "@root", ground_xml)
-
-  # finally, save the trees
-  object_tree.write(filepath + "/objects.xml")
-  assets_tree.write(filepath + "/assets.xml")
-  detail_tree.write(filepath + "/details.xml")
-
-  if max_mass < biggest_mass[0]: extra = f", but mass capped at {max_mass * 1e3:.0f}g. {mass_capped_counter} objects had mass capped"
-  else: extra = ""
-  total = print_categories(category_count)
-  print(f"The biggest mass was {biggest_mass[0] * 1e3:.0f}g for the object: {biggest_mass[1]}" + extra + f". The average mass was {avg_mass/total * 1e3:.1f}g")
+  h = hashlib.sha256()
+  h.update(get_file_digest(os.path.abspath(__file__)).encode())
+  h.update(yaml.safe_dump({
+    "object" : object,
+    "details" : details,
+    "settings" : {x: settings.get(x) for x in catalogue_settings},
+  }, sort_keys=True).encode())
+  h.update(np.asarray(rng_state[1]).tobytes())
+  h.update(repr(rng_state[2:]).encode())
+
+  if details.get("inertia_from_mesh", settings.get("inertia_from_mesh", False)):
+    mesh_folder = mesh_dir + "/models/" + details["path"]
+    for name in sorted(os.listdir(mesh_folder)):
+      h.update(f"{name}={get_file_digest(mesh_folder + '/' + name)}".encode())
+
+  return h.hexdigest()
+
+def build_catalogue_incremental(object_details, rng, cache_dir, mesh_dir=None):
+  """
+  Build the same catalogue as build_catalogue(), one yaml entry at a time,
+  reusing the rows of any entry which is unchanged since it was saved in
+  cache_dir (see get_entry_key). The random state after each entry is cached
+  too, so later entries draw the same values. Returns the catalogue and the
+  number of entries which were reused
+  """
+
+  if mesh_dir is None: mesh_dir = description_path + "/meshes_mujoco"
+  settings = object_details["settings"]
+  mesh_memo = {}
+
+  # warn about a missing maximum mass once, rather than for every entry
+  entry_settings = dict(settings, maximum_mass_grams=get_max_mass(object_details) * 1e3)
+
+  parts = []
+  num_samples = 0
+  reused = 0
+
+  for object in object_details:
+
+    # should we skip this yaml file entry
+    if object == "settings": continue
+    elif object_details[object]["include"] is False: continue
+
+    key = get_entry_key(object, object_details[object], settings, rng.get_state(), mesh_dir)
+    cached = cache_dir + "/" + key + ".npz"
+
+    if os.path.exists(cached):
+      with np.load(cached) as data:
+        part = data["catalogue"]
+        rng.set_state(("MT19937", data["keys"], int(data["pos"]), int(data["has_gauss"]),
+                       float(data["gauss"])))
+      reused += 1
+    else:
+      part = build_catalogue({"settings": entry_settings, object: object_details[object]},
+                             rng=rng, mesh_dir=mesh_dir, mesh_memo=mesh_memo)
+      state = rng.get_state()
+      os.makedirs(cache_dir, exist_ok=True)
+      with open(cached + ".incomplete", "wb") as outfile:
+        np.savez(outfile, catalogue=part, keys=state[1], pos=state[2], has_gauss=state[3],
+                 gauss=state[4])
+      os.replace(cached + ".incomplete", cached)
+
+    # sample numbers continue on from the previous entries
+    part = part.copy()
+    part["sample"] += num_samples
+    if len(part) > 0: num_samples = part["sample"].max() + 1
+    parts.append(part)
+
+  catalogue = np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype=catalogue_dtype)
+  return catalogue, reused
+
+def save_object_xml(catalogue, directory):
+  """
+  Write the objects.xml, assets.xml and details.xml files of a catalogue into
+  the given directory. Each object is streamed to the three files as it is
+  made, so no tree of the whole set is ever held in memory
+  """
+
+  body = get_object_element()
+  collision_body = get_object_element(separate_collision=True)
+  asset = get_asset_element()
+  details = get_details_element()
+
+  with etree.xmlfile(directory + "/objects.xml") as object_file, \
+       etree.xmlfile(directory + "/assets.xml") as assets_file, \
+       etree.xmlfile(directory + "/details.xml") as detail_file:
+    with object_file.element("mujoco"), \
+         assets_file.element("mujoco"), \
+         detail_file.element("mujoco"):
+
+      for name, mesh, collision_mesh, iquat, refquat, mass, diaginertia, friction, scale, size, z_rest, from_mesh, ipos in zip(
+          catalogue["name"].tolist(), catalogue["mesh"].tolist(),
+          catalogue["collision_mesh"].tolist(),
+          catalogue["iquat"].tolist(), catalogue["refquat"].tolist(),
+          catalogue["mass"].tolist(), catalogue["diaginertia"].tolist(),
+          catalogue["friction"].tolist(), catalogue["scale"].tolist(),
+          catalogue["size"].tolist(), catalogue["z_rest"].tolist(),
+          catalogue["inertia_from_mesh"].tolist(), catalogue["ipos"].tolist()):
+        diaginertia = "{0:.6f} {1:.6f} {2:.6f}".format(*diaginertia)
+        friction = " ".join([str(x) for x in friction])
+        ipos = "{0:.6f} {1:.6f} {2:.6f}".format(*(np.round(ipos, 6) + 0.0)) if from_mesh else "0 0 0"
+        this_body = collision_body if collision_mesh else body
+        set_object_element(this_body, name, iquat, mass, diaginertia, friction, ipos)
+        set_asset_element(asset, name, mesh, *scale, refquat)
+        set_details_element(details, name, *size, z_rest)
+        object_file.write(this_body)
+        assets_file.write(asset)
+        detail_file.write(details)
+
+        # the simplified mesh is only used for collisions, the visual mesh is unchanged
+        if collision_mesh:
+          set_asset_element(asset, name + "_collision", collision_mesh, *scale, refquat)
+          assets_file.write(asset)
+
+      object_file.write(get_ground_element())
+
+# ----- mass properties from meshes ----- #
+
+def get_quat_matrix(quat):
+  """
+  Get the rotation matrix of a unit quaternion string "w x y z"
+  """
+  q = np.array(quat.split(), dtype=float)
+  w, x, y, z = q / np.linalg.norm(q)
+  return np.array([
+    [1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)],
+    [2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)],
+    [2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)],
+  ])
+
+def get_matrix_quat(matrix):
+  """
+  Get the quaternion string "w x y z" of a rotation matrix
+  """
+  m = matrix
+  trace = m[0, 0] + m[1, 1] + m[2, 2]
+  if trace > 0:
+    s = 2 * np.sqrt(trace + 1)
+    q = [0.25 * s, (m[2, 1] - m[1, 2]) / s, (m[0, 2] - m[2, 0]) / s, (m[1, 0] - m[0, 1]) / s]
+  else:
+    i = int(np.argmax(np.diag(m)))
+    j, k = (i + 1) % 3, (i + 2) % 3
+    s = 2 * np.sqrt(1 + m[i, i] - m[j, j] - m[k, k])
+    q = [0.0] * 4
+    q[0] = (m[k, j] - m[j, k]) / s
+    q[i + 1] = 0.25 * s
+    q[j + 1] = (m[j, i] + m[i, j]) / s
+    q[k + 1] = (m[k, i] + m[i, k]) / s
+  if q[0] < 0: q = [-x for x in q]
+  return "{0:.6f} {1:.6f} {2:.6f} {3:.6f}".format(*q)
+
+def get_mesh_moments(vertices, faces):
+  """
+  Get the volume, first moment and second moment (about the origin) of a
+  closed mesh by summing the signed tetrahedra between each triangle and the
+  origin. The results are of the solid with unit density
+  """
+
+  a, b, c = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+  det = np.einsum("ij,ij->i", a, np.cross(b, c))
+  corners = a + b + c
+
+  volume = det.sum() / 6.0
+  first = (det[:, None] * corners).sum(axis=0) / 24.0
+
+  # every tetrahedron contributes det/120 * (sum of v v^T over its corners + s s^T)
+  outer = (np.einsum("i,ij,ik->jk", det, a, a) + np.einsum("i,ij,ik->jk", det, b, b)
+           + np.einsum("i,ij,ik->jk", det, c, c) + np.einsum("i,ij,ik->jk", det, corners, corners))
+  second = outer / 120.0
+
+  return volume, first, second
+
+def get_mesh_inertia(meshes, scales, quats, spawn_axes, mesh_dir, memo=None):
+  """
+  Calculate the volume, centre of mass, principal inertia (for unit density),
+  inertia orientation, size and rest height of many scaled and rotated meshes
+  in the body frame (mujoco rotates a mesh by the conjugate of its refquat then
+  scales it). Each mesh file is read once, its moments are kept in the memo
+  dictionary by file digest, and results by (digest, scale, quat)
+  """
+
+  if memo is None: memo = {}
+  memo.setdefault("digests", {})
+  memo.setdefault("meshes", {})
+  memo.setdefault("results", {})
 
+  num = len(meshes)
+  volume = np.empty(num)
+  ipos = np.empty((num, 3))
+  principal = np.empty((num, 3))
+  iquat = np.empty(num, dtype="U64")
+  size = np.empty((num, 3))
+  z_rest = np.empty(num)
 
+  # rotate the bounding box onto the spawn axis, which is vertical at rest
+  spawn_order = np.array([[2, 0, 1], [1, 2, 0], [0, 1, 2]])
 
+  for i, (mesh, scale, quat, axis) in enumerate(zip(meshes.tolist(), scales.tolist(),
+                                                    quats.tolist(), spawn_axes.tolist())):
 
-    
+    path = mesh_dir + "/" + mesh
+    if path not in memo["digests"]:
+      memo["digests"][path] = get_file_digest(path)
+    digest = memo["digests"][path]
 
+    key = (digest, tuple(scale), quat, axis)
+    if key not in memo["results"]:
+
+      if digest not in memo["meshes"]:
+        vertices, faces = read_stl(path)
+        vertices = vertices.astype(float)
+        memo["meshes"][digest] = (vertices, get_mesh_moments(vertices, faces))
+      vertices, (unit_volume, unit_first, unit_second) = memo["meshes"][digest]
+
+      # a linear transform of the mesh transforms its moments
+      transform = np.diag(scale) @ get_quat_matrix(quat)
+      det = np.linalg.det(transform)
+      this_volume = unit_volume * det
+      com = (transform @ unit_first) * det / this_volume
+      second = transform @ unit_second @ transform.T * det - this_volume * np.outer(com, com)
+      inertia = np.trace(second) * np.eye(3) - second
+
+      # principal axes, as a right handed rotation
+      moments, axes = np.linalg.eigh(inertia)
+      if np.linalg.det(axes) < 0: axes[:, 2] *= -1
+
+      body_vertices = vertices @ transform.T
+      lower = body_vertices.min(axis=0)
+      upper = body_vertices.max(axis=0)
+
+      if this_volume <= 0:
+        raise RuntimeError(f"mesh '{mesh}' is not a closed outward facing surface")
+
+      memo["results"][key] = (this_volume, com, moments, get_matrix_quat(axes),
+                              (upper - lower)[spawn_order[axis]], -lower[axis])
+
+    volume[i], ipos[i], principal[i], iquat[i], size[i], z_rest[i] = memo["results"][key]
+
+  return volume, ipos, principal, iquat, size, z_rest
+
+# ----- collision mesh simplification ----- #
+
+# binary STL triangle records
+stl_dtype = np.dtype([
+  ("normal", "<f4", (3,)),
+  ("vertices", "<f4", (3, 3)),
+  ("attribute", "<u2"),
+])
+
+def get_file_digest(path):
+  """
+  Get the sha256 digest of a file
+  """
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      h.update(chunk)
+  return h.hexdigest()
+
+def read_stl(path):
+  """
+  Read a binary or ascii STL file, returning the unique vertices (as mujoco
+  merges them) and the triangles as indices into the vertices
+  """
+
+  with open(path, "rb") as f:
+    data = f.read()
+
+  # binary files give their size exactly, ascii files may also start with 'solid'
+  num = int(np.frombuffer(data, dtype="<u4", count=1, offset=80)[0]) if len(data) >= 84 else -1
+  if len(data) == 84 + stl_dtype.itemsize * num:
+    points = np.frombuffer(data, dtype=stl_dtype, count=num, offset=84)["vertices"].reshape(-1, 3)
+  else:
+    points = np.array(re.findall(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)", data), dtype=np.float32)
+
+  vertices, faces = np.unique(points.reshape(-1, 3), axis=0, return_inverse=True)
+  return vertices, faces.reshape(-1, 3)
+
+def write_stl(path, vertices, faces):
+  """
+  Write triangles, given as indices into the vertices, to a binary STL file
+  """
+
+  triangles = vertices[faces].astype(np.float32)
+  normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+  lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+  normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+  records = np.zeros(len(faces), dtype=stl_dtype)
+  records["normal"] = normals
+  records["vertices"] = triangles
+
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "wb") as f:
+    f.write(b"collision mesh".ljust(80))
+    f.write(np.array([len(faces)], dtype="<u4").tobytes())
+    f.write(records.tobytes())
+
+def decimate_mesh(vertices, faces, vertex_budget):
+  """
+  Simplify a mesh to at most vertex_budget vertices by clustering vertices on
+  the largest grid which gives enough clusters. Each cluster keeps its vertex
+  furthest from the centre, so the convex hull which mujoco collides with
+  shrinks as little as possible. Triangles which collapse are removed
+  """
+
+  if len(vertices) <= vertex_budget: return vertices, faces
+
+  lower = vertices.min(axis=0)
+  extent = float((vertices.max(axis=0) - lower).max())
+  distance = np.linalg.norm(vertices - vertices.mean(axis=0), axis=1)
+
+  def cluster(cell):
+    keys = np.floor((vertices - lower) / cell).astype(np.int64)
+    return np.unique(keys, axis=0, return_inverse=True)[1].reshape(-1)
+
+  # binary search for the smallest grid cell within the budget
+  small, large = 0.0, extent * 1.01
+  best = cluster(large)
+  for i in range(30):
+    cell = 0.5 * (small + large)
+    clusters = cluster(cell)
+    if clusters.max() + 1 > vertex_budget:
+      small = cell
+    else:
+      large = cell
+      best = clusters
+
+  # the vertex furthest from the centre represents each cluster
+  order = np.lexsort((-distance, best))
+  firsts = order[np.r_[True, best[order][1:] != best[order][:-1]]]
+
+  # remove collapsed and repeated triangles
+  new_faces = best[faces]
+  keep = ((new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2])
+          & (new_faces[:, 0] != new_faces[:, 2]))
+  new_faces = new_faces[keep]
+  unique = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)[1]
+  new_faces = new_faces[np.sort(unique)]
+
+  # keep only the vertices still used by a triangle
+  used, new_faces = np.unique(new_faces, return_inverse=True)
+  return vertices[firsts[used]], new_faces.reshape(-1, 3)
+
+def simplify_collision_meshes(catalogue, mesh_dir, output_dir, cache_dir=None):
+  """
+  Decimate the mesh of every object with a vertex budget into a simplified
+  collision mesh saved under output_dir, setting the collision_mesh of the
+  catalogue (relative to mesh_dir, as mujoco loads it). Simplified meshes are
+  cached in cache_dir by the digest of their source file. Returns a report
+  with the vertex counts and savings of every mesh
+  """
+
+  report = []
+  pairs = dict.fromkeys(zip(catalogue["mesh"].tolist(), catalogue["vertex_budget"].tolist()))
+
+  for mesh, vertex_budget in pairs:
+
+    if vertex_budget <= 0: continue
+
+    source = mesh_dir + "/" + mesh
+    vertices, faces = read_stl(source)
+    target = output_dir + "/" + os.path.splitext(mesh)[0] + f"_v{vertex_budget}.STL"
+    collision_vertices = len(vertices)
+    collision_mesh = ""
+
+    # only meshes over their budget need a simplified version
+    if len(vertices) > vertex_budget:
+
+      cached = None
+      if cache_dir is not None:
+        cached = cache_dir + "/" + get_file_digest(source) + f"_v{vertex_budget}.STL"
+
+      if cached is not None and os.path.exists(cached):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(cached, target)
+        collision_vertices = len(read_stl(target)[0])
+        collision_mesh = os.path.relpath(target, mesh_dir)
+      else:
+        new_vertices, new_faces = decimate_mesh(vertices, faces, vertex_budget)
+
+        # a convex hull needs a solid, otherwise keep colliding with the source mesh
+        if len(new_faces) >= 4:
+          write_stl(target, new_vertices, new_faces)
+          collision_vertices = len(new_vertices)
+          collision_mesh = os.path.relpath(target, mesh_dir)
+          if cached is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            shutil.copyfile(target, cached + ".incomplete")
+            os.replace(cached + ".incomplete", cached)
+
+    match = (catalogue["mesh"] == mesh) & (catalogue["vertex_budget"] == vertex_budget)
+    catalogue["collision_mesh"][match] = collision_mesh
+
+    report.append({
+      "mesh" : mesh,
+      "collision_mesh" : collision_mesh,
+      "vertex_budget" : vertex_budget,
+      "vertices" : len(vertices),
+      "collision_vertices" : collision_vertices,
+      "saving_percent" : round(100.0 * (1 - collision_vertices / len(vertices)), 1),
+      "objects" : int(np.count_nonzero(match)),
+    })
+
+  return report
+
+def save_object_index(catalogue, filename):
+  """
+  Save the catalogue as a SQLite database with one row per object, so tools
+  can select objects with a query instead of parsing the xml. The split and
+  slot of each object are filled in when the set is split by xml_script.py,
+  and the variants table lists the gripper task folders built with the set.
+  The idx column is the index of the object in the catalogue (and objects.xml),
+  which identifies it as names can repeat
+  """
+
+  if os.path.exists(filename): os.remove(filename)
+  temp_filename = filename + ".incomplete"
+  if os.path.exists(temp_filename): os.remove(temp_filename)
+
+  db = sqlite3.connect(temp_filename)
+  db.executescript("""
+    CREATE TABLE objects (
+      idx INTEGER PRIMARY KEY, name TEXT, entry TEXT, category TEXT, mesh TEXT, collision_mesh TEXT,
+      x REAL, y REAL, z REAL, z_rest REAL,
+      mass REAL, raw_mass REAL, mass_capped INTEGER, density REAL,
+      friction REAL, torsional_friction REAL, rolling_friction REAL,
+      scale_x REAL, scale_y REAL, scale_z REAL,
+      split INTEGER, slot INTEGER
+    );
+    CREATE TABLE variants (
+      folder TEXT PRIMARY KEY, segments INTEGER, width_mm REAL, config_hash TEXT
+    );
+    CREATE INDEX objects_name ON objects (name);
+    CREATE INDEX objects_category ON objects (category, mass);
+    CREATE INDEX objects_friction ON objects (friction);
+    CREATE INDEX objects_split ON objects (split, slot);
+  """)
+  db.executemany("INSERT INTO objects VALUES (" + ", ".join(["?"] * 22) + ")", zip(
+    range(len(catalogue)), catalogue["name"].tolist(), catalogue["entry"].tolist(), catalogue["category"].tolist(),
+    catalogue["mesh"].tolist(), catalogue["collision_mesh"].tolist(),
+    *catalogue["size"].T.tolist(), catalogue["z_rest"].tolist(),
+    catalogue["mass"].tolist(), catalogue["raw_mass"].tolist(),
+    catalogue["mass_capped"].astype(int).tolist(), catalogue["density"].tolist(),
+    *catalogue["friction"].T.tolist(), *catalogue["scale"].T.tolist(),
+    [None] * len(catalogue), [None] * len(catalogue)
+  ))
+  db.commit()
+  db.close()
+  os.replace(temp_filename, filename)
+
+def print_summary(catalogue):
+  """
+  Print the categories and mass statistics of a catalogue
+  """
+
+  category_count = {}
+  for key in categories:
+    category_count[key] = int(np.count_nonzero(catalogue["category"] == key))
+  total = print_categories(category_count)
+
+  biggest = catalogue[np.argmax(catalogue["raw_mass"])]
+  capped = catalogue["mass_capped"]
+  if capped.any():
+    max_mass = catalogue["mass"][capped][0]
+    mass_capped_counter = len(np.unique(catalogue["sample"][capped]))
+    extra = f", but mass capped at {max_mass * 1e3:.0f}g. {mass_capped_counter} objects had mass capped"
+  else: extra = ""
+  avg_mass = catalogue["mass"].sum() / total
+  print(f"The biggest mass was {biggest['raw_mass'] * 1e3:.0f}g for the object: {biggest['variant']}, density {biggest['density']:g}"
+        + extra + f". The average mass was {avg_mass * 1e3:.1f}g")
+
+if __name__ == "__main__":
 
+  # define arguments and parse them
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--gen-objects", default=True, type=int)
+  parser.add_argument("--mesh-cache", default=None) # folder to cache simplified collision meshes
+  parser.add_argument("--catalogue-cache", default=None) # folder to cache the catalogue rows of each entry
+  args = parser.parse_args()
+
+  if not bool(args.gen_objects):
+    # no need to run this script
+    exit()
+
+  # import the dictionary of object information
+  with open(filepath + "/" + objects_yaml_file) as file:
+    object_details = yaml.safe_load(file)
+
+  # do we have a fixed random seed (so test set fixed)
+  rand_seed = object_details["settings"].get("fixed_random_seed", 0)
+  if rand_seed == 0: rand_seed = np.random.randint(0, 2147483647)
+  rng = np.random.RandomState(rand_seed)
+
+  with span("build catalogue"):
+    if args.catalogue_cache is None:
+      catalogue = build_catalogue(object_details, rng=rng)
+    else:
+      catalogue, reused = build_catalogue_incremental(object_details, rng, args.catalogue_cache)
+      print(f"Reused {reused} unchanged entries from the catalogue cache")
+
+  # simplify collision meshes, replacing any from a previous set
+  if os.path.exists(filepath + "/" + collision_folder):
+    shutil.rmtree(filepath + "/" + collision_folder)
+  if os.path.exists(filepath + "/" + mesh_report_file):
+    os.remove(filepath + "/" + mesh_report_file)
+  if catalogue["vertex_budget"].any():
+    with span("simplify collision meshes", category="files"):
+      report = simplify_collision_meshes(catalogue, description_path + "/meshes_mujoco",
+                                         filepath + "/" + collision_folder, args.mesh_cache)
+    with open(filepath + "/" + mesh_report_file, "w") as outfile:
+      yaml.safe_dump(report, outfile, sort_keys=False)
+    vertices = sum([x["vertices"] for x in report])
+    collision_vertices = sum([x["collision_vertices"] for x in report])
+    print(f"Simplified collision meshes from {vertices} to {collision_vertices} vertices "
+          f"({100.0 * (1 - collision_vertices / vertices):.1f}% saved), see {mesh_report_file}")
+
+  with span("save object xml", category="files"):
+    save_object_xml(catalogue, filepath)
+  with span("save object index", category="files"):
+    save_object_index(catalogue, filepath + "/" + object_index_file)
+  print_summary(catalogue)
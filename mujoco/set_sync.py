@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""
+Publish built object sets, transferring only what has changed. Every
+published set records the digest and size of its files in a manifest, files
+unchanged since the last publish are linked from the old copy of the set, and
+meshes link to a content addressed mesh store shared by every set in a folder.
+Each published set is a symlink to a hidden version folder beside it, so a new
+version is swapped in with a single rename. Used by build_multi_segment_set.py:
+
+  from set_sync import sync_set
+
+  copied, reused = sync_set("build", "object_sets/set_x", "object_sets/mesh_store")
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+
+# every published set records the digest and size of its files here, so a
+# later sync only transfers what has changed
+set_manifest_file = "set_manifest.yaml"
+
+# how many threads hash files at once when syncing sets
+hash_threads = 8
+
+# sha256 of mesh files already stored this run, meshes are shared by every set
+mesh_digests = {}
+
+def get_file_digest(path, digests=None):
+  """
+  Get the sha256 hex digest of a file, remembered in digests (a dict) if given
+  """
+  if digests is not None and path in digests: return digests[path]
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      h.update(chunk)
+  digest = h.hexdigest()
+  if digests is not None: digests[path] = digest
+  return digest
+
+def store_mesh(path, store_dir):
+  """
+  Add a file to the content addressed mesh store, unless a file with the same
+  contents is already there, and return the path of the stored file
+  """
+  digest = get_file_digest(path, mesh_digests)
+  stored = f"{store_dir}/{digest[:2]}/{digest}{os.path.splitext(path)[1]}"
+  if not os.path.exists(stored):
+    os.makedirs(os.path.dirname(stored), exist_ok=True)
+    shutil.copyfile(path, stored + ".incomplete")
+    os.replace(stored + ".incomplete", stored)
+  return stored
+
+def link_mesh(stored, target, mode):
+  """
+  Make target a hardlink or relative symlink to a stored mesh file, falling
+  back to a copy if links are not possible (eg across filesystems)
+  """
+  if os.path.lexists(target):
+    if os.path.exists(target) and os.path.samefile(stored, target): return
+    os.remove(target)
+  try:
+    if mode == "hard":
+      os.link(stored, target)
+      return
+    elif mode == "symlink":
+      os.symlink(os.path.relpath(stored, os.path.dirname(target)), target)
+      return
+  except OSError: pass
+  shutil.copyfile(stored, target)
+
+def get_manifest(folder):
+  """
+  Get the sha256 digest and size of every file in a folder, keyed by path
+  relative to the folder. Files are hashed in parallel
+  """
+  paths = []
+  for root, dirs, files in os.walk(folder):
+    paths += [os.path.relpath(root + "/" + x, folder) for x in files]
+  paths = sorted([x for x in paths if x != set_manifest_file])
+  with ThreadPoolExecutor(max_workers=hash_threads) as pool:
+    digests = list(pool.map(lambda x: get_file_digest(folder + "/" + x), paths))
+  return {x: {"digest": d, "size": os.path.getsize(folder + "/" + x)}
+          for x, d in zip(paths, digests)}
+
+def load_manifest(folder):
+  """
+  Get the manifest of a published set, hashing its files if it has no
+  manifest, or an empty manifest if the set does not exist
+  """
+  if os.path.exists(folder + "/" + set_manifest_file):
+    with open(folder + "/" + set_manifest_file) as file:
+      return yaml.safe_load(file) or {}
+  elif os.path.isdir(folder):
+    return get_manifest(folder)
+  return {}
+
+def save_manifest(manifest, folder):
+  """
+  Write the manifest of a set, replacing any previous one in a single rename
+  """
+  with open(folder + "/" + set_manifest_file + ".incomplete", "w") as outfile:
+    yaml.safe_dump(manifest, outfile)
+  os.replace(folder + "/" + set_manifest_file + ".incomplete", folder + "/" + set_manifest_file)
+
+def stage_files(source, staging, manifest, old_folder, old_manifest, store_dir, mode):
+  """
+  Fill staging with the files in the manifest of source. Files unchanged from
+  the old manifest are hardlinked from old_folder (copied if they cannot be),
+  meshes are linked from the shared mesh store, and only the rest are copied
+  from source. Returns the number of files copied and reused
+  """
+  copied = 0
+  reused = 0
+  for path, entry in manifest.items():
+    os.makedirs(os.path.dirname(staging + "/" + path), exist_ok=True)
+    if path.startswith("meshes_mujoco/"):
+      link_mesh(store_mesh(source + "/" + path, store_dir), staging + "/" + path, mode)
+      reused += 1
+    elif old_manifest.get(path) == entry:
+      try: os.link(old_folder + "/" + path, staging + "/" + path)
+      except OSError: shutil.copyfile(old_folder + "/" + path, staging + "/" + path)
+      reused += 1
+    else:
+      shutil.copyfile(source + "/" + path, staging + "/" + path)
+      copied += 1
+  return copied, reused
+
+def get_version_prefix(target):
+  """
+  Get the start of the path of every version folder of the set at target
+  """
+  parent, name = os.path.split(os.path.abspath(target))
+  return parent + "/." + name + "."
+
+def remove_set(target):
+  """
+  Delete a published set, both its symlink and the version folder it links to
+  """
+  if os.path.islink(target):
+    version = os.path.realpath(target)
+    os.remove(target)
+    if os.path.isdir(version): shutil.rmtree(version)
+  elif os.path.exists(target):
+    shutil.rmtree(target)
+
+def sync_set(source, target, store_dir, mode="hard", backup=None):
+  """
+  Publish the built set folder source at target, transferring only the files
+  which are new or changed since the manifest of the set already at target.
+  The new set is assembled in a version folder beside the target, and target
+  is a symlink to it replaced with os.replace, so readers see either the old
+  or the new set in full and never a gap. A set published before versions
+  were used is a plain folder, which is moved aside before the symlink takes
+  its place, so only on that first publish is there a moment with no set. The
+  replaced version is moved to backup if given, otherwise deleted. Returns the
+  number of files copied and reused
+  """
+  manifest = get_manifest(source)
+  old_manifest = load_manifest(target)
+
+  # remove any version folders left by an interrupted publish
+  prefix = get_version_prefix(target)
+  current = os.path.realpath(target) if os.path.islink(target) else None
+  parent = os.path.dirname(prefix)
+  for x in os.listdir(parent):
+    path = parent + "/" + x
+    if path.startswith(prefix) and path != current:
+      if os.path.islink(path): os.remove(path)
+      else: shutil.rmtree(path)
+
+  staging = prefix + str(time.time_ns())
+  os.makedirs(staging)
+  copied, reused = stage_files(source, staging, manifest, target, old_manifest,
+                               store_dir, mode)
+  save_manifest(manifest, staging)
+
+  old = current
+  if os.path.exists(target) and not os.path.islink(target):
+    old = prefix + "old"
+    os.rename(target, old)
+
+  link = staging + ".link"
+  os.symlink(os.path.basename(staging), link)
+  os.replace(link, target)
+
+  if old is not None and os.path.isdir(old):
+    if backup is None: shutil.rmtree(old)
+    else: os.rename(old, backup)
+
+  return copied, reused
+
+def merge_into_set(source, target_set, folder_name, store_dir, mode="hard"):
+  """
+  Add the task folder source to an already published set as folder_name,
+  renaming it into place once complete and adding its files to the manifest
+  """
+  manifest = get_manifest(source)
+  set_manifest = load_manifest(target_set)
+
+  staging = target_set + "/" + folder_name + ".incoming"
+  if os.path.exists(staging): shutil.rmtree(staging)
+  os.makedirs(staging)
+  stage_files(source, staging, manifest, None, {}, store_dir, mode)
+  os.rename(staging, target_set + "/" + folder_name)
+
+  for path, entry in manifest.items():
+    set_manifest[folder_name + "/" + path] = entry
+  save_manifest(set_manifest, target_set)
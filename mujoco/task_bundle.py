@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""
+Packed task bundles, one file holding every task file of a gripper variant
+together with the files each one includes. A task is stored as one contiguous
+record, so reading it takes one seek and one read, and an index of record
+offsets is kept at the end of the file. Meshes are not bundled, they are loaded
+from the meshes_mujoco folder of the set as usual.
+
+Reading a task needs only the standard library:
+
+  from task_bundle import TaskBundle
+
+  with TaskBundle("object_sets/set_x/gripper_N8_28/tasks.bundle") as bundle:
+    files = bundle.read_task(0)     # {filename: bytes}, as a mujoco VFS
+    model = bundle.load_model(0)    # or compile it directly with mujoco
+"""
+
+import os
+import re
+import json
+import struct
+
+# file layout: header, task records, json index
+bundle_magic = b"GTBUNDLE"
+bundle_version = 1
+bundle_header = struct.Struct("<8sIQQ") # magic, version, index offset, index length
+
+# default name of the bundle in a task folder
+bundle_filename = "tasks.bundle"
+
+def write_bundle(filename, tasks, meta=None):
+  """
+  Write a bundle of tasks, given as a list of (task filename, files) where
+  files is a list of (filename, bytes) starting with the task file itself. The
+  bundle only replaces filename once it is complete
+  """
+
+  index = {"meta": meta or {}, "tasks": []}
+
+  with open(filename + ".incomplete", "wb") as outfile:
+
+    # the header is rewritten once the index offset is known
+    outfile.write(bundle_header.pack(bundle_magic, bundle_version, 0, 0))
+
+    for name, files in tasks:
+      offset = outfile.tell()
+      entries = []
+      length = 0
+      for file_name, data in files:
+        outfile.write(data)
+        entries.append([file_name, length, len(data)])
+        length += len(data)
+      index["tasks"].append({"name": name, "offset": offset, "length": length,
+                             "files": entries})
+
+    index_bytes = json.dumps(index).encode()
+    index_offset = outfile.tell()
+    outfile.write(index_bytes)
+    outfile.seek(0)
+    outfile.write(bundle_header.pack(bundle_magic, bundle_version, index_offset,
+                                     len(index_bytes)))
+
+  os.replace(filename + ".incomplete", filename)
+
+class TaskBundle:
+  """
+  Read tasks from a bundle without unpacking it. The index is read when the
+  bundle is opened, then each task is read with a single seek and read
+  """
+
+  def __init__(self, filename):
+    self.filename = os.path.abspath(filename)
+    self.file = open(self.filename, "rb")
+    magic, version, offset, length = bundle_header.unpack(self.file.read(bundle_header.size))
+    if magic != bundle_magic:
+      raise RuntimeError(f"{filename} is not a task bundle")
+    if version != bundle_version:
+      raise RuntimeError(f"{filename} is bundle version {version}, expected {bundle_version}")
+    self.file.seek(offset)
+    index = json.loads(self.file.read(length))
+    self.meta = index["meta"]
+    self.tasks = index["tasks"]
+
+  def __len__(self):
+    return len(self.tasks)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.file.close()
+
+  def read_task(self, i):
+    """
+    Get the files of task i as a dictionary of filename to bytes, with names
+    as the task file refers to them (as a mujoco VFS expects)
+    """
+    task = self.tasks[i]
+    self.file.seek(task["offset"])
+    data = self.file.read(task["length"])
+    return {name: data[start:start + length] for name, start, length in task["files"]}
+
+  def load_model(self, i):
+    """
+    Compile task i into a mujoco model, with the meshes loaded from disk
+    relative to the folder of the bundle
+    """
+    import mujoco
+
+    files = self.read_task(i)
+    xml = files.pop(self.tasks[i]["name"]).decode()
+
+    # the xml is not loaded from its folder, so make the mesh directory absolute
+    folder = os.path.dirname(self.filename)
+    xml = re.sub(r'meshdir="([^"]*)"',
+                 lambda m: 'meshdir="{}"'.format(os.path.join(folder, m.group(1))), xml, count=1)
+
+    return mujoco.MjModel.from_xml_string(xml, assets=files)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+Tests that the task objects array and the object index agree with the split
+object files, on a set whose yaml repeats entries so that object names repeat:
+
+  python3 -m pytest test_task_objects.py
+"""
+
+import os
+import sys
+import sqlite3
+import numpy as np
+import yaml
+from lxml import etree
+
+filepath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, filepath + "/object_sets")
+
+from build_object_set import build_catalogue, save_object_xml, save_object_index
+from xml_script import (split_object_set, load_task_objects, object_split_filename,
+                        object_index_filename)
+
+# a set yaml with repeated entries, and a fixed seed so every run is the same
+set_name = "set9_full_smallspheres"
+seed = 1234
+
+def build_split_set(objects_dir):
+  """
+  Build the objects and object index of the set in objects_dir and split it
+  """
+  with open(filepath + "/object_sets/" + set_name + ".yaml") as file:
+    object_details = yaml.safe_load(file)
+  object_details["settings"]["fixed_random_seed"] = seed
+  object_details["settings"].setdefault("random_order", True)
+
+  catalogue = build_catalogue(object_details, rng=np.random.RandomState(seed),
+                              mesh_dir=filepath + "/build/meshes_mujoco")
+  save_object_xml(catalogue, objects_dir)
+  save_object_index(catalogue, objects_dir + "/" + object_index_filename)
+  return split_object_set(object_details, objects_dir)
+
+def test_task_objects_match_split_files(tmp_path):
+  objects_dir = str(tmp_path)
+  splits = build_split_set(objects_dir)
+  task_objects = load_task_objects(objects_dir)
+
+  names = [obj["name"] for split in splits for obj in split]
+  assert len(set(names)) < len(names), "the set should repeat object names"
+
+  # details.xml is in catalogue order, so its rows are found by catalogue index
+  detail_root = list(etree.parse(objects_dir + "/details.xml").getroot())
+
+  for i, split in enumerate(splits):
+    tree = etree.parse(objects_dir + "/" + object_split_filename.format(i))
+    bodies = [b for b in tree.getroot() if b.tag == "body"][:-1] # ground plane is last
+    assert len(bodies) == len(split)
+    for j, (obj, body) in enumerate(zip(split, bodies)):
+      row = task_objects[i, j]
+      assert row["used"]
+      assert row["name"] == body.get("name")
+      assert row["mass"] == float(body.find("inertial").get("mass"))
+      assert list(row["friction"]) == [float(x) for x in body.find("geom").get("friction").split()]
+      assert row["z_rest"] == float(detail_root[obj["index"]].get("z_rest"))
+
+    assert not task_objects[i, len(split):]["used"].any()
+
+def test_object_index_slots(tmp_path):
+  objects_dir = str(tmp_path)
+  splits = build_split_set(objects_dir)
+
+  # vacuuming may renumber rowids, but not the catalogue index in idx
+  db = sqlite3.connect(objects_dir + "/" + object_index_filename)
+  db.execute("VACUUM")
+  rows = db.execute("SELECT name, mass, split, slot FROM objects ORDER BY idx").fetchall()
+  db.close()
+
+  # every object is in exactly one split and slot, including repeated names
+  slots = sorted((split, slot) for name, mass, split, slot in rows)
+  assert slots == sorted((i, j) for i, split in enumerate(splits) for j in range(len(split)))
+
+  task_objects = load_task_objects(objects_dir)
+  for name, mass, split, slot in rows:
+    assert task_objects[split, slot]["name"] == name
+    assert np.isclose(task_objects[split, slot]["mass"], mass, rtol=1e-3)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+"""
+Derive the task files of a gripper variant from those of a reference variant
+with the same number of segments, when the two differ only in finger width.
+The width changes only the finger segment inertials, the size of the segment
+box geoms, the scale of the fingertip mesh and the finger_width numeric, so
+these are recomputed with gripper_mjcf.py and patched into a copy of the
+reference task files, instead of running xacro, compile and xml_script again:
+
+  from width_delta import derive_task_folder
+  derive_task_folder("build/gripper_N5_24", "build/gripper_N5_28", gripper_details)
+
+Which attributes to patch is found by generating both models and comparing
+them, so if the width ever changes anything else get_width_patch() raises a
+ValueError and the variant must be built in full. To check a derived folder
+against a full build of the same variant:
+
+  python3 width_delta.py build/gripper_N5_24 build/gripper_N5_28 --width 28 --compare <full build>
+"""
+
+import os
+import copy
+import shutil
+import argparse
+import yaml
+import numpy as np
+from lxml import etree
+from gripper_mjcf import (get_mjcf, get_vector, get_quat, get_quat_rotation,
+                          get_principal_inertia, format_numbers)
+from xml_script import get_robot_xml, mjb_manifest_filename, bundle_filename
+
+# the config file saved in every task folder
+config_filename = "gripper.yaml"
+
+# attributes of the generated model which may change with the finger width
+patchable = {
+  "inertial": ["pos", "quat", "mass", "diaginertia"],
+  "geom": ["size"],
+  "mesh": ["scale"],
+}
+
+# ----- finding what the width changes ----- #
+
+def get_numerics(custom_fields):
+  """
+  Get the name and data of every numeric in the custom field xml of a robot
+  """
+  custom = etree.fromstring("<custom>" + custom_fields + "</custom>")
+  return {x.get("name"): x.get("data") for x in custom.iter("numeric")}
+
+def get_inertia(inertial):
+  """
+  Get the mass, centre of mass and inertia tensor of an inertial element
+  """
+  axes = get_quat_rotation(get_vector(inertial, "quat", [1, 0, 0, 0]))
+  return {
+    "mass": get_vector(inertial, "mass", [0]),
+    "pos": get_vector(inertial, "pos", [0, 0, 0]),
+    "inertia": axes @ np.diag(get_vector(inertial, "diaginertia", [0, 0, 0])) @ axes.T,
+  }
+
+def get_width_patch(reference_details, gripper_details):
+  """
+  Get the changes which turn the task files of the reference gripper into those
+  of gripper_details, raising a ValueError if anything other than the finger
+  width differs or if the width changes more than the patchable attributes
+  """
+
+  # the configs must be the same apart from the width
+  reference = copy.deepcopy(reference_details)
+  reference["gripper_params"]["finger_width"] = gripper_details["gripper_params"]["finger_width"]
+  if reference != gripper_details:
+    raise ValueError("the gripper configs differ in more than the finger width")
+
+  # only the custom numerics of the xml_script snippets may change
+  reference_xml = get_robot_xml(reference_details)
+  robot_xml = get_robot_xml(gripper_details)
+  for key in robot_xml:
+    if key != "custom_fields" and robot_xml[key] != reference_xml[key]:
+      raise ValueError(f"the {key} of xml_script.py changes with the finger width")
+  reference_numerics = get_numerics(reference_xml["custom_fields"])
+  numerics = get_numerics(robot_xml["custom_fields"])
+  patch = {
+    "numeric": {k: v for k, v in numerics.items() if reference_numerics.get(k) != v},
+    "inertial": {},
+    "geom_size": {},
+    "mesh_scale": {},
+  }
+
+  # compare the models element by element, they are the same shape for any width
+  reference_root = get_mjcf(reference_details).getroot()
+  root = get_mjcf(gripper_details).getroot()
+  reference_elements = list(reference_root.iter())
+  elements = list(root.iter())
+  if [x.tag for x in elements] != [x.tag for x in reference_elements]:
+    raise ValueError("the finger width changes the elements of the gripper model")
+
+  geom_index = {}
+  for x, y in zip(reference_elements, elements):
+    if x.tag == "geom":
+      body = y.getparent().get("name")
+      geom_index[body] = geom_index.get(body, -1) + 1
+    changed = [k for k in set(x.attrib) | set(y.attrib) if x.get(k) != y.get(k)]
+    if len(changed) == 0: continue
+    for k in changed:
+      if k not in patchable.get(x.tag, []):
+        raise ValueError(f"the finger width changes {k} of a {x.tag} in the gripper model")
+    if x.tag == "inertial":
+      patch["inertial"][y.getparent().get("name")] = get_inertia(y)
+    elif x.tag == "geom":
+      patch["geom_size"][(body, geom_index[body])] = y.get("size")
+    elif x.tag == "mesh":
+      patch["mesh_scale"][y.get("name")] = y.get("scale")
+
+  return patch
+
+# ----- patching task files ----- #
+
+def get_body_geoms(body):
+  """
+  Get the geoms of a body in order, including those inside frames (as fused
+  links are written by newer versions of compile) but not those of child bodies
+  """
+  geoms = []
+  for x in body:
+    if x.tag == "geom": geoms.append(x)
+    elif x.tag == "frame": geoms += get_body_geoms(x)
+  return geoms
+
+def get_inertial_attributes(inertial, quat):
+  """
+  Get the attributes of an inertial element, which had the given quat. These
+  principal axes are kept if they still diagonalise the new inertia with the
+  moments in the same order, as compile would write them, otherwise new axes
+  are found (and quat is None if they are the identity)
+  """
+  values, axes = get_principal_inertia(inertial["inertia"])
+  old_axes = get_quat_rotation([1, 0, 0, 0] if quat is None else [float(x) for x in quat.split()])
+  scale = max(np.abs(values).max(), 1e-300)
+  if not np.allclose(old_axes.T @ inertial["inertia"] @ old_axes, np.diag(values),
+                     rtol=0, atol=1e-9 * scale):
+    if np.allclose(axes, np.eye(3), rtol=0, atol=1e-12): quat = None
+    else: quat = format_numbers(get_quat(axes))
+  return {"pos": format_numbers(inertial["pos"]), "quat": quat,
+          "mass": format_numbers(inertial["mass"]), "diaginertia": format_numbers(values)}
+
+def patch_tree(tree, patch, reference_folder, task_folder, inertials=None):
+  """
+  Apply a width patch to the tree of a task file (or shared robot file), and
+  point its includes of the reference task folder at task_folder instead. The
+  new inertial attributes are kept in inertials (a dict) if given, as every
+  task file of a folder has the same robot
+  """
+
+  root = tree.getroot()
+  bodies = {x.get("name"): x for x in root.iter("body")}
+  if inertials is None: inertials = {}
+
+  for name, inertial in patch["inertial"].items():
+    if name not in bodies: continue
+    element = bodies[name].find("inertial")
+    key = (name, element.get("quat"))
+    if key not in inertials: inertials[key] = get_inertial_attributes(inertial, element.get("quat"))
+    for k, v in inertials[key].items():
+      if v is None: element.attrib.pop(k, None)
+      else: element.set(k, v)
+
+  for (name, i), size in patch["geom_size"].items():
+    if name in bodies: get_body_geoms(bodies[name])[i].set("size", size)
+
+  for mesh in root.iter("mesh"):
+    if mesh.get("name") in patch["mesh_scale"]:
+      scale = patch["mesh_scale"][mesh.get("name")]
+      if scale is None: mesh.attrib.pop("scale", None)
+      else: mesh.set("scale", scale)
+
+  for numeric in root.iter("numeric"):
+    if numeric.get("name") in patch["numeric"]:
+      numeric.set("data", patch["numeric"][numeric.get("name")])
+
+  for include in root.iter("include"):
+    if include.get("file").startswith(f"../{reference_folder}/"):
+      include.set("file", f"../{task_folder}/" + include.get("file")[len(reference_folder) + 4:])
+
+def derive_task_folder(reference_dir, task_dir, gripper_details, patch=None):
+  """
+  Create task_dir from the task files of the reference variant in reference_dir,
+  patched for the finger width of gripper_details, and save gripper_details in
+  it. The reference config is read from its task folder unless the patch is
+  given. Any .mjb files are left out, they must be compiled again
+  """
+
+  if patch is None:
+    with open(reference_dir + "/" + config_filename) as file:
+      patch = get_width_patch(yaml.safe_load(file), gripper_details)
+
+  if os.path.exists(reference_dir + "/" + bundle_filename):
+    raise ValueError(f"the task files of {reference_dir} are bundled, they cannot be patched")
+
+  if os.path.exists(task_dir): shutil.rmtree(task_dir)
+  shutil.copytree(reference_dir, task_dir,
+                  ignore=shutil.ignore_patterns("*.mjb", mjb_manifest_filename))
+
+  reference_folder = os.path.basename(os.path.normpath(reference_dir))
+  task_folder = os.path.basename(os.path.normpath(task_dir))
+  inertials = {}
+  for name in sorted(os.listdir(task_dir)):
+    if name.endswith(".xml"):
+      tree = etree.parse(task_dir + "/" + name)
+      patch_tree(tree, patch, reference_folder, task_folder, inertials)
+      tree.write(task_dir + "/" + name)
+
+  with open(task_dir + "/" + config_filename, "w") as outfile:
+    yaml.dump(gripper_details, outfile, default_flow_style=False)
+
+# ----- checking against a full build ----- #
+
+def compare_task_folders(derived_dir, built_dir, rtol=1e-5, atol=1e-9):
+  """
+  Compare a derived task folder with a full build of the same variant, returning
+  a list of the differences found. Numbers are compared to the precision
+  compile writes them, and inertials by their tensors, as the principal axes
+  of equal moments can be written either way. The .mjb files are not compared
+  """
+
+  def get_files(folder):
+    return sorted([os.path.relpath(root + "/" + x, folder) for root, dirs, files in os.walk(folder)
+                   for x in files if not x.endswith(".mjb") and x != mjb_manifest_filename])
+
+  def differ(a, b):
+    try: a, b = np.array(a.split(), dtype=float), np.array(b.split(), dtype=float)
+    except ValueError: return True
+    return a.shape != b.shape or not np.allclose(a, b, rtol=rtol, atol=atol)
+
+  derived_files, built_files = get_files(derived_dir), get_files(built_dir)
+  differences = [f"{x} is only in {derived_dir if x in derived_files else built_dir}"
+                 for x in sorted(set(derived_files) ^ set(built_files))]
+
+  for name in [x for x in built_files if x in derived_files]:
+    with open(derived_dir + "/" + name, "rb") as a, open(built_dir + "/" + name, "rb") as b:
+      if a.read() == b.read(): continue
+    if not name.endswith(".xml"):
+      differences.append(f"{name} differs")
+      continue
+
+    derived = list(etree.parse(derived_dir + "/" + name).getroot().iter())
+    built = list(etree.parse(built_dir + "/" + name).getroot().iter())
+    if [x.tag for x in derived] != [x.tag for x in built]:
+      differences.append(f"{name} has different elements")
+      continue
+    for x, y in zip(derived, built):
+      parent = y.getparent()
+      where = f"{name} {x.tag} {y.get('name') or ('' if parent is None else parent.get('name', ''))}"
+      if x.tag == "inertial":
+        a, b = get_inertia(x), get_inertia(y)
+        for k in a:
+          if not np.allclose(a[k], b[k], rtol=rtol, atol=atol):
+            differences.append(f"{where} {k}: {a[k].tolist()} != {b[k].tolist()}")
+        continue
+      for k in sorted(set(x.attrib) | set(y.attrib)):
+        if x.get(k) != y.get(k) and (x.get(k) is None or y.get(k) is None or differ(x.get(k), y.get(k))):
+          differences.append(f"{where} {k}: {x.get(k)} != {y.get(k)}")
+
+  return differences
+
+if __name__ == "__main__":
+
+  # derive one task folder from another, eg to check against a full build
+  parser = argparse.ArgumentParser()
+  parser.add_argument("reference") # task folder of the reference variant
+  parser.add_argument("output") # task folder to create
+  parser.add_argument("--width", type=float, required=True) # finger width of the output in mm
+  parser.add_argument("--compare", default=None) # full build of the output to compare with
+  args = parser.parse_args()
+
+  with open(args.reference + "/" + config_filename) as file:
+    gripper_details = yaml.safe_load(file)
+  gripper_details["gripper_params"]["finger_width"] = args.width * 1e-3
+
+  derive_task_folder(args.reference, args.output, gripper_details)
+  print(f"Derived {args.output} from {args.reference}")
+
+  if args.compare is not None:
+    differences = compare_task_folders(args.output, args.compare)
+    for x in differences: print(x)
+    print(f"{len(differences)} differences from the full build in {args.compare}")
+    exit(1 if len(differences) > 0 else 0)
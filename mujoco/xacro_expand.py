@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""
+Expand the robot xacros inside this python process, instead of starting
+./xacro3 for every robot file of every gripper variant. Each xacro file is
+parsed once into a DOM document, and later expansions (which include the same
+macro files) work on a copy of it, while the macros in it are still defined
+again by every expansion. The gripper config can be given as a dictionary
+rather than reloaded from config/gripper.yaml by every load_yaml(). Macro
+calls are also spliced into the document in one step, where xacro inserts each
+node with a search of its new siblings, which is quadratic in the number of
+links and most of the time for many segments. The output is identical to
+'./xacro3 file > output'.
+
+This replaces xacro internals, so it is only done for the xacro releases in
+patched_xacro_versions. Any other release runs unpatched xacro.process_file(),
+which reads the gripper config from its file:
+
+  from xacro_expand import expand_xacro
+
+  urdf = expand_xacro("xacro/gripper_task.urdf.xacro", root_dir=mujoco_dir,
+                      config=gripper_details)
+"""
+
+import os
+import copy
+import importlib.metadata
+import xml.dom.minidom
+import threading
+import contextlib
+import yaml
+import xacro
+
+# the config file loaded by the xacros, relative to the mujoco folder
+config_file = "../config/gripper.yaml"
+
+# parsed xacro documents and loaded yaml files, keyed by their real path,
+# modification time and size so that edited files are read again
+parsed_files = {}
+loaded_yamls = {}
+
+# xacro keeps its state in module globals, so one expansion runs at a time
+xacro_lock = threading.Lock()
+
+# xacro releases whose internals (parse, replace_node, the load_yaml symbols
+# and the minidom id cache) have been checked to give identical output patched
+patched_xacro_versions = ["2.1.1"]
+
+# the xacro functions which are replaced during an expansion
+original_parse = xacro.parse
+original_replace_node = xacro.replace_node
+
+def can_patch_xacro():
+  """
+  Is the installed xacro a release whose internals can be patched
+  """
+  try: version = importlib.metadata.version("xacro")
+  except importlib.metadata.PackageNotFoundError: return False
+  symbols = getattr(xacro, "_global_symbols", {})
+  return (version in patched_xacro_versions and "load_yaml" in symbols
+          and "load_yaml" in symbols.get("xacro", {})
+          and hasattr(xml.dom.minidom, "_clear_id_cache"))
+
+patch_xacro = can_patch_xacro()
+
+def get_file_key(path):
+  """
+  Get the key of a file in the caches
+  """
+  stat = os.stat(path)
+  return (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+
+def parse_cached(inp, filename=None):
+  """
+  Replaces xacro.parse(), returning a copy of the parsed document of filename,
+  which is only read and parsed the first time
+  """
+  if inp is not None: return original_parse(inp, filename)
+  try: key = get_file_key(os.path.join(xacro.root_dir, filename))
+  except OSError: return original_parse(inp, filename) # raises the usual xacro error
+  if key not in parsed_files:
+    parsed_files[key] = original_parse(None, filename)
+  return parsed_files[key].cloneNode(True)
+
+def replace_node(node, by, content_only=False):
+  """
+  Replaces xacro.replace_node(), putting the nodes in by (or their children
+  if content_only) in place of node, with one splice of the child list
+  """
+  parent = node.parentNode
+  if by is None: by = []
+  elif not isinstance(by, list): by = [by]
+  new_nodes = [x for doc in by for x in (list(doc.childNodes) if content_only else [doc])]
+
+  # moving siblings or fragments is left to xacro, it never does so for macros
+  if any([x.parentNode is parent or x.nodeType == x.DOCUMENT_FRAGMENT_NODE for x in new_nodes]):
+    return original_replace_node(node, by, content_only)
+
+  # detach the new nodes from where they were
+  for doc in by:
+    if content_only:
+      xml.dom.minidom._clear_id_cache(doc)
+      del doc.childNodes[:]
+    elif doc.parentNode is not None:
+      doc.parentNode.removeChild(doc)
+
+  index = parent.childNodes.index(node)
+  xml.dom.minidom._clear_id_cache(parent)
+  parent.childNodes[index:index + 1] = new_nodes
+  node.parentNode = node.previousSibling = node.nextSibling = None
+
+  # link the siblings either side of the splice
+  before = parent.childNodes[index - 1] if index > 0 else None
+  end = index + len(new_nodes)
+  after = parent.childNodes[end] if end < len(parent.childNodes) else None
+  for x in new_nodes:
+    x.parentNode = parent
+    x.previousSibling = before
+    if before is not None: before.nextSibling = x
+    before = x
+  if before is not None: before.nextSibling = after
+  if after is not None: after.previousSibling = before
+
+def get_load_yaml(configs):
+  """
+  Get a replacement for xacro's load_yaml(), which returns a copy of the
+  dictionary in configs for any file given there, and otherwise loads each
+  file once
+  """
+
+  # yaml files may use the units of xacro (eg !degrees), which are added to a
+  # loader of our own so that yaml.safe_load() is unchanged for everyone else
+  class XacroLoader(yaml.SafeLoader): pass
+  for unit in xacro.ConstructUnits:
+    XacroLoader.add_constructor(unit.value.tag, unit.constructor)
+
+  def load_yaml(filename):
+    path = os.path.realpath(os.path.join(xacro.root_dir, xacro.abs_filename_spec(filename)))
+    if path in configs:
+      data = configs[path]
+    else:
+      key = get_file_key(path)
+      if key not in loaded_yamls:
+        with open(path) as file:
+          loaded_yamls[key] = yaml.load(file, Loader=XacroLoader)
+      data = loaded_yamls[key]
+    return xacro.YamlListWrapper.wrap(copy.deepcopy(data))
+  return load_yaml
+
+@contextlib.contextmanager
+def patched_xacro(root_dir, configs):
+  """
+  Make xacro resolve files from root_dir, reuse parsed files, splice macro
+  calls and take the given configs from memory, restoring it afterwards
+  """
+  symbols = xacro._global_symbols
+  saved = (xacro.root_dir, xacro.parse, xacro.replace_node, symbols["load_yaml"],
+           symbols["xacro"]["load_yaml"])
+  load_yaml = get_load_yaml(configs)
+  xacro.root_dir = root_dir
+  xacro.parse = parse_cached
+  xacro.replace_node = replace_node
+  symbols["load_yaml"] = load_yaml
+  symbols["xacro"]["load_yaml"] = load_yaml
+  try:
+    yield
+  finally:
+    (xacro.root_dir, xacro.parse, xacro.replace_node, symbols["load_yaml"],
+     symbols["xacro"]["load_yaml"]) = saved
+    del xacro.all_includes[:]
+
+def expand_xacro(filename, root_dir=".", config=None):
+  """
+  Expand the xacro filename (relative to root_dir, where ./xacro3 would be run)
+  into urdf text. If config is given it is used in place of the gripper config
+  file, without reading it, unless xacro cannot be patched, when the file is
+  read (the config must match it, as for the build graph)
+  """
+  if not patch_xacro:
+    with xacro_lock:
+      saved = xacro.root_dir
+      xacro.root_dir = os.path.abspath(root_dir) # as 'xacro --root-dir'
+      try:
+        return xacro.process_file(filename).toprettyxml(indent="  ")
+      finally:
+        xacro.root_dir = saved
+
+  configs = {}
+  if config is not None:
+    configs[os.path.realpath(os.path.join(root_dir, config_file))] = config
+  with xacro_lock, patched_xacro(os.path.abspath(root_dir), configs):
+    return xacro.process_file(filename).toprettyxml(indent="  ")
+
+def expand_variants(filenames, configs, root_dir="."):
+  """
+  Expand every xacro in filenames for each config in turn, returning a list
+  with a dictionary of filename to urdf text for each config
+  """
+  return [{x: expand_xacro(x, root_dir, config) for x in filenames} for config in configs]
@@ -1,28 +1,35 @@
 #!/usr/bin/env python3
 
+"""
+This script puts the final touches on the mujoco files built from the robot
+urdfs, and randomly splits the object set into many task files. It is run by
+the Makefile from the command line, or it can be imported and driven from
+python without re-reading any yaml files, eg for a sweep over many grippers:
+
+  from xml_script import build_task_files, load_object_trees
+  object_trees = load_object_trees("build/objects")
+  build_task_files(gripper_details, object_details, "build",
+                   task_folder="gripper_N5_24", object_trees=object_trees)
+"""
+
 import yaml
 import os
+import io
+import subprocess
+import shutil
+import hashlib
+import sqlite3
 from lxml import etree
 from math import floor, ceil
 from copy import deepcopy
 import numpy as np
 import argparse
+from task_bundle import write_bundle, bundle_filename
+from build_trace import span
 
-# ----- if we are given command line arguments ---- #
-
-# define arguments and parse them
-parser = argparse.ArgumentParser()
-parser.add_argument("--build-folder",         default="build")
-parser.add_argument("--objects-folder",       default="objects")
-parser.add_argument("--task-folder",          default="task")
-parser.add_argument("--gen-objects",          default=True, type=int) 
-
-args = parser.parse_args()
-
-# # parse arguments but allow unknown arguments
-# args, unknown = parser.parse_known_args()
-
-generate_objects = bool(args.gen_objects)
+# the libyaml bindings are much faster for the large splits.yaml, if available
+yaml_dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 # ----- initial setup, no need to change ----- #
 
@@ -34,75 +41,36 @@ print_test_masses = False # do we print all masses of the test set
 demo = False # are we arranging objects into demo mode
 
 # define directory structure
-build_folder = args.build_folder
-objects_folder = args.objects_folder
-task_file_folder = args.task_folder
 gripper_config_file = "/config/gripper.yaml"
-define_objects_file = "/" + objects_folder + "/define_objects.yaml"
+define_objects_file = "define_objects.yaml"
+splits_file = "splits.yaml"
+asset_split_filename = "assets/assets_{}.xml"
+object_split_filename = "objects/objects_{}.xml"
+keyframe_split_filename = "keyframes/keyframe_{}.xml"
+shared_robot_filename = "shared_robot.xml"
+mjb_manifest_filename = "mjb_manifest.yaml"
+object_index_filename = "objects.db" # made by build_object_set.py
+task_objects_filename = "task_objects.npy"
+
+# one row for the object in every slot of every split, see save_task_objects()
+task_object_dtype = np.dtype([
+  ("used", "?"),                # false for empty slots at the end of the last split
+  ("name", "U128"),
+  ("size", "<f8", (3,)),        # x, y, z size when resting
+  ("z_rest", "<f8"),
+  ("qpos", "<f8", (7,)),        # spawn pose in the keyframe
+  ("mass", "<f8"),
+  ("friction", "<f8", (3,)),
+])
 
 # get relevant path information
 filepath = os.path.dirname(os.path.abspath(__file__))
 description_path = os.path.dirname(filepath)
-directory_path = filepath + "/" + build_folder + "/"
-
-with open(description_path + gripper_config_file) as file:
-  gripper_details = yaml.safe_load(file)
-
-with open(directory_path + define_objects_file) as file:
-  object_details = yaml.safe_load(file)
-
-# do we have a fixed random seed (so test set fixed)
-rand_seed = object_details["settings"]["fixed_random_seed"]
-shuffle_objects = object_details["settings"]["random_order"]
-if rand_seed == 0: rand_seed = np.random.randint(0, 2147483647)
-np.random.seed(rand_seed)
-
-if debug:
-  print("Running xml_script.py, debug mode is ON")
-  print("The random seed is:", rand_seed, "yaml value = ", object_details['settings']['fixed_random_seed'])
-  print("The gripper description directory path is:", description_path)
-  print("The mjcf directory path is:", directory_path)
-  print("The task folder name is:", task_file_folder)
-  print("Generate objects flag is:", generate_objects)
 
 # ----- essential user defined parameters ----- #
 
-# exctract the details of the gripper configuration from yaml file
-is_segmented = gripper_details["gripper_config"]["is_segmented"]
-num_segments = gripper_details["gripper_config"]["num_segments"]
-fixed_first_segment = gripper_details["gripper_config"]["fixed_first_segment"]
-fixed_hook_segment = gripper_details["gripper_config"]["fixed_hook_segment"]
-fixed_motor_joints = gripper_details["gripper_config"]["fixed_motor_joints"]
-use_xy_base_joint = gripper_details["gripper_config"]["xy_base_joint"]
-use_z_base_rotation = gripper_details["gripper_config"]["z_base_rotation"]
 use_sky = True # do we include a skybox
 
-if debug:
-  print("is segmented is", is_segmented)
-  print("num segments is", num_segments)
-  print("fixed first segment is", fixed_first_segment)
-  print("fixed hook joint is", fixed_hook_segment)
-  print("fixed motor joints is", fixed_motor_joints)
-  print("xy_base joint is", use_xy_base_joint)
-
-# starting configuration of the robot joints
-joint_start = {
-  "panda_joint1": 0.0,
-  "panda_joint2": 0.0,
-  "panda_joint3": 0.0,
-  "panda_joint4": 0.0,
-  "panda_joint5": 0.0,
-  "panda_joint6": 0.0,
-  "panda_joint7": 0.0,
-  "gripper_prismatic": gripper_details["gripper_params"]["xy_home"],
-  "gripper_revolute": 0.0,
-  "gripper_palm": gripper_details["gripper_params"]["z_home"],
-  "base_x_joint": 0.0,
-  "base_y_joint": 0.0,
-  "base_z_joint": 0.0,
-  "base_z_rotation_joint": 0.0,
-}
-
 # panda parameters
 panda_control = "motor"
 
@@ -132,61 +100,157 @@ gripper_joints = [
   "finger_2_prismatic_joint", "finger_2_revolute_joint",
   "finger_3_prismatic_joint", "finger_3_revolute_joint",
   "palm_prismatic_joint"]
-if use_xy_base_joint:
-  base_joints = ["base_X_joint", "base_Y_joint", "base_Z_joint"]
-  if use_z_base_rotation:
-    base_joints += ["base_Z_rotation_joint"]
-else: base_joints = ["world_to_base"]
+panda_joints = ["panda_joint{0}".format(i) for i in range(1,8)]
 
-# ----- generate qpos and joint names ---- #
+# ----- xml snippets which do not depend on the gripper configuration ----- #
 
-ffs = 1 if fixed_first_segment else 0
-hk_jnt = 0 if fixed_hook_segment else 1
+task_keyframe = """
+  <keyframe>
+    <key name="initial pose"
+         time="0"
+         qpos="{0} {1} {2}"
+    />
+  </keyframe>
+"""
 
-# auto generate joint names
-panda_joints = ["panda_joint{0}".format(i) for i in range(1,8)]
-finger_joints = ["finger_{0}_segment_joint_{1}".format(i, j) for i in range(1,4) 
-                  for j in range(ffs, num_segments)]
-
-# define keyframe qpos for segmented finger, 0 for all
-if is_segmented:
-  finger_joint_qpos = "0 " * (num_segments - ffs + hk_jnt)
-else:
-  finger_joint_qpos = ""
-
-# define keyframe qpos for main model joints
-if fixed_motor_joints:
-  gripper_qpos = "{0} {0} {0} {1}".format(
-    finger_joint_qpos, joint_start["gripper_palm"]
-  )
-else:
-  gripper_qpos = "{0} {1} {2} {0} {1} {2} {0} {1} {2} {3}".format(
-    joint_start["gripper_prismatic"], joint_start["gripper_revolute"], 
-    finger_joint_qpos, joint_start["gripper_palm"]
-  )
-panda_qpos = "{0} {1} {2} {3} {4} {5} {6}".format(
-  joint_start["panda_joint1"], joint_start["panda_joint2"], 
-  joint_start["panda_joint3"], joint_start["panda_joint4"],
-  joint_start["panda_joint5"], joint_start["panda_joint6"], 
-  joint_start["panda_joint7"]
-)
-if use_xy_base_joint:
-  base_joint_qpos = "{0} {1} {2}".format(
-    joint_start["base_x_joint"],
-    joint_start["base_y_joint"],
-    joint_start["base_z_joint"]
-  )
-  if use_z_base_rotation:
-    base_joint_qpos += f" {joint_start['base_z_rotation_joint']}"
-else:
-  base_joint_qpos = "{0}".format(
-    joint_start["base_z_joint"]
+# define the actuator information
+gripper_actuator_subelement = """
+  <{0} name="{1}_actuator" joint="{1}"/>
+"""
+
+panda_actuator_subelement = """
+  <{0} name="{1}_actuator" joint="{1}"/>
+"""
+
+finger_actuator_subelement = """
+  <{0} name="{1}_actuator" joint="{1}"/>
+"""
+
+base_actuator_subelement = """
+  <{0} name="{1}_actuator" joint="{1}"/>
+"""
+
+# ----- create force sensor xml ----- #
+
+force_sensor_site = """
+  <site name="force sensor site"
+        type="sphere"
+        rgba="0 0 0 0"
+        size="0.005 0.005 0.005"
+        pos="0 0 0"
+        quat="0 0 0 1"
+  />
+"""
+
+force_sensor = """
+  <sensor>
+    <force name="force sensor" noise="0" site="force sensor site"/>
+  </sensor>
+"""
+
+object_customs = """
+  <numeric name="{0}" size="3" data="{1} {2} {3}"/>
+"""
+
+# ----- xml snippets which depend on the gripper configuration ----- #
+
+def get_robot_xml(gripper_details):
+  """
+  Create the keyframe, actuator, camera, constraint and custom field xml for a
+  given gripper configuration (the dictionary from config/gripper.yaml). These
+  are returned as a dictionary of formatted xml strings
+  """
+
+  # exctract the details of the gripper configuration from yaml file
+  is_segmented = gripper_details["gripper_config"]["is_segmented"]
+  num_segments = gripper_details["gripper_config"]["num_segments"]
+  fixed_first_segment = gripper_details["gripper_config"]["fixed_first_segment"]
+  fixed_hook_segment = gripper_details["gripper_config"]["fixed_hook_segment"]
+  fixed_motor_joints = gripper_details["gripper_config"]["fixed_motor_joints"]
+  use_xy_base_joint = gripper_details["gripper_config"]["xy_base_joint"]
+  use_z_base_rotation = gripper_details["gripper_config"]["z_base_rotation"]
+
+  if debug:
+    print("is segmented is", is_segmented)
+    print("num segments is", num_segments)
+    print("fixed first segment is", fixed_first_segment)
+    print("fixed hook joint is", fixed_hook_segment)
+    print("fixed motor joints is", fixed_motor_joints)
+    print("xy_base joint is", use_xy_base_joint)
+
+  # starting configuration of the robot joints
+  joint_start = {
+    "panda_joint1": 0.0,
+    "panda_joint2": 0.0,
+    "panda_joint3": 0.0,
+    "panda_joint4": 0.0,
+    "panda_joint5": 0.0,
+    "panda_joint6": 0.0,
+    "panda_joint7": 0.0,
+    "gripper_prismatic": gripper_details["gripper_params"]["xy_home"],
+    "gripper_revolute": 0.0,
+    "gripper_palm": gripper_details["gripper_params"]["z_home"],
+    "base_x_joint": 0.0,
+    "base_y_joint": 0.0,
+    "base_z_joint": 0.0,
+    "base_z_rotation_joint": 0.0,
+  }
+
+  # define the base joint names
+  if use_xy_base_joint:
+    base_joints = ["base_X_joint", "base_Y_joint", "base_Z_joint"]
+    if use_z_base_rotation:
+      base_joints += ["base_Z_rotation_joint"]
+  else: base_joints = ["world_to_base"]
+
+  # ----- generate qpos and joint names ---- #
+
+  ffs = 1 if fixed_first_segment else 0
+  hk_jnt = 0 if fixed_hook_segment else 1
+
+  # auto generate joint names
+  finger_joints = ["finger_{0}_segment_joint_{1}".format(i, j) for i in range(1,4) 
+                    for j in range(ffs, num_segments)]
+
+  # define keyframe qpos for segmented finger, 0 for all
+  if is_segmented:
+    finger_joint_qpos = "0 " * (num_segments - ffs + hk_jnt)
+  else:
+    finger_joint_qpos = ""
+
+  # define keyframe qpos for main model joints
+  if fixed_motor_joints:
+    gripper_qpos = "{0} {0} {0} {1}".format(
+      finger_joint_qpos, joint_start["gripper_palm"]
+    )
+  else:
+    gripper_qpos = "{0} {1} {2} {0} {1} {2} {0} {1} {2} {3}".format(
+      joint_start["gripper_prismatic"], joint_start["gripper_revolute"], 
+      finger_joint_qpos, joint_start["gripper_palm"]
+    )
+  panda_qpos = "{0} {1} {2} {3} {4} {5} {6}".format(
+    joint_start["panda_joint1"], joint_start["panda_joint2"], 
+    joint_start["panda_joint3"], joint_start["panda_joint4"],
+    joint_start["panda_joint5"], joint_start["panda_joint6"], 
+    joint_start["panda_joint7"]
   )
+  if use_xy_base_joint:
+    base_joint_qpos = "{0} {1} {2}".format(
+      joint_start["base_x_joint"],
+      joint_start["base_y_joint"],
+      joint_start["base_z_joint"]
+    )
+    if use_z_base_rotation:
+      base_joint_qpos += f" {joint_start['base_z_rotation_joint']}"
+  else:
+    base_joint_qpos = "{0}".format(
+      joint_start["base_z_joint"]
+    )
 
-# ----- create keyframe xml -----#
+  # ----- create keyframe xml -----#
 
-# format xml code with keyframe information
-gripper_keyframe = """ 
+  # format xml code with keyframe information
+  gripper_keyframe = """ 
   <keyframe>
     <key name="initial pose"
          time="0"
@@ -195,7 +259,7 @@ gripper_keyframe = """
   </keyframe>
 """.format(gripper_qpos)
 
-panda_keyframe = """
+  panda_keyframe = """
   <keyframe>
     <key name="initial pose"
          time="0"
@@ -204,7 +268,7 @@ panda_keyframe = """
   </keyframe>
 """.format(panda_qpos)
 
-panda_and_gripper_keyframe = """
+  panda_and_gripper_keyframe = """
   <keyframe>
     <key name="initial pose"
          time="0"
@@ -213,74 +277,48 @@ panda_and_gripper_keyframe = """
   </keyframe>
 """.format(panda_qpos, gripper_qpos)
 
-task_keyframe = """
-  <keyframe>
-    <key name="initial pose"
-         time="0"
-         qpos="{0} {1} {2}"
-    />
-  </keyframe>
-"""
-
-# ----- create actuator xml ----- #
-
-# define the actuator information
-gripper_actuator_subelement = """
-  <{0} name="{1}_actuator" joint="{1}"/>
-"""
-
-panda_actuator_subelement = """
-  <{0} name="{1}_actuator" joint="{1}"/>
-"""
+  # ----- create actuator xml ----- #
 
-finger_actuator_subelement = """
-  <{0} name="{1}_actuator" joint="{1}"/>
-"""
-
-base_actuator_subelement = """
-  <{0} name="{1}_actuator" joint="{1}"/>
-"""
-
-# create actuator xml for each joint
-gripper_actuator_string = """"""
-for joint in gripper_joints:
-  if fixed_motor_joints: 
-    if joint.endswith("revolute_joint"): continue
-    if joint.endswith("prismatic_joint"): continue
-  gripper_actuator_string += gripper_actuator_subelement.format(
-    gripper_control, joint
-  )
-panda_actuator_string = """"""
-for joint in panda_joints:
-  panda_actuator_string += panda_actuator_subelement.format(
-    panda_control, joint
-  )
-finger_actuator_string = """"""
-for joint in finger_joints:
-  finger_actuator_string += finger_actuator_subelement.format(
-    finger_control, joint
-  )
-base_actuator_string = """"""
-for joint in base_joints:
-  base_actuator_string += base_actuator_subelement.format(
-    base_control, joint
-  )
+  # create actuator xml for each joint
+  gripper_actuator_string = """"""
+  for joint in gripper_joints:
+    if fixed_motor_joints: 
+      if joint.endswith("revolute_joint"): continue
+      if joint.endswith("prismatic_joint"): continue
+    gripper_actuator_string += gripper_actuator_subelement.format(
+      gripper_control, joint
+    )
+  panda_actuator_string = """"""
+  for joint in panda_joints:
+    panda_actuator_string += panda_actuator_subelement.format(
+      panda_control, joint
+    )
+  finger_actuator_string = """"""
+  for joint in finger_joints:
+    finger_actuator_string += finger_actuator_subelement.format(
+      finger_control, joint
+    )
+  base_actuator_string = """"""
+  for joint in base_joints:
+    base_actuator_string += base_actuator_subelement.format(
+      base_control, joint
+    )
 
-# format the final xml chunks for the actuation
-gripper_actuator = """
+  # format the final xml chunks for the actuation
+  gripper_actuator = """
   <actuator>
     {0}
     {1}
   </actuator>
 """.format(gripper_actuator_string, finger_actuator_string)
 
-panda_actuator = """
+  panda_actuator = """
   <actuator>
     {0}
   </actuator>
 """.format(panda_actuator_string)
 
-panda_and_gripper_actuator = """
+  panda_and_gripper_actuator = """
   <actuator>
     {0}
     {1}
@@ -288,7 +326,7 @@ panda_and_gripper_actuator = """
   </actuator>
 """.format(panda_actuator_string, gripper_actuator_string, finger_actuator_string)
 
-task_actuator = """
+  task_actuator = """
   <actuator>
     {0}
     {1}
@@ -296,31 +334,13 @@ task_actuator = """
   </actuator>
 """.format(base_actuator_string, gripper_actuator_string, finger_actuator_string)
 
-# ----- create force sensor xml ----- #
-
-force_sensor_site = """
-  <site name="force sensor site"
-        type="sphere"
-        rgba="0 0 0 0"
-        size="0.005 0.005 0.005"
-        pos="0 0 0"
-        quat="0 0 0 1"
-  />
-"""
-
-force_sensor = """
-  <sensor>
-    <force name="force sensor" noise="0" site="force sensor site"/>
-  </sensor>
-"""
-
-# ----- create depth camera xml ----- #
+  # ----- create depth camera xml ----- #
 
-if fixed_motor_joints:
-  depth_target = "finger_1_segment_link_1" # since actual target does not exist
-else:
-  depth_target = "finger_1_intermediate"
-depth_camera = f"""
+  if fixed_motor_joints:
+    depth_target = "finger_1_segment_link_1" # since actual target does not exist
+  else:
+    depth_target = "finger_1_intermediate"
+  depth_camera = f"""
   <camera name="depth camera" 
           mode="fixed" 
           target="{depth_target}" 
@@ -328,9 +348,9 @@ depth_camera = f"""
           quat="0.208 0.978 0 0"/>
 """
 
-# ----- create equality constraints for gripper motors ----- #
-if not fixed_motor_joints:
-  equality_constraints = """
+  # ----- create equality constraints for gripper motors ----- #
+  if not fixed_motor_joints:
+    equality_constraints = """
     <equality>
       <weld name="pris1_weld"
             active="false"
@@ -369,8 +389,8 @@ if not fixed_motor_joints:
       />
     </equality>
   """
-else:
-  equality_constraints = """
+  else:
+    equality_constraints = """
     <equality>
       <weld name="palm_weld"
             active="false"
@@ -380,8 +400,8 @@ else:
     </equality>
   """
 
-# ----- input settings and dimensions ----- #
-custom_fields = """
+  # ----- input settings and dimensions ----- #
+  custom_fields = """
     <numeric name="finger_length" data="{0}"/>
     <numeric name="finger_width" data="{1}"/>
     <numeric name="finger_thickness" data="{2}"/>
@@ -395,28 +415,98 @@ custom_fields = """
     <numeric name="xy_base_rotation" data="{10}"/>
     <numeric name="z_base_rotation" data="{11}"/>
 """.format(
-  gripper_details["gripper_params"]["finger_length"],
-  gripper_details["gripper_params"]["finger_width"],
-  gripper_details["gripper_params"]["finger_thickness"],
-  gripper_details["gripper_params"]["finger_E"],
-  gripper_details["gripper_params"]["fingertip_clearance"],
-  gripper_details["gripper_params"]["hook_angle_degrees"],
-  gripper_details["gripper_params"]["hook_length"],
-  int(gripper_details["gripper_config"]["fixed_hook_segment"]),
-  int(gripper_details["gripper_config"]["fixed_first_segment"]),
-  int(gripper_details["gripper_config"]["xy_base_joint"]),
-  int(gripper_details["gripper_config"]["xy_base_rotation"]),
-  int(gripper_details["gripper_config"]["z_base_rotation"]),
-)
-
-object_customs = """
-  <numeric name="{0}" size="3" data="{1} {2} {3}"/>
-"""
+    gripper_details["gripper_params"]["finger_length"],
+    gripper_details["gripper_params"]["finger_width"],
+    gripper_details["gripper_params"]["finger_thickness"],
+    gripper_details["gripper_params"]["finger_E"],
+    gripper_details["gripper_params"]["fingertip_clearance"],
+    gripper_details["gripper_params"]["hook_angle_degrees"],
+    gripper_details["gripper_params"]["hook_length"],
+    int(gripper_details["gripper_config"]["fixed_hook_segment"]),
+    int(gripper_details["gripper_config"]["fixed_first_segment"]),
+    int(gripper_details["gripper_config"]["xy_base_joint"]),
+    int(gripper_details["gripper_config"]["xy_base_rotation"]),
+    int(gripper_details["gripper_config"]["z_base_rotation"]),
+  )
 
-all_object_customs = []
+  return {
+    "num_segments" : num_segments,
+    "fixed_first_segment" : fixed_first_segment,
+    "gripper_qpos" : gripper_qpos,
+    "base_joint_qpos" : base_joint_qpos,
+    "gripper_keyframe" : gripper_keyframe,
+    "panda_keyframe" : panda_keyframe,
+    "panda_and_gripper_keyframe" : panda_and_gripper_keyframe,
+    "gripper_actuator" : gripper_actuator,
+    "panda_actuator" : panda_actuator,
+    "panda_and_gripper_actuator" : panda_and_gripper_actuator,
+    "task_actuator" : task_actuator,
+    "depth_camera" : depth_camera,
+    "equality_constraints" : equality_constraints,
+    "custom_fields" : custom_fields,
+  }
 
 # ----- helper functions ----- #
 
+# index from (tag, name) to elements for trees being edited, see index_names()
+name_indexes = {}
+
+def index_element(index, element):
+  """
+  Add an element and every named element beneath it to a name index
+  """
+  for e in element.iter(tag=etree.Element):
+    name = e.get("name")
+    if name is not None:
+      index.setdefault((e.tag, name), []).append(e)
+
+def index_names(tree):
+  """
+  Build an index from (tag, name) to the elements of a tree, so that helpers
+  can find named elements without searching the whole tree. The index is kept
+  up to date by add_chunk() and the helpers which rename elements, and is
+  removed with forget_names() once the tree is no longer edited
+  """
+  index = {}
+  for e in tree.getroot():
+    index_element(index, e)
+  name_indexes[tree] = index
+  return index
+
+def get_name_index(tree):
+  """
+  Get the name index of a tree, building it if needed
+  """
+  if tree in name_indexes: return name_indexes[tree]
+  return index_names(tree)
+
+def forget_names(tree):
+  """
+  Remove the name index of a tree
+  """
+  name_indexes.pop(tree, None)
+
+def find_named(tree, tagname, names):
+  """
+  Find all elements with a given tag and any of the given names (a name or a
+  list of names), in the order of the names
+  """
+  index = get_name_index(tree)
+  if isinstance(names, str): names = [names]
+  return [e for n in names for e in index.get((tagname, n), [])]
+
+def rename_element(tree, element, name):
+  """
+  Set the name of an element, updating the name index of its tree if it has one
+  """
+  if tree in name_indexes:
+    index = name_indexes[tree]
+    old = element.get("name")
+    if old is not None and element in index.get((element.tag, old), []):
+      index[(element.tag, old)].remove(element)
+    index.setdefault((element.tag, name), []).append(element)
+  element.set("name", name)
+
 def modify_tag_text(tree, tagname, target_text):
   """
   This function loads an xml file, finds a specific tag, then overrides that
@@ -452,19 +542,13 @@ def modify_tag_attribute(tree, tagname, attribute_name, new_value):
 
 def add_tag_attribute(tree, tagname, tag_label, attribute_name, attribute_value):
   """
-  Add a new attribute for a tag, eg <tag/> goes to <tag attribute="true"/>
+  Add a new attribute for a tag, eg <tag/> goes to <tag attribute="true"/>. The
+  tag_label can be a list of names to edit many tags at once
   """
 
-  # now get the root of the tree
-  root = tree.getroot()
-
-  # search recursively for all instances of the tag
-  tags = root.findall(".//" + tagname)
-
-  # add the attribute only if the tag_label matches
-  for t in tags:
-    if t.attrib["name"] == tag_label:
-      t.set(attribute_name, attribute_value)
+  # add the attribute only to tags where the tag_label matches
+  for t in find_named(tree, tagname, tag_label):
+    t.set(attribute_name, attribute_value)
 
 def add_chunk(tree, parent_tag, xml_string_to_add):
   """
@@ -478,6 +562,10 @@ def add_chunk(tree, parent_tag, xml_string_to_add):
   # get the root of the parent tree
   root = tree.getroot()
 
+  # keep the name index up to date
+  if tree in name_indexes:
+    index_element(name_indexes[tree], new_tree)
+
   # special case where we are adding at the root
   if parent_tag == "@root":
     root.append(new_tree)
@@ -511,77 +599,70 @@ def add_chunk_with_specific_attribute(tree, parent_tag, attribute_name,
 
   # special case where we are adding at the root
   if parent_tag == "@root":
+    if tree in name_indexes:
+      index_element(name_indexes[tree], new_tree)
     root.append(new_tree)
     return
 
-  # search recursively for all instances of the parent tag
-  tags = root.findall(".//" + parent_tag)
+  # look names up in the index, otherwise search recursively for the parent tag
+  if attribute_name == "name":
+    tags = find_named(tree, parent_tag, attribute_value)
+  else:
+    tags = [t for t in root.findall(".//" + parent_tag)
+            if t.attrib[attribute_name] == attribute_value]
 
   for t in tags:
-    if t.attrib[attribute_name] == attribute_value:
-      t.append(new_tree)
+    t.append(new_tree)
+
+  if len(tags) > 0 and tree in name_indexes:
+    index_element(name_indexes[tree], new_tree)
   
   return
 
 def add_geom_name(tree, parent_body):
   """
-  Add a geom name to a geom
+  Add a geom name to a geom, parent_body can be a list of body names
   """
 
-  # now get the root of the tree
-  root = tree.getroot()
-
-  # search recursively for all instances of the tag
-  tags = root.findall(".//" + "body")
-
   labels = ["visual", "collision", "hook_visual", "hook_collision"]
 
   # special case if we want to name every single geom
   if parent_body == "@all":
     num = 0
-    for t in tags:
+    for t in tree.getroot().findall(".//" + "body"):
       name = t.attrib["name"]
       geoms = t.findall("geom")
       for i, g in enumerate(geoms):
         try:
-          g.set("name", name + "_geom_" + labels[i])
+          rename_element(tree, g, name + "_geom_" + labels[i])
         except IndexError as e:
           print("Index error in add_geom_name:", e)
-          g.set("name", name + "_geom_" + str(i))
+          rename_element(tree, g, name + "_geom_" + str(i))
         num += 1
     return
 
   # add the geom label only to bodies that match the parent body name
-  for t in tags:
-    if t.attrib["name"] == parent_body:
-      geoms = t.findall("geom")
-      for i, g in enumerate(geoms):
-
-        # set the name to a given template
-        g.set("name", parent_body + "_geom_" + labels[i])
+  for t in find_named(tree, "body", parent_body):
+    geoms = t.findall("geom")
+    for i, g in enumerate(geoms):
 
-        # also set the friction
-        g.set("friction")
+      # set the name to a given template
+      rename_element(tree, g, t.attrib["name"] + "_geom_" + labels[i])
 
 def add_finger_geom_name_and_friction(tree, parent_body, friction):
   """
   Adds a name to finger segment collision geoms, as well as friction which should
-  be given in the form "1 0.001 0.0005"
+  be given in the form "1 0.001 0.0005". The parent_body can be a list of body
+  names to edit many bodies at once
   """
 
-  # now get the root of the tree
-  root = tree.getroot()
-
-  # search recursively for all instances of the tag
-  tags = root.findall(".//" + "body")
-
   # special case if we want to name every single geom
   if parent_body == "@all":
     num = 0
-    for t in tags:
+    for t in tree.getroot().findall(".//" + "body"):
       geoms = t.findall("geom")
       for g in geoms:
-        g.set("name", "geom_" + str(num))
+        rename_element(tree, g, "geom_" + str(num))
         num += 1
     return
 
@@ -589,33 +670,41 @@ def add_finger_geom_name_and_friction(tree, parent_body, friction):
   labels = ["visual", "collision", "hook_visual", "hook_collision"]
 
   # add the geom label only to bodies that match the parent body name
-  for t in tags:
-    if t.attrib["name"] == parent_body:
-      geoms = t.findall("geom")
-      for i, g in enumerate(geoms):
+  for t in find_named(tree, "body", parent_body):
+    geoms = t.findall("geom")
+    for i, g in enumerate(geoms):
 
-        # set the name to a given template
-        g.set("name", parent_body + "_geom_" + labels[i])
+      # set the name to a given template
+      rename_element(tree, g, t.attrib["name"] + "_geom_" + labels[i])
 
-        # also set the friction
-        g.set("friction", friction)
+      # also set the friction
+      g.set("friction", friction)
 
-def random_object_split(asset_tree, object_tree, detail_tree, obj_per_task):
+def random_object_split(asset_tree, object_tree, detail_tree, obj_per_task,
+                        rng=np.random, shuffle_objects=True):
   """
-  Randomly split the total number of objects into num new seperate files
+  Randomly split the total number of objects into num new seperate files. The
+  shuffle is drawn from rng (eg a seeded np.random.RandomState). This yields
+  one split at a time as its [asset, object] elements, which are the elements
+  of the input trees and not copies, and a record of the objects in the split
+  giving their name, size and keyframe qpos
   """
 
-  # create blank trees
-  blankroot = """<mujoco></mujoco>"""
-  blanktree = etree.fromstring(blankroot)
-
-  # get the roots of the input trees
+  # get the children of the input trees as lists, lxml indexing walks the children
   asset_root = asset_tree.getroot()
-  object_root = object_tree.getroot()
-  detail_root = detail_tree.getroot()
+  object_root = list(object_tree.getroot())
+  detail_root = list(detail_tree.getroot())
+
+  # group the assets of each object, a simplified collision mesh follows its object mesh
+  asset_groups = []
+  for asset in asset_root:
+    if asset_groups and asset.get("name") == asset_groups[-1][0].get("name") + "_collision":
+      asset_groups[-1].append(asset)
+    else:
+      asset_groups.append([asset])
 
   # how many total objects are there
-  num_obj = len(asset_root.getchildren())
+  num_obj = len(asset_groups)
 
   # determine how many splits we need
   num_splits = int(np.ceil(num_obj / float(obj_per_task)))
@@ -624,16 +713,9 @@ def random_object_split(asset_tree, object_tree, detail_tree, obj_per_task):
   print("There are", num_obj, "objects, with", 
     obj_per_task, "per task, giving", num_splits, "splits")
 
-  # create copies of the trees
-  trees = []
-  for i in range(num_splits):
-    trees.append(
-      [deepcopy(blanktree), deepcopy(blanktree), ""]
-    )
-
   # for testing: compare asset/object numbers (object should be +1 for ground)
   if debug:
-    other_num = len(object_root.getchildren())
+    other_num = len(object_root)
     print("number of assets is", num_obj)
     print("number of objects is", other_num)
 
@@ -644,7 +726,7 @@ def random_object_split(asset_tree, object_tree, detail_tree, obj_per_task):
   # create shuffled random list of every object
   rand_lists = np.arange(num_obj)
   if shuffle_objects:
-    np.random.shuffle(rand_lists)
+    rng.shuffle(rand_lists)
 
   # get the qpos info, split into individual numbers
   qpos_str = " {0} {1} {2} {3} {4} {5} {6}"
@@ -686,10 +768,12 @@ def random_object_split(asset_tree, object_tree, detail_tree, obj_per_task):
     "ellipses" : 0
   }
 
-  # loop through the num of objects per split and assemble trees and qpos
+  # loop through the num of objects per split and assemble elements and qpos
   for i in range(num_splits):
 
-    custom_xml = """"""
+    asset_elements = []
+    object_elements = []
+    split = []
 
     for j in range(obj_per_task):
 
@@ -699,8 +783,8 @@ def random_object_split(asset_tree, object_tree, detail_tree, obj_per_task):
         break
 
       r = rand_lists[i * obj_per_task + j]
-      trees[i][0].append(deepcopy(asset_root[r]))
-      trees[i][1].append(deepcopy(object_root[r]))
+      asset_elements += asset_groups[r]
+      object_elements.append(object_root[r])
       
       # get the z_rest from the detail tree
       z_rest = detail_root[r].attrib["z_rest"]
@@ -709,24 +793,22 @@ def random_object_split(asset_tree, object_tree, detail_tree, obj_per_task):
       z_rest_padding = 1e-4
       z_rest = str(float(z_rest) + z_rest_padding)
 
-      # create the qpos for this object
-      trees[i][2] += qpos_str.format(
-        object_X[j],
-        object_Y[j],
-        z_rest,
-        0,
-        0,
-        0,
-        1
-      )
-
-      # test adding custom numeric fields for object xyz
-      custom_xml += object_customs.format(
-        f"Task object {j}",
-        detail_root[r].attrib["x"],
-        detail_root[r].attrib["y"],
-        detail_root[r].attrib["z"],
-      )
+      # create the qpos for this object, and save its size for custom numeric fields
+      split.append({
+        "name" : object_root[r].attrib["name"],
+        "index" : int(r),
+        "size" : [detail_root[r].attrib["x"], detail_root[r].attrib["y"],
+                  detail_root[r].attrib["z"]],
+        "qpos" : qpos_str.format(
+          object_X[j],
+          object_Y[j],
+          z_rest,
+          0,
+          0,
+          0,
+          1
+        )
+      })
 
       # for debugging the category breakdown of test objects
       if i < test_num_for_debug:
@@ -745,17 +827,28 @@ def random_object_split(asset_tree, object_tree, detail_tree, obj_per_task):
             # print(t)
             print(r, "|", t.attrib["mass"])
 
-    # test the new details
-    global all_object_customs
-    all_object_customs.append(custom_xml)
-
     # now add the ground plane (we assume its the last entry)
-    trees[i][1].append(deepcopy(object_root[-1]))
+    object_elements.append(object_root[-1])
+
+    yield [asset_elements, object_elements], split
 
   if print_test_categories:
     print_categories(category_count)
 
-  return trees
+def get_split_xml(split):
+  """
+  Get the keyframe qpos and the custom numeric xml for the objects in one
+  split, from its record made by random_object_split()
+  """
+
+  qpos = ""
+  custom_xml = """"""
+
+  for j, obj in enumerate(split):
+    qpos += obj["qpos"]
+    custom_xml += object_customs.format(f"Task object {j}", *obj["size"])
+
+  return qpos, custom_xml
 
 def print_categories(count_dict):
   """
@@ -776,13 +869,162 @@ def print_categories(count_dict):
 
 # ----- execute scripting to insert xml snippets into files ----- #
 
-if __name__ == "__main__":
- 
+def load_object_trees(objects_dir):
   """
-  This script opens a given xml file, saves the tree, and then makes some
-  changes to it. The new tree then overwrites the old tree and the file is
-  saved. The lxml module is used, which preserves comments and ordering, so
-  the new file should look identical to the old file except the changes.
+  Parse the assets.xml, objects.xml and details.xml of an object set. These can
+  be given to build_task_files() so that many grippers reuse the same parse
+  """
+
+  parser = etree.XMLParser(remove_comments=True)
+  asset_tree = etree.parse(objects_dir + "/" + "assets.xml", parser=parser)
+  object_tree = etree.parse(objects_dir + "/" + "objects.xml", parser=parser)
+  detail_tree = etree.parse(objects_dir + "/" + "details.xml", parser=parser)
+
+  return asset_tree, object_tree, detail_tree
+
+def write_if_changed(filename, data):
+  """
+  Write bytes to a file only if its contents differ, so that unchanged files
+  keep their modification time. Returns True if the file was written
+  """
+  if os.path.exists(filename) and os.path.getsize(filename) == len(data):
+    with open(filename, "rb") as file:
+      if file.read() == data: return False
+  with open(filename, "wb") as outfile:
+    outfile.write(data)
+  return True
+
+def split_object_set(object_details, objects_dir, object_trees=None):
+  """
+  Randomly split the object set into the assets_i.xml and objects_i.xml files
+  for each task, and save a record of the split in splits.yaml. This depends
+  only on the object set, so it is done once and shared by every gripper
+  """
+
+  # do we have a fixed random seed (so test set fixed)
+  rand_seed = object_details["settings"].get("fixed_random_seed", 0)
+  shuffle_objects = object_details["settings"].get("random_order", True)
+  if rand_seed == 0: rand_seed = np.random.randint(0, 2147483647)
+  rng = np.random.RandomState(rand_seed)
+
+  if debug:
+    print("The random seed is:", rand_seed, "yaml value = ", object_details['settings'].get('fixed_random_seed', 0))
+
+  if object_trees is None:
+    object_trees = load_object_trees(objects_dir)
+  asset_tree, object_tree, detail_tree = object_trees
+
+  assetN_filename = objects_dir + "/" + asset_split_filename
+  objectN_filename = objects_dir + "/" + object_split_filename
+  os.makedirs(os.path.dirname(assetN_filename), exist_ok=True)
+  os.makedirs(os.path.dirname(objectN_filename), exist_ok=True)
+
+  # split the files into equal parts with a given number of objects per task,
+  # writing each split as soon as it is made, unless the file is unchanged
+  splits = []
+  with span("write object splits", category="files"):
+    for i, (split_elements, split) in enumerate(
+        random_object_split(asset_tree, object_tree, detail_tree,
+                            max_objects_per_task, rng=rng,
+                            shuffle_objects=shuffle_objects)):
+
+      for elements, filename in zip(split_elements, [assetN_filename, objectN_filename]):
+        buffer = io.BytesIO()
+        with etree.xmlfile(buffer) as xf:
+          with xf.element("mujoco"):
+            for element in elements:
+              xf.write(element)
+        write_if_changed(filename.format(i), buffer.getvalue())
+
+      splits.append(split)
+
+    # remove the files of any splits beyond the last one
+    for filename in [assetN_filename, objectN_filename]:
+      i = len(splits)
+      while os.path.exists(filename.format(i)):
+        os.remove(filename.format(i))
+        i += 1
+
+    with open(objects_dir + "/" + splits_file, "w") as outfile:
+      yaml.dump(splits, outfile, Dumper=yaml_dumper)
+
+  with span("index object splits"):
+    index_object_splits(objects_dir, splits)
+  with span("save task objects", category="files"):
+    save_task_objects(objects_dir, splits, object_tree, detail_tree)
+
+  return splits
+
+def save_task_objects(objects_dir, splits, object_tree, detail_tree):
+  """
+  Save the size, z_rest, spawn qpos, mass and friction of the object in each
+  split and slot as a numpy structured array of shape (splits, slots). Load it
+  with load_task_objects(), which memory maps it so that many processes can
+  share one copy
+  """
+
+  num_slots = max([len(x) for x in splits] + [0])
+  task_objects = np.zeros((len(splits), num_slots), dtype=task_object_dtype)
+
+  # names can repeat, so take the elements at the catalogue index of each slot
+  object_root = list(object_tree.getroot())
+  detail_root = list(detail_tree.getroot())
+
+  for i, split in enumerate(splits):
+    for j, obj in enumerate(split):
+      body, detail = object_root[obj["index"]], detail_root[obj["index"]]
+      task_objects[i, j] = (
+        True, obj["name"], [float(x) for x in obj["size"]], float(detail.get("z_rest")),
+        [float(x) for x in obj["qpos"].split()], float(body.find("inertial").get("mass")),
+        [float(x) for x in body.find("geom").get("friction").split()]
+      )
+
+  # written in full before replacing any previous file
+  filename = objects_dir + "/" + task_objects_filename
+  with open(filename + ".incomplete", "wb") as outfile:
+    np.save(outfile, task_objects)
+  os.replace(filename + ".incomplete", filename)
+
+def load_task_objects(objects_dir, mmap_mode="r"):
+  """
+  Load the task objects array saved by save_task_objects(), indexed by
+  [split, slot], memory mapped read only by default
+  """
+  return np.load(objects_dir + "/" + task_objects_filename, mmap_mode=mmap_mode)
+
+def index_object_splits(objects_dir, splits):
+  """
+  Record the split and slot of every object in the SQLite object index of the
+  set, if it has one. Rows are matched by their catalogue index, as names can
+  repeat
+  """
+
+  if not os.path.exists(objects_dir + "/" + object_index_filename): return
+
+  db = sqlite3.connect(objects_dir + "/" + object_index_filename)
+  db.execute("UPDATE objects SET split = NULL, slot = NULL")
+  db.executemany("UPDATE objects SET split = ?, slot = ? WHERE idx = ?",
+                 [(i, j, obj["index"]) for i, split in enumerate(splits)
+                  for j, obj in enumerate(split)])
+  db.commit()
+  db.close()
+
+def load_splits(objects_dir):
+  """
+  Load the record of an object set split saved by split_object_set()
+  """
+  with open(objects_dir + "/" + splits_file) as file:
+    return yaml.load(file, Loader=yaml_loader)
+
+def build_task_files(gripper_details, object_details, build_dir, task_folder="task",
+                     objects_folder="objects", generate_objects=True, object_trees=None,
+                     splits=None, shared_robot=False, tag_robots=True):
+  """
+  This function opens the mjcf files in build_dir, saves the tree, and then
+  makes some changes to it. The new tree then overwrites the old tree and the
+  file is saved. The lxml module is used, which preserves comments and
+  ordering, so the new file should look identical to the old file except the
+  changes.
 
   The idea is to take mujoco xml files (mjcf files), open their xml tree,
   and then insert some extra bits and pieces.
@@ -792,49 +1034,100 @@ if __name__ == "__main__":
     - panda contains the panda only
     - both contains both the gripper and the panda
     - task contains the gripper fixed above the ground, ready for grasping
+
+  The gripper and object settings are given as dictionaries (as loaded from
+  config/gripper.yaml and define_objects.yaml). If generate_objects is True the
+  object set is split first with split_object_set(), using object_trees (the
+  already parsed output of load_object_trees(), which is never modified) if
+  given. Otherwise the existing split is used, either given as splits or
+  loaded from splits.yaml, and only the task and keyframe files are written.
+
+  If shared_robot is True the robot (assets, bodies, actuators, sensors,
+  equality constraints and custom fields) is saved once into shared_robot.xml
+  in the task folder, and each task file is a small shell which includes it
+  alongside the object split and keyframe for that task.
+
+  If tag_robots is False the gripper, panda and both files are not needed, only
+  the task file is read, and it is left unchanged.
   """
 
+  directory_path = os.path.abspath(build_dir) + "/"
+  task_file_folder = task_folder
+
+  if debug:
+    print("Running xml_script.py, debug mode is ON")
+    print("The mjcf directory path is:", directory_path)
+    print("The task folder name is:", task_file_folder)
+    print("Generate objects flag is:", generate_objects)
+
+  # edit the robot files and get the tree of the task file
+  with span("tag robot files"):
+    robot_xml, task_tree = tag_robot_files(gripper_details, directory_path, tag_robots)
+
+  # ----- now we split the task tree into multiple files (each with fewer objects) ----- #
+
+  # split the objects into files with a given number of objects per task, or reuse the split
+  if generate_objects:
+    with span("split objects"):
+      splits = split_object_set(object_details, directory_path + objects_folder, object_trees)
+  elif splits is None:
+    with span("load splits"):
+      splits = load_splits(directory_path + objects_folder)
+
+  with span("write task files", category="files"):
+    write_task_files(task_tree, robot_xml, splits, directory_path, task_folder=task_file_folder,
+                     objects_folder=objects_folder, shared_robot=shared_robot)
+
+def tag_robot_files(gripper_details, build_dir, tag_robots=True):
+  """
+  Add the keyframes, actuators, sensors, camera, equality constraints, joint
+  stiffnesses and geom names for this gripper configuration to the mjcf files
+  in build_dir. The gripper, panda and both files are overwritten, the edited
+  task tree is returned with the robot xml snippets for writing the task files.
+  If tag_robots is False only the task file is read (and left unchanged)
+  """
+
+  directory_path = os.path.abspath(build_dir) + "/"
+
+  # create the xml snippets for this gripper configuration
+  robot_xml = get_robot_xml(gripper_details)
+  num_segments = robot_xml["num_segments"]
+  fixed_first_segment = robot_xml["fixed_first_segment"]
+
   # define the names of the base xml files we will be editing
   gripper_filename = directory_path + "gripper_mujoco.xml"
   panda_filename = directory_path + "panda_mujoco.xml"
   both_filename = directory_path + "panda_and_gripper_mujoco.xml"
   task_filename = directory_path + "gripper_task.xml"
 
-  # define the names of object files we will open
-  asset_filename = directory_path + objects_folder + "/" + "assets.xml"
-  object_filename = directory_path + objects_folder + "/" + "objects.xml"
-  detail_filename = directory_path + objects_folder + "/" + "details.xml"
-
-  # define the names of files we will make when we split tasks and objects
-  asset_split_filename = "assets/assets_{}.xml"
-  object_split_filename = "objects/objects_{}.xml"
-  keyframe_split_filename = "keyframes/keyframe_{}.xml"
-  task_split_filename = task_file_folder + "/gripper_task_{}.xml"
-  taskN_filename = directory_path + "/" + task_split_filename
-  assetN_filename = directory_path + objects_folder + "/" + asset_split_filename
-  objectN_filename = directory_path + objects_folder + "/" + object_split_filename
-  keyframeN_filename = directory_path + task_file_folder + "/" + keyframe_split_filename
-
   # parse and extract the xml tree for each file we want to use
   parser = etree.XMLParser(remove_comments=True)
-  gripper_tree = etree.parse(gripper_filename, parser=parser)
-  panda_tree = etree.parse(panda_filename, parser=parser)
-  both_tree = etree.parse(both_filename, parser=parser)
   task_tree = etree.parse(task_filename, parser=parser)
-  asset_tree = etree.parse(asset_filename, parser=parser)
-  object_tree = etree.parse(object_filename, parser=parser)
-  detail_tree = etree.parse(detail_filename, parser=parser)
+  if tag_robots:
+    gripper_tree = etree.parse(gripper_filename, parser=parser)
+    panda_tree = etree.parse(panda_filename, parser=parser)
+    both_tree = etree.parse(both_filename, parser=parser)
+    robot_trees = [gripper_tree, panda_tree, both_tree, task_tree]
+  else:
+    robot_trees = [task_tree]
+
+  # index the named elements of each tree for fast lookups while editing
+  for tree in robot_trees:
+    index_names(tree)
+
+  if tag_robots:
 
-  # add the keyframe information to each
-  add_chunk(gripper_tree, "@root", gripper_keyframe)
-  add_chunk(panda_tree, "@root", panda_keyframe)
-  add_chunk(both_tree, "@root", panda_and_gripper_keyframe)
+    # add the keyframe information to each
+    add_chunk(gripper_tree, "@root", robot_xml["gripper_keyframe"])
+    add_chunk(panda_tree, "@root", robot_xml["panda_keyframe"])
+    add_chunk(both_tree, "@root", robot_xml["panda_and_gripper_keyframe"])
 
-  # add the actuator information to each
-  add_chunk(gripper_tree, "@root", gripper_actuator)
-  add_chunk(panda_tree, "@root", panda_actuator)
-  add_chunk(both_tree, "@root", panda_and_gripper_actuator)
-  add_chunk(task_tree, "@root", task_actuator)
+    # add the actuator information to each
+    add_chunk(gripper_tree, "@root", robot_xml["gripper_actuator"])
+    add_chunk(panda_tree, "@root", robot_xml["panda_actuator"])
+    add_chunk(both_tree, "@root", robot_xml["panda_and_gripper_actuator"])
+
+  add_chunk(task_tree, "@root", robot_xml["task_actuator"])
 
   # add force sensor to the gripper body
   add_chunk_with_specific_attribute(task_tree, "body", "name",
@@ -843,10 +1136,10 @@ if __name__ == "__main__":
 
   # add depth camera to gripper (only in gripper_task)
   add_chunk_with_specific_attribute(task_tree, "body", "name",
-                                    "gripper_base_link", depth_camera)
+                                    "gripper_base_link", robot_xml["depth_camera"])
 
   # add equality constraints to gripper task for non-backdriveable joints
-  add_chunk(task_tree, "@root", equality_constraints)
+  add_chunk(task_tree, "@root", robot_xml["equality_constraints"])
 
   # now add in finger joint stiffnesses
   tag_string = "finger_{0}_segment_joint_{1}"
@@ -858,60 +1151,106 @@ if __name__ == "__main__":
   ffs = 1 if fixed_first_segment else 0
   dummy_finger_stiffness = 5 # set a value, this should be overwritten at mujoco runtime
 
-  for i in range(3):
-
-    # # experiment: add joint friction
-    # next_rev = "finger_{0}_revolute_joint".format(i)
-    # next_pris = "finger_{0}_prismatic_joint".format(i)
-    # add_tag_attribute(task_tree, "joint", next_rev, "frictionloss", str(1))
-    # add_tag_attribute(task_tree, "joint", next_pris, "frictionloss", str(1))
-    # raise RuntimeError("joint friction not tested out yet!!!")
-
-    # loop through each finger segment and add xml tags/attributes
-    for j in range(num_segments):
-
-      # names of the finger segment joint and body
-      next_joint = tag_string.format(i + 1, j + ffs)
-      next_body = body_string.format(i + 1, j + ffs + 1)
-
-      # add finger stiffness attributes
-      add_tag_attribute(gripper_tree, "joint", next_joint,
-                        "stiffness", str(dummy_finger_stiffness))
-      add_tag_attribute(both_tree, "joint", next_joint,
-                        "stiffness", str(dummy_finger_stiffness))
-      add_tag_attribute(task_tree, "joint", next_joint,
-                        "stiffness", str(dummy_finger_stiffness))
-                    
-      # add geom names
-      add_finger_geom_name_and_friction(task_tree, next_body, finger_segment_friction)
+  # # experiment: add joint friction
+  # next_rev = ["finger_{0}_revolute_joint".format(i) for i in range(3)]
+  # next_pris = ["finger_{0}_prismatic_joint".format(i) for i in range(3)]
+  # add_tag_attribute(task_tree, "joint", next_rev, "frictionloss", str(1))
+  # add_tag_attribute(task_tree, "joint", next_pris, "frictionloss", str(1))
+  # raise RuntimeError("joint friction not tested out yet!!!")
+
+  # names of every finger segment joint and body
+  segment_joints = [tag_string.format(i + 1, j + ffs)
+                    for i in range(3) for j in range(num_segments)]
+  segment_bodies = [body_string.format(i + 1, j + ffs + 1)
+                    for i in range(3) for j in range(num_segments)]
+
+  # add finger stiffness attributes
+  for tree in [gripper_tree, both_tree, task_tree] if tag_robots else [task_tree]:
+    add_tag_attribute(tree, "joint", segment_joints,
+                      "stiffness", str(dummy_finger_stiffness))
+
+  # add geom names
+  add_finger_geom_name_and_friction(task_tree, segment_bodies, finger_segment_friction)
 
   # add palm geom names
   add_finger_geom_name_and_friction(task_tree, "palm", finger_segment_friction)
 
   # finally, overwrite the files with the new xml
-  gripper_tree.write(gripper_filename, xml_declaration=True, encoding='utf-8')
-  panda_tree.write(panda_filename, xml_declaration=True, encoding='utf-8')
-  both_tree.write(both_filename, xml_declaration=True, encoding='utf-8')
+  if tag_robots:
+    gripper_tree.write(gripper_filename, xml_declaration=True, encoding='utf-8')
+    panda_tree.write(panda_filename, xml_declaration=True, encoding='utf-8')
+    both_tree.write(both_filename, xml_declaration=True, encoding='utf-8')
 
-  # ----- now we split the task tree into multiple files (each with fewer objects) ----- #
+  # the robot trees are no longer edited by name
+  for tree in robot_trees:
+    forget_names(tree)
+
+  return robot_xml, task_tree
+
+def write_task_files(task_tree, robot_xml, splits, build_dir, task_folder="task",
+                     objects_folder="objects", shared_robot=False):
+  """
+  Write one task file and keyframe file for each object split into the task
+  folder of build_dir, each a copy of the tagged task tree (or a shell which
+  includes shared_robot.xml) with the includes and keyframe of its split
+  """
+
+  directory_path = os.path.abspath(build_dir) + "/"
+  task_file_folder = task_folder
 
-  # split the files into equal parts with a given number of objects per task
-  taskN_trees = random_object_split(asset_tree, object_tree, detail_tree, max_objects_per_task)
+  # define the names of files we will make for each task
+  task_split_filename = task_file_folder + "/gripper_task_{}.xml"
+  taskN_filename = directory_path + "/" + task_split_filename
+  keyframeN_filename = directory_path + task_file_folder + "/" + keyframe_split_filename
+
+  # ensure the output folders exist (the Makefile creates them for the command line)
+  for folder in [os.path.dirname(taskN_filename), os.path.dirname(keyframeN_filename)]:
+    os.makedirs(folder, exist_ok=True)
+
+  # a nice background to put in
+  blue_sky = """<texture type="skybox" builtin="gradient" rgb1=".3 .5 .7" rgb2="0 0 0" width="32" height="512"/>"""
+  robot_custom_fields = robot_xml["custom_fields"]
+
+  # save the robot once, every task file then includes it
+  if shared_robot:
+    robot_tree = deepcopy(task_tree)
+    robot_root = robot_tree.getroot()
+    compiler = robot_root.find("compiler")
+    robot_root.remove(compiler)
+    if use_sky:
+      add_chunk(robot_tree, "asset", blue_sky)
+    add_chunk(robot_tree, "@root", """<custom> {0} </custom>""".format(robot_custom_fields))
+    robot_tree.write(directory_path + task_file_folder + "/" + shared_robot_filename)
+    robot_custom_fields = ""
 
   # for each split, perform the formatting as above and save as a new file
-  for i in range(len(taskN_trees)):
+  for i in range(len(splits)):
+
+    # get the keyframe qpos and custom numeric fields for the objects in this split
+    objects_qpos, object_custom_fields = get_split_xml(splits[i])
+
+    if shared_robot:
+
+      # create a shell which includes the robot
+      taskN_tree = etree.ElementTree(etree.Element("mujoco", task_tree.getroot().attrib))
+      taskN_tree.getroot().append(deepcopy(compiler))
+      robot_include = """<include file="../{0}/{1}"/>""".format(task_file_folder, shared_robot_filename)
+      add_chunk(taskN_tree, "@root", robot_include)
+      add_chunk(taskN_tree, "@root", """<asset></asset>""")
+      add_chunk(taskN_tree, "@root", """<worldbody></worldbody>""")
 
-    # create a copy which we will edit
-    taskN_tree = deepcopy(task_tree)
+    else:
+
+      # create a copy which we will edit
+      taskN_tree = deepcopy(task_tree)
+
+      # put a nice background in
+      if use_sky:
+        add_chunk(taskN_tree, "asset", blue_sky)
 
     # edit the meshdir because the tasks are in the /task directory
     modify_tag_attribute(taskN_tree, "compiler", "meshdir", "../meshes_mujoco")
 
-    # put a nice background in
-    if use_sky:
-      blue_sky = """<texture type="skybox" builtin="gradient" rgb1=".3 .5 .7" rgb2="0 0 0" width="32" height="512"/>"""
-      add_chunk(taskN_tree, "asset", blue_sky)
-
     # create xml text for specefic includes and add them to the tree
     objectN_includes = """<include file="../{0}/{1}"/>""".format(objects_folder, object_split_filename.format(i))
     assetN_include = """<include file="../{0}/{1}"/>""".format(objects_folder, asset_split_filename.format(i))
@@ -921,7 +1260,7 @@ if __name__ == "__main__":
     add_chunk(taskN_tree, "@root", keyframeN_include)
 
     # add in the custom numeric fields
-    task_custom_fields = """<custom> {0} {1} </custom>""".format(custom_fields, all_object_customs[i])
+    task_custom_fields = """<custom> {0} {1} </custom>""".format(robot_custom_fields, object_custom_fields)
     add_chunk(taskN_tree, "@root", task_custom_fields)
 
     # write the split task files into the task folder
@@ -930,18 +1269,238 @@ if __name__ == "__main__":
     # make a keyframe snippet to be saved in a seperate file
     keyframe_tree = etree.ElementTree(etree.Element("mujoco"))
     add_chunk(keyframe_tree, "@root", 
-        task_keyframe.format(base_joint_qpos, gripper_qpos, taskN_trees[i][2]))
+        task_keyframe.format(robot_xml["base_joint_qpos"], robot_xml["gripper_qpos"], objects_qpos))
 
     # write the keyframe inside the task folder
     keyframe_tree.write(keyframeN_filename.format(i))
 
-    # if generating object set, write to the assets.xml files etc
-    if generate_objects:
+# ----- compile the task files into mujoco binary models ----- #
 
-      # create element trees from the split
-      new_asset_tree = etree.ElementTree(taskN_trees[i][0])
-      new_object_tree = etree.ElementTree(taskN_trees[i][1])
+def get_file_digest(path, digests=None):
+  """
+  Get the sha256 digest of a file, remembered in digests (a dict) if given
+  """
 
-      new_asset_tree.write(assetN_filename.format(i))
-      new_object_tree.write(objectN_filename.format(i))
-      
+  if digests is not None and path in digests: return digests[path]
+
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      h.update(chunk)
+  digest = h.hexdigest()
+
+  if digests is not None: digests[path] = digest
+  return digest
+
+def get_task_includes(task_filename):
+  """
+  Get a task file and every file it includes (recursively) as (name, path)
+  pairs, where name is the file attribute as written, which mujoco resolves
+  relative to the directory of the task file. Also returns the parsed roots
+  """
+
+  model_dir = os.path.dirname(os.path.abspath(task_filename))
+  parser = etree.XMLParser(remove_comments=True)
+
+  includes = [(os.path.basename(task_filename), os.path.abspath(task_filename))]
+  roots = []
+
+  i = 0
+  while i < len(includes):
+    root = etree.parse(includes[i][1], parser=parser).getroot()
+    roots.append(root)
+    i += 1
+    for e in root.iter("include"):
+      includes.append((e.get("file"), os.path.normpath(os.path.join(model_dir, e.get("file")))))
+
+  return includes, roots
+
+def get_task_inputs(task_filename):
+  """
+  Get every file a task file depends on: the task file itself, the files it
+  includes (recursively) and the mesh and texture files they reference. Paths
+  are resolved as mujoco does, relative to the directory of the task file
+  """
+
+  model_dir = os.path.dirname(os.path.abspath(task_filename))
+  includes, roots = get_task_includes(task_filename)
+
+  inputs = [path for name, path in includes]
+  asset_dirs = {"meshdir": model_dir, "texturedir": model_dir}
+  elements = []
+
+  for root in roots:
+    for e in root.iter(tag=etree.Element):
+      if e.tag == "compiler":
+        for key in asset_dirs:
+          if e.get(key) is not None:
+            asset_dirs[key] = os.path.join(model_dir, e.get(key))
+      elif e.tag != "include" and e.get("file") is not None:
+        elements.append(e)
+
+  # then add the asset files, once the compiler asset directories are known
+  for e in elements:
+    asset_dir = asset_dirs["meshdir"] if e.tag == "mesh" else asset_dirs["texturedir"]
+    path = os.path.normpath(os.path.join(asset_dir, e.get("file")))
+    if path not in inputs: inputs.append(path)
+
+  return inputs
+
+def bundle_task_files(build_dir, task_folder="task", remove_files=True):
+  """
+  Pack every gripper_task_{i}.xml in the task folder, with the files it
+  includes, into one task bundle (see task_bundle.py), so that reading a task
+  takes one seek and one read. If remove_files the bundled task, keyframe and
+  shared robot files are then deleted from the task folder
+  """
+
+  task_dir = os.path.abspath(build_dir) + "/" + task_folder
+
+  tasks = []
+  bundled = []
+  i = 0
+  while os.path.exists(task_dir + "/gripper_task_{}.xml".format(i)):
+    includes, roots = get_task_includes(task_dir + "/gripper_task_{}.xml".format(i))
+    files = []
+    for name, path in includes:
+      with open(path, "rb") as file:
+        files.append((name, file.read()))
+      bundled.append(path)
+    tasks.append((includes[0][0], files))
+    i += 1
+
+  write_bundle(task_dir + "/" + bundle_filename, tasks,
+               meta={"task_folder": task_folder, "num_tasks": len(tasks)})
+
+  # the object splits are shared by other grippers, only remove this gripper's files
+  if remove_files:
+    for path in set(bundled):
+      if (os.path.dirname(path) + "/").startswith(task_dir + "/") and os.path.exists(path):
+        os.remove(path)
+    if os.path.isdir(task_dir + "/keyframes") and not os.listdir(task_dir + "/keyframes"):
+      os.rmdir(task_dir + "/keyframes")
+
+  print("Bundled", len(tasks), "task files into", task_dir + "/" + bundle_filename)
+
+def compile_task_files(build_dir, task_folder="task", compiler="compile", digests=None):
+  """
+  Compile every gripper_task_{i}.xml in the task folder into a mujoco binary
+  model, gripper_task_{i}.mjb, and save a manifest (mjb_manifest.yaml) mapping
+  each task index to its .mjb file and the digest of all its inputs.
+
+  The compiler is either the path to an executable called as
+  'compiler input.xml output.mjb' (eg bin/compile from mujoco), or a python
+  function with the same arguments. Tasks whose input digest matches the
+  existing manifest are not compiled again. Returns the manifest
+  """
+
+  task_dir = os.path.abspath(build_dir) + "/" + task_folder
+  manifest_filename = task_dir + "/" + mjb_manifest_filename
+  if digests is None: digests = {}
+
+  # the compiler is an input too
+  if callable(compiler):
+    compiler_id = compiler.__module__ + "." + compiler.__name__
+  else:
+    compiler_path = shutil.which(compiler) or compiler
+    compiler_id = get_file_digest(compiler_path, digests)
+
+  old_manifest = {}
+  if os.path.exists(manifest_filename):
+    with open(manifest_filename) as file:
+      old_manifest = yaml.safe_load(file) or {}
+
+  manifest = {}
+  i = 0
+  while os.path.exists(task_dir + "/gripper_task_{}.xml".format(i)):
+
+    xml_filename = "gripper_task_{}.xml".format(i)
+    mjb_filename = "gripper_task_{}.mjb".format(i)
+
+    h = hashlib.sha256(compiler_id.encode())
+    for path in get_task_inputs(task_dir + "/" + xml_filename):
+      h.update(os.path.relpath(path, task_dir).encode())
+      h.update(get_file_digest(path, digests).encode())
+    digest = h.hexdigest()
+
+    # only compile if the inputs have changed
+    if (old_manifest.get(i, {}).get("digest") != digest
+        or not os.path.exists(task_dir + "/" + mjb_filename)):
+      with span("compile mjb", category="subprocess", task=i) as trace:
+        if callable(compiler):
+          compiler(task_dir + "/" + xml_filename, task_dir + "/" + mjb_filename)
+        else:
+          result = subprocess.run([compiler_path, task_dir + "/" + xml_filename,
+                                   task_dir + "/" + mjb_filename],
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+          if result.returncode != 0 or not os.path.exists(task_dir + "/" + mjb_filename):
+            raise RuntimeError(f"compiling {xml_filename} failed:\n{result.stdout}")
+          trace["bytes"] += os.path.getsize(task_dir + "/" + mjb_filename)
+
+    manifest[i] = {"xml" : xml_filename, "mjb" : mjb_filename, "digest" : digest}
+    i += 1
+
+  # remove binaries left over from a previous build with more tasks
+  mjb_files = [x["mjb"] for x in manifest.values()]
+  for name in os.listdir(task_dir):
+    if name.endswith(".mjb") and name not in mjb_files:
+      os.remove(task_dir + "/" + name)
+
+  with open(manifest_filename, "w") as outfile:
+    yaml.safe_dump(manifest, outfile)
+
+  print("Compiled", len(manifest), "task files into .mjb files in", task_dir)
+
+  return manifest
+
+if __name__ == "__main__":
+
+  # define arguments and parse them
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--build-folder",         default="build")
+  parser.add_argument("--objects-folder",       default="objects")
+  parser.add_argument("--task-folder",          default="task")
+  parser.add_argument("--gen-objects",          default=True, type=int) 
+  parser.add_argument("--split-only",           default=False, type=int)
+  parser.add_argument("--shared-robot",         default=False, type=int)
+  parser.add_argument("--mjb",                  default=False, type=int)
+  parser.add_argument("--mjb-compiler",         default="compile")
+  parser.add_argument("--bundle",               default=False, type=int)
+  parser.add_argument("--tag-robots",           default=True, type=int)
+
+  args = parser.parse_args()
+
+  directory_path = filepath + "/" + args.build_folder + "/"
+
+  if debug:
+    print("The gripper description directory path is:", description_path)
+
+  with open(directory_path + args.objects_folder + "/" + define_objects_file) as file:
+    object_details = yaml.safe_load(file)
+
+  # only split the object set, once for all the grippers which will use it
+  if args.split_only:
+    with span("split objects"):
+      split_object_set(object_details, directory_path + args.objects_folder)
+    exit()
+
+  with open(description_path + gripper_config_file) as file:
+    gripper_details = yaml.safe_load(file)
+
+  build_task_files(gripper_details, object_details, directory_path,
+                   task_folder=args.task_folder,
+                   objects_folder=args.objects_folder,
+                   generate_objects=bool(args.gen_objects),
+                   shared_robot=bool(args.shared_robot),
+                   tag_robots=bool(args.tag_robots))
+
+  # compile every task file into a mujoco binary
+  if args.mjb:
+    with span("compile task files"):
+      compile_task_files(directory_path, task_folder=args.task_folder,
+                         compiler=args.mjb_compiler)
+
+  # pack the task files into one bundle, replacing them
+  if args.bundle:
+    with span("bundle task files", category="files"):
+      bundle_task_files(directory_path, task_folder=args.task_folder)